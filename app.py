@@ -1,50 +1,53 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response, Response, send_file
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, timedelta
 import mysql.connector
 import secrets
-from utils.db_connection import get_db_connection
+import importlib
+import time
+import hmac
+import logging
+from utils.bitacora import configurar_logging, estadisticas_logging
+from utils.db_connection import get_db_connection, estadisticas_pool
+from utils.auditoria import escritor_auditoria
+from utils.estadisticas import estadisticas_admin
+from utils.usuarios import listar_usuarios, usuario_a_json
+from utils.busqueda_usuarios import indice_usuarios
+from utils.mensajes import obtener_historial, SALA_GENERAL
+from utils.xmpp_estado import monitor_xmpp
+from utils.salud import monitor_salud
+from utils.ingesta_trafico import buffer_trafico
+from utils.autenticacion import motor_login, IntentosExcedidos
+from utils.referencias import referencias, descripcion_tipo_documento
+from utils.sesiones import interfaz_sesiones, contexto_usuarios, invalidar_usuario
+from utils.exportaciones import (CONJUNTOS, FORMATOS, generar_csv, generar_xlsx, iniciar_flujo,
+                                  nombre_archivo, trabajos_exportacion)
+from utils.metricas import instrumentar_app, consultas_lentas
+from config import CHAT_PUBLIC_URL, LOGS_ACTIVIDAD_RECIENTE_DIAS, INGESTA_TOKENS, INGESTA_MAX_BYTES, PROXY_SALTOS
+
+logger = logging.getLogger(__name__)
+
+# Módulos con pandas/NumPy/scikit-learn: se importan en la primera petición que los usa,
+# o antes del fork con crear_app(precargar_analitica=True) (gunicorn con preload)
+MODULOS_ANALITICA = ("utils.analitica_trafico", "utils.series", "utils.anomalias")
 
 app = Flask(__name__)
 app.secret_key = 'clave_secreta_ucundinamarca_2024_jennifer_leo'
+# La cookie solo lleva un id; nombre, correo, rol y tipo de documento salen de la caché de contexto
+app.session_interface = interfaz_sesiones
+# Detrás del balanceador remote_addr es la IP del proxy: el límite de intentos por IP
+# necesita la del cliente, tomada solo de los saltos de confianza
+if PROXY_SALTOS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_SALTOS, x_proto=PROXY_SALTOS)
 
 def registrar_log_db(usuario_id, accion, detalles=""):
-    """Registra actividad en la base de datos - adaptado a la estructura real"""
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            # La tabla logs_transacciones solo tiene: id, usuario_id, accion, fecha_hora
-            cursor.execute("""
-                INSERT INTO logs_transacciones 
-                (usuario_id, accion) 
-                VALUES (%s, %s)
-            """, (usuario_id, f"{accion}: {detalles}" if detalles else accion))
-            
-            conn.commit()
-            cursor.close()
-            print(f"Log registrado: {accion} - Usuario: {usuario_id}")
-        except Exception as e:
-            print(f"Error registrando log: {e}")
-        finally:
-            conn.close()
+    """Encola la actividad para logs_transacciones; el escritor de auditoría la inserta por lotes"""
+    # La tabla logs_transacciones solo tiene: id, usuario_id, accion, fecha_hora
+    escritor_auditoria.registrar(usuario_id, f"{accion}: {detalles}" if detalles else accion)
 
 def obtener_tipos_documento():
-    """Obtiene los tipos de documento de la base de datos"""
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT id, codigo, descripcion FROM tipos_documento ORDER BY id")
-            tipos = cursor.fetchall()
-            cursor.close()
-            return tipos
-        except Exception as e:
-            print(f"Error obteniendo tipos de documento: {e}")
-            return []
-        finally:
-            conn.close()
-    return []
+    """Tipos de documento desde la caché de tablas de referencia"""
+    return referencias.filas('tipos_documento')
 
 @app.route("/", methods=["GET", "POST"])
 @app.route("/login", methods=["GET", "POST"])
@@ -55,45 +58,34 @@ def login():
         correo = request.form["usuario"]
         contrasena = request.form["contrasena"]
 
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor(dictionary=True)
-            
-            try:
-                # Consulta SIN la columna 'activo' (no existe en tu BD)
-                cursor.execute("""
-                    SELECT u.*, td.descripcion as tipo_documento 
-                    FROM usuarios u 
-                    JOIN tipos_documento td ON u.tipo_documento_id = td.id 
-                    WHERE u.correo = %s
-                """, (correo,))
-                
-                usuario = cursor.fetchone()
-                
-                if usuario and check_password_hash(usuario['contrasena'], contrasena):
-                    session["usuario_id"] = usuario["id"]
-                    session["usuario"] = usuario["nombre"]
-                    session["correo"] = usuario["correo"]
-                    session["rol"] = usuario["rol"]
-                    session["tipo_documento"] = usuario["tipo_documento"]
-                    
-                    registrar_log_db(usuario["id"], "LOGIN", "Inicio de sesión exitoso")
-                    
-                    if usuario["rol"] == "administrador":
-                        return redirect(url_for("admin_dashboard"))
-                    else:
-                        return redirect(url_for("dashboard"))
-                else:
-                    error = "Correo o contraseña incorrectos."
-                    
-            except Exception as e:
-                error = f"Error en el sistema: {e}"
-                print(f"Error detallado: {e}")
-            finally:
-                cursor.close()
-                conn.close()
+        try:
+            usuario = motor_login.autenticar(correo, contrasena, request.remote_addr)
+        except IntentosExcedidos as e:
+            error = "Demasiados intentos de inicio de sesión. Intenta de nuevo en unos minutos."
+            respuesta = make_response(render_template("login.html", error=error), 429)
+            respuesta.headers["Retry-After"] = str(e.reintentar_en)
+            return respuesta
+        except ConnectionError as e:
+            usuario = None
+            error = str(e)
+        except Exception as e:
+            usuario = None
+            error = f"Error en el sistema: {e}"
+            logger.exception("Error detallado: %s", e)
         else:
-            error = "Error de conexión a la base de datos."
+            if not usuario:
+                error = "Correo o contraseña incorrectos."
+
+        if usuario:
+            session["usuario_id"] = usuario["id"]
+            contexto_usuarios.guardar(usuario)
+
+            registrar_log_db(usuario["id"], "LOGIN", "Inicio de sesión exitoso")
+
+            if usuario["rol"] == "administrador":
+                return redirect(url_for("admin_dashboard"))
+            else:
+                return redirect(url_for("dashboard"))
 
     return render_template("login.html", error=error)
 
@@ -125,7 +117,7 @@ def registro():
                     if cursor.fetchone():
                         error = "El correo electrónico ya está registrado."
                     else:
-                        contrasena_hash = generate_password_hash(contrasena)
+                        contrasena_hash = motor_login.generar_hash(contrasena)
                         
                         cursor.execute("""
                             INSERT INTO usuarios 
@@ -135,6 +127,12 @@ def registro():
                         
                         conn.commit()
                         usuario_id = cursor.lastrowid
+                        estadisticas_admin.registrar_usuario('estudiante')
+                        indice_usuarios.agregar({
+                            'id': usuario_id, 'nombre': nombre, 'correo': correo, 'telefono': telefono,
+                            'documento': documento, 'rol': 'estudiante',
+                            'tipo_documento_id': int(tipo_documento_id) if tipo_documento_id else None
+                        })
                         
                         registrar_log_db(usuario_id, "REGISTRO", f"Usuario {nombre} registrado")
                         
@@ -157,7 +155,7 @@ def dashboard():
         return redirect(url_for("login"))
     
     registrar_log_db(session["usuario_id"], "ACCESO_DASHBOARD", "Accedió al panel de usuario")
-    return render_template("dashboard.html", nombre=session["usuario"])
+    return render_template("dashboard.html", nombre=session["usuario"], chat_url=CHAT_PUBLIC_URL)
 
 @app.route("/admin")
 def admin_dashboard():
@@ -165,34 +163,26 @@ def admin_dashboard():
         flash("Acceso restringido al administrador.")
         return redirect(url_for("login"))
     
-    conn = get_db_connection()
-    stats = {}
+    stats = estadisticas_admin.obtener(forzar=request.args.get("recalcular") == "1")
     registros = []
     
+    conn = get_db_connection()
     if conn:
         try:
             cursor = conn.cursor(dictionary=True)
-            
-            cursor.execute("SELECT COUNT(*) as total FROM usuarios")
-            stats['total_usuarios'] = cursor.fetchone()['total']
-            
-            cursor.execute("SELECT COUNT(*) as total FROM mensajes")
-            stats['total_mensajes'] = cursor.fetchone()['total']
-            
-            cursor.execute("SELECT COUNT(*) as hoy FROM logs_transacciones WHERE DATE(fecha_hora) = CURDATE()")
-            stats['actividad_hoy'] = cursor.fetchone()['hoy']
-            
+            # El límite inferior deja la consulta en las particiones recientes de logs_transacciones
             cursor.execute("""
                 SELECT l.*, u.nombre as usuario_nombre 
                 FROM logs_transacciones l 
                 JOIN usuarios u ON l.usuario_id = u.id 
+                WHERE l.fecha_hora >= NOW() - INTERVAL %s DAY
                 ORDER BY l.fecha_hora DESC 
                 LIMIT 20
-            """)
+            """, (LOGS_ACTIVIDAD_RECIENTE_DIAS,))
             registros = cursor.fetchall()
             
         except Exception as e:
-            print(f"Error obteniendo estadísticas: {e}")
+            logger.error("Error obteniendo actividad reciente: %s", e)
         finally:
             cursor.close()
             conn.close()
@@ -206,7 +196,19 @@ def chat():
         return redirect(url_for("login"))
     
     registrar_log_db(session["usuario_id"], "ACCESO_CHAT", "Accedió al sistema de chat")
-    return render_template("chat.html", nombre=session["usuario"])
+    return render_template("chat.html", nombre=session["usuario"], chat_url=CHAT_PUBLIC_URL)
+
+@app.route("/chat/api/historial")
+def api_historial_chat():
+    if "usuario_id" not in session:
+        return jsonify({"error": "Sesión no válida."}), 401
+
+    mensajes, anterior = obtener_historial(
+        sala=request.args.get("sala") or SALA_GENERAL,
+        antes_de=request.args.get("antes_de", type=int),
+        limite=request.args.get("limite", 50, type=int)
+    )
+    return jsonify({"mensajes": mensajes, "anterior": anterior})
 
 @app.route("/logout")
 def logout():
@@ -216,37 +218,79 @@ def logout():
     flash("Sesión cerrada correctamente.", "info")
     return redirect(url_for("login"))
 
+# =========================================================
+# SONDAS DEL BALANCEADOR DE CARGA
+# =========================================================
+
+@app.route("/healthz")
+def healthz():
+    # Solo el proceso: no toca ninguna dependencia
+    respuesta = jsonify(monitor_salud.vida())
+    respuesta.headers["Cache-Control"] = "no-store"
+    return respuesta
+
+@app.route("/readyz")
+def readyz():
+    # Resultado en caché de las verificaciones de fondo (utils/salud.py)
+    datos = monitor_salud.disponibilidad()
+    respuesta = jsonify(datos)
+    respuesta.headers["Cache-Control"] = "no-store"
+    return respuesta, 200 if datos["listo"] else 503
+
 # =========================================================
 # RUTAS PARA LOS MÓDULOS ADMIN
 # =========================================================
 
+def _filtros_usuarios():
+    """Filtros del listado de usuarios tomados de la query string"""
+    return {
+        "rol": request.args.get("rol") or None,
+        "tipo_documento_id": request.args.get("tipo_documento", type=int),
+        "prefijo": request.args.get("q") or None,
+        "limite": request.args.get("limite", 50, type=int),
+    }
+
 @app.route("/admin/usuarios")
 def gestion_usuarios():
     if "usuario_id" not in session or session.get("rol") != "administrador":
         flash("Acceso restringido al administrador.")
         return redirect(url_for("login"))
     
-    conn = get_db_connection()
-    usuarios = []
-    
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("""
-                SELECT u.*, td.descripcion as tipo_documento 
-                FROM usuarios u 
-                JOIN tipos_documento td ON u.tipo_documento_id = td.id 
-                ORDER BY u.fecha_creacion DESC
-            """)
-            usuarios = cursor.fetchall()
-        except Exception as e:
-            print(f"Error obteniendo usuarios: {e}")
-        finally:
-            cursor.close()
-            conn.close()
+    filtros = _filtros_usuarios()
+    usuarios, siguiente = listar_usuarios(**filtros)
     
     registrar_log_db(session["usuario_id"], "ACCESO_USUARIOS", "Accedió a gestión de usuarios")
-    return render_template("admin_usuarios.html", usuarios=usuarios)
+    return render_template("admin_usuarios.html", usuarios=usuarios, siguiente=siguiente,
+                           filtros=filtros, stats=estadisticas_admin.obtener(),
+                           tipos_documento=obtener_tipos_documento())
+
+@app.route("/admin/api/usuarios")
+def api_usuarios():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    usuarios, siguiente = listar_usuarios(cursor=request.args.get("cursor"), **_filtros_usuarios())
+    return jsonify({
+        "usuarios": [usuario_a_json(u) for u in usuarios],
+        "siguiente": siguiente
+    })
+
+@app.route("/admin/api/usuarios/buscar")
+def api_buscar_usuarios():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    inicio = time.perf_counter()
+    usuarios, origen = indice_usuarios.buscar(request.args.get("q", ""), request.args.get("k", 10, type=int))
+    resultados = []
+    for usuario in usuarios:
+        usuario["tipo_documento"] = descripcion_tipo_documento(usuario["tipo_documento_id"])
+        resultados.append(dict(usuario_a_json(usuario), puntaje=usuario.get("puntaje")))
+    return jsonify({
+        "usuarios": resultados,
+        "origen": origen,
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2)
+    })
 
 @app.route("/admin/estadisticas")
 def estadisticas_detalladas():
@@ -254,48 +298,116 @@ def estadisticas_detalladas():
         flash("Acceso restringido al administrador.")
         return redirect(url_for("login"))
     
-    conn = get_db_connection()
-    stats = {}
-    
-    if conn:
-        try:
-            cursor = conn.cursor(dictionary=True)
-            
-            # Estadísticas generales
-            cursor.execute("SELECT COUNT(*) as total FROM usuarios")
-            stats['total_usuarios'] = cursor.fetchone()['total']
-            
-            cursor.execute("SELECT COUNT(*) as total FROM mensajes")
-            stats['total_mensajes'] = cursor.fetchone()['total']
-            
-            cursor.execute("SELECT COUNT(*) as total FROM logs_transacciones WHERE DATE(fecha_hora) = CURDATE()")
-            stats['actividad_hoy'] = cursor.fetchone()['total']
-            
-            cursor.execute("SELECT COUNT(*) as total FROM trafico_red WHERE fecha = CURDATE()")
-            stats['conexiones_hoy'] = cursor.fetchone()['total']
-            
-            # Usuarios por rol
-            cursor.execute("SELECT rol, COUNT(*) as cantidad FROM usuarios GROUP BY rol")
-            stats['usuarios_rol'] = cursor.fetchall()
-            
-            # Actividad por hora
-            cursor.execute("""
-                SELECT HOUR(fecha_hora) as hora, COUNT(*) as cantidad 
-                FROM logs_transacciones 
-                WHERE DATE(fecha_hora) = CURDATE() 
-                GROUP BY HOUR(fecha_hora) 
-                ORDER BY hora
-            """)
-            stats['actividad_hora'] = cursor.fetchall()
-            
-        except Exception as e:
-            print(f"Error obteniendo estadísticas: {e}")
-        finally:
-            cursor.close()
-            conn.close()
+    # Contadores en caché; ?recalcular=1 fuerza la consulta a la base de datos
+    stats = estadisticas_admin.obtener(forzar=request.args.get("recalcular") == "1")
     
+    # Anomalías de tráfico ya detectadas en segundo plano (no se evalúa nada aquí)
+    from utils.anomalias import detector_anomalias
+    anomalias = detector_anomalias.anomalias(limite=20)
+    estado_anomalias = detector_anomalias.estadisticas()
+
     registrar_log_db(session["usuario_id"], "ACCESO_ESTADISTICAS", "Accedió a estadísticas detalladas")
-    return render_template("admin_estadisticas.html", stats=stats)
+    return render_template("admin_estadisticas.html", stats=stats, anomalias=anomalias,
+                           estado_anomalias=estado_anomalias)
+
+@app.route("/admin/api/trafico/analitica")
+def api_analitica_trafico():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    from utils.analitica_trafico import analizar_trafico_cacheado, rango_por_defecto
+    desde, hasta = rango_por_defecto()
+    try:
+        if request.args.get("desde"):
+            desde = datetime.strptime(request.args["desde"], "%Y-%m-%d").date()
+        if request.args.get("hasta"):
+            hasta = datetime.strptime(request.args["hasta"], "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify({"error": "Las fechas deben tener el formato AAAA-MM-DD."}), 400
+    if desde > hasta:
+        return jsonify({"error": "La fecha inicial es posterior a la final."}), 400
+
+    return jsonify(analizar_trafico_cacheado(desde, hasta, request.args.get("zona", type=int)))
+
+@app.route("/admin/api/trafico/anomalias", methods=["GET", "POST"])
+def api_anomalias_trafico():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    from utils.anomalias import detector_anomalias
+    # POST reentrena los modelos en segundo plano (por ejemplo, tras cambiar la red de una zona)
+    if request.method == "POST":
+        detector_anomalias.solicitar_reentrenamiento()
+        return jsonify({"estado": "reentrenamiento solicitado"}), 202
+    return jsonify({
+        "anomalias": detector_anomalias.anomalias(request.args.get("zona", type=int),
+                                                  min(request.args.get("limite", 50, type=int), 500)),
+        "detector": detector_anomalias.estadisticas(),
+    })
+
+def _token_colector_valido():
+    autorizacion = request.headers.get("Authorization", "")
+    if not autorizacion.startswith("Bearer "):
+        return False
+    token = autorizacion[len("Bearer "):]
+    return any(hmac.compare_digest(token, valido) for valido in INGESTA_TOKENS)
+
+@app.route("/api/trafico/muestras", methods=["POST"])
+def api_ingesta_trafico():
+    # Los colectores se autentican con token, no con la sesión del panel
+    if not _token_colector_valido():
+        return jsonify({"error": "No autorizado."}), 401
+    if request.content_length is None or request.content_length > INGESTA_MAX_BYTES:
+        return jsonify({"error": f"El cuerpo debe indicar su tamaño y no superar {INGESTA_MAX_BYTES} bytes."}), 413
+    if request.mimetype == "text/csv":
+        formato = "csv"
+    elif request.mimetype in ("application/x-ndjson", "application/jsonl", "application/json"):
+        formato = "jsonl"
+    else:
+        return jsonify({"error": "Use text/csv o application/x-ndjson."}), 415
+
+    resultado = buffer_trafico.ingerir(request.get_data(as_text=True), formato)
+    if resultado is None:
+        # Buffer lleno: nada se aceptó y el colector puede reenviar el lote completo
+        respuesta = jsonify({"error": "Buffer de ingesta lleno, reintente."})
+        respuesta.headers["Retry-After"] = "1"
+        return respuesta, 503
+    return jsonify(resultado), (202 if resultado["aceptadas"] else 400)
+
+@app.route("/admin/api/ingesta")
+def api_estado_ingesta():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    return jsonify(buffer_trafico.estadisticas())
+
+@app.route("/admin/api/series/<tipo>")
+def api_series(tipo):
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+    if tipo not in ("actividad", "trafico"):
+        return jsonify({"error": "Serie no encontrada."}), 404
+
+    from utils.series import serie_cacheada, rango_desde_parametros, REDUCTORES, METRICAS_TRAFICO
+    metodo = request.args.get("metodo", "lttb")
+    metrica = request.args.get("metrica", "ancho_banda_consumido") if tipo == "trafico" else None
+    if metodo not in REDUCTORES or (metrica and metrica not in METRICAS_TRAFICO):
+        return jsonify({"error": "Método o métrica no válidos."}), 400
+    try:
+        desde, hasta, rango = rango_desde_parametros(request.args)
+    except (ValueError, OverflowError):
+        return jsonify({"error": "Rango de fechas no válido."}), 400
+
+    serie, etag = serie_cacheada(tipo, desde, hasta, request.args.get("puntos", 200, type=int),
+                                 metodo, metrica, request.args.get("zona", type=int), rango)
+    if serie is None:
+        return jsonify({"error": "Error de conexión a la base de datos."}), 503
+
+    # Con If-None-Match igual al ETag se responde 304 sin cuerpo
+    respuesta = jsonify(serie)
+    respuesta.set_etag(etag)
+    respuesta.headers["Cache-Control"] = "no-cache"
+    return respuesta.make_conditional(request)
 
 @app.route("/admin/xmpp")
 def estado_xmpp():
@@ -303,17 +415,19 @@ def estado_xmpp():
         flash("Acceso restringido al administrador.")
         return redirect(url_for("login"))
     
-    # Simular estado XMPP (en un caso real conectarías con tu servidor XMPP)
-    estado_xmpp = {
-        'conectado': True,
-        'usuarios_conectados': 15,
-        'mensajes_hoy': 47,
-        'servidor': 'xmpp.ucundinamarca.edu.co',
-        'version': '1.0.0'
-    }
+    # Última muestra de la sonda en segundo plano (no se conecta al servidor aquí)
+    estado_xmpp = monitor_xmpp.estado()
+    historial = monitor_xmpp.historial()
     
     registrar_log_db(session["usuario_id"], "ACCESO_XMPP", "Accedió al estado XMPP")
-    return render_template("admin_xmpp.html", estado=estado_xmpp)
+    return render_template("admin_xmpp.html", estado=estado_xmpp, historial=historial)
+
+@app.route("/admin/api/xmpp")
+def api_estado_xmpp():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    return jsonify({"estado": monitor_xmpp.estado(), "historial": monitor_xmpp.historial()})
 
 @app.route("/admin/config")
 def configuracion():
@@ -324,6 +438,168 @@ def configuracion():
     registrar_log_db(session["usuario_id"], "ACCESO_CONFIG", "Accedió a configuración")
     return render_template("admin_config.html")
 
+def _filtros_exportacion():
+    """Filtros de exportación de la query string; lanza ValueError si una fecha no es válida"""
+    filtros = {
+        "desde": datetime.strptime(request.args["desde"], "%Y-%m-%d").date() if request.args.get("desde") else None,
+        "hasta": datetime.strptime(request.args["hasta"], "%Y-%m-%d").date() if request.args.get("hasta") else None,
+        "rol": request.args.get("rol") or None,
+        "tipo_documento_id": request.args.get("tipo_documento", type=int),
+        "prefijo": request.args.get("q") or None,
+        "usuario_id": request.args.get("usuario_id", type=int),
+        "zona_id": request.args.get("zona_id", type=int),
+    }
+    return {k: v for k, v in filtros.items() if v is not None}
+
+@app.route("/admin/exportar/<tipo>")
+def exportar(tipo):
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    formato = request.args.get("formato", "csv")
+    if tipo not in CONJUNTOS or formato not in FORMATOS:
+        return jsonify({"error": "Exportación no válida."}), 404
+    try:
+        filtros = _filtros_exportacion()
+    except ValueError:
+        return jsonify({"error": "Las fechas deben tener el formato AAAA-MM-DD."}), 400
+
+    registrar_log_db(session["usuario_id"], "EXPORTACION", f"Exportó {tipo} en {formato}")
+
+    # Exportaciones muy grandes: se generan en segundo plano y se descargan cuando estén listas
+    if request.args.get("segundo_plano") == "1":
+        trabajo = trabajos_exportacion.crear(tipo, formato, filtros, session["usuario_id"])
+        return jsonify(trabajo), 202
+
+    try:
+        generador = generar_xlsx(tipo, filtros) if formato == "xlsx" else generar_csv(tipo, filtros)
+        contenido = iniciar_flujo(generador)
+    except ConnectionError as e:
+        return jsonify({"error": str(e)}), 503
+
+    respuesta = Response(contenido, mimetype=FORMATOS[formato])
+    respuesta.headers["Content-Disposition"] = f'attachment; filename="{nombre_archivo(tipo, formato)}"'
+    return respuesta
+
+@app.route("/admin/api/exportaciones/<trabajo_id>")
+def estado_exportacion(trabajo_id):
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    trabajo = trabajos_exportacion.estado(trabajo_id)
+    if not trabajo:
+        return jsonify({"error": "Exportación no encontrada."}), 404
+    if trabajo["estado"] == "listo":
+        trabajo["descarga"] = url_for("descargar_exportacion", trabajo_id=trabajo_id)
+    return jsonify(trabajo)
+
+@app.route("/admin/exportaciones/<trabajo_id>/descargar")
+def descargar_exportacion(trabajo_id):
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    trabajo = trabajos_exportacion.estado(trabajo_id)
+    if not trabajo or trabajo["estado"] != "listo":
+        return jsonify({"error": "Exportación no disponible."}), 404
+    return send_file(trabajos_exportacion.ruta_archivo(trabajo), mimetype=FORMATOS[trabajo["formato"]],
+                     as_attachment=True, download_name=trabajo["archivo"])
+
+@app.route("/admin/api/pool")
+def api_estado_pool():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    return jsonify(dict(estadisticas_pool(), fondo=estadisticas_pool(fondo=True)))
+
+@app.route("/admin/api/auditoria")
+def api_estado_auditoria():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    return jsonify(escritor_auditoria.estadisticas())
+
+@app.route("/admin/api/login")
+def api_estado_login():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    return jsonify(motor_login.estadisticas())
+
+@app.route("/admin/api/referencias", methods=["GET", "POST"])
+def api_referencias():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    # POST invalida la caché (por ejemplo, tras editar tipos_documento a mano)
+    if request.method == "POST":
+        tabla = request.args.get("tabla")
+        if tabla and tabla not in referencias.tablas():
+            return jsonify({"error": f"Tabla de referencia desconocida: {tabla}"}), 400
+        referencias.invalidar(tabla)
+    return jsonify(referencias.estadisticas())
+
+@app.route("/admin/api/usuarios/indice", methods=["GET", "POST"])
+def api_indice_usuarios():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    # POST reconstruye el índice de búsqueda (por ejemplo, tras editar usuarios a mano)
+    if request.method == "POST":
+        indice_usuarios.reconstruir()
+    return jsonify(indice_usuarios.estadisticas())
+
+@app.route("/admin/api/sesiones")
+def api_estado_sesiones():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    return jsonify(interfaz_sesiones.estadisticas())
+
+@app.route("/admin/api/usuarios/<int:usuario_id>/invalidar-sesion", methods=["POST"])
+def api_invalidar_sesion_usuario(usuario_id):
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    # Tras editar o eliminar un usuario: sus sesiones abiertas toman el rol y los datos nuevos
+    invalidar_usuario(usuario_id)
+    registrar_log_db(session["usuario_id"], "INVALIDAR_SESION", f"Invalidó el contexto del usuario {usuario_id}")
+    return jsonify({"usuario_id": usuario_id, "invalidado": True})
+
+@app.route("/admin/api/logging")
+def api_estado_logging():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    return jsonify(estadisticas_logging())
+
+@app.route("/admin/api/consultas-lentas")
+def api_consultas_lentas():
+    if "usuario_id" not in session or session.get("rol") != "administrador":
+        return jsonify({"error": "Acceso restringido al administrador."}), 403
+
+    # Las más recientes primero
+    return jsonify({"consultas": list(reversed(consultas_lentas))})
+
+def crear_app(precargar_analitica=False):
+    """
+    Termina de configurar la app una sola vez por proceso y la retorna.
+    gunicorn la llama en el proceso maestro (gunicorn.conf.py); python app.py y benchmark.py también.
+    """
+    if app.extensions.get("ucundinamarca"):
+        return app
+    inicio = time.perf_counter()
+    configurar_logging()
+    instrumentar_app(app)
+    referencias.precargar()
+    if precargar_analitica:
+        for modulo in MODULOS_ANALITICA:
+            importlib.import_module(modulo)
+    app.extensions["ucundinamarca"] = {"arranque_ms": round((time.perf_counter() - inicio) * 1000, 1),
+                                       "analitica_precargada": precargar_analitica}
+    logger.info("App configurada", extra=app.extensions["ucundinamarca"])
+    return app
+
 if __name__ == "__main__":
-    print("Iniciando servidor Flask...")
+    crear_app()
+    logger.info("Iniciando servidor Flask...")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
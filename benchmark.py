@@ -0,0 +1,307 @@
+"""
+Pruebas de carga de app.py (login, registro, dashboard y panel admin).
+
+Levanta la app en un servidor HTTP local contra la base MySQL configurada en .env
+(idealmente una base dedicada, poblada con --sembrar) y la recorre con clientes
+concurrentes. Reporta p50/p95/p99, peticiones por segundo y consultas SQL por
+petición (leídas de la cabecera Server-Timing), y guarda el resultado en JSON.
+
+Uso:
+    python benchmark.py --sembrar --usuarios 50000 --logs 500000
+    python benchmark.py --clientes 16 --peticiones 200 --salida base.json
+    python benchmark.py --base base.json --umbral 0.15   # sale con código 1 si hay regresión
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+from http.cookiejar import CookieJar
+
+from config import MYSQL_DB
+
+PREFIJO = 'bench'
+PREFIJO_REGISTRO = 'benchreg'
+ESCENARIOS = ['login', 'registro', 'dashboard', 'admin', 'admin_usuarios', 'admin_estadisticas']
+_RE_CONSULTAS = re.compile(r'(\d+) consultas')
+
+
+def sembrar(args):
+    """Pobla la base con el modo masivo de poblar_datos_real.py (usuarios bench<n>@...)"""
+    from poblar_datos_real import poblar_masivo
+
+    poblar_masivo(argparse.Namespace(
+        usuarios=args.usuarios, logs=args.logs, dias=args.dias, zonas=3, procesos=args.procesos,
+        bloque=20000, lote=2000, load_data=False, prefijo=PREFIJO, semilla=2024,
+        progreso='benchmark_progreso.json'))
+
+
+class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    """Se mide la respuesta de la ruta, no la página a la que redirige"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Cliente:
+    """Cliente HTTP con cookies propias (una sesión de Flask por cliente)"""
+
+    def __init__(self, base):
+        self.base = base
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(CookieJar()), _SinRedirecciones)
+
+    def pedir(self, ruta, datos=None):
+        """Retorna (estado, segundos, consultas SQL) de una petición"""
+        cuerpo = urllib.parse.urlencode(datos).encode() if datos is not None else None
+        inicio = time.perf_counter()
+        try:
+            respuesta = self.opener.open(self.base + ruta, cuerpo, timeout=60)
+            respuesta.read()
+            estado, cabeceras = respuesta.status, respuesta.headers
+        except urllib.error.HTTPError as e:
+            e.read()
+            estado, cabeceras = e.code, e.headers
+        duracion = time.perf_counter() - inicio
+        consultas = _RE_CONSULTAS.search(cabeceras.get('Server-Timing', '') or '')
+        return estado, duracion, int(consultas.group(1)) if consultas else None
+
+    def iniciar_sesion(self, correo, contrasena):
+        estado, _, _ = self.pedir('/login', {'usuario': correo, 'contrasena': contrasena})
+        if estado != 302:
+            raise RuntimeError(f"No se pudo iniciar sesión como {correo} (HTTP {estado})")
+
+
+def _correo(n):
+    return f"{PREFIJO}{n}@ucundinamarca.edu.co"
+
+
+def _peticion(escenario, cliente, rnd, args):
+    """Una petición del escenario; retorna (estado, segundos, consultas, estado esperado)"""
+    if escenario == 'login':
+        # Los ids múltiplos de 5000 son administradores; da igual para medir el login
+        datos = {'usuario': _correo(rnd.randrange(1, args.usuarios)), 'contrasena': args.contrasena}
+        return cliente.pedir('/login', datos) + ((302,),)
+    if escenario == 'registro':
+        datos = {
+            'tipo_documento': '1', 'documento': str(rnd.randrange(10 ** 9, 10 ** 10)),
+            'nombre': 'Usuario Benchmark', 'correo': f"{PREFIJO_REGISTRO}{uuid.uuid4().hex}@ucundinamarca.edu.co",
+            'telefono': '3000000000', 'contrasena': 'benchmark123', 'confirmar': 'benchmark123',
+        }
+        return cliente.pedir('/registro', datos) + ((302,),)
+    rutas = {
+        'dashboard': '/dashboard',
+        'admin': '/admin',
+        'admin_usuarios': '/admin/usuarios',
+        'admin_estadisticas': '/admin/estadisticas',
+    }
+    return cliente.pedir(rutas[escenario]) + ((200,),)
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    indice = min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return round(ordenados[indice] * 1000, 2)
+
+
+def ejecutar_escenario(escenario, base, args):
+    """Corre `args.clientes` hilos que hacen `args.peticiones` peticiones cada uno"""
+    clientes = []
+    for i in range(args.clientes):
+        cliente = Cliente(base)
+        if escenario == 'dashboard':
+            cliente.iniciar_sesion(_correo(1 + i), args.contrasena)
+        elif escenario.startswith('admin'):
+            cliente.iniciar_sesion(_correo(0), args.contrasena)
+        clientes.append(cliente)
+
+    duraciones, consultas, errores = [], [], []
+    candado = threading.Lock()
+    barrera = threading.Barrier(args.clientes + 1)
+
+    def trabajar(i, cliente):
+        rnd = random.Random(f"{escenario}:{i}")
+        propias_d, propias_c, propios_e = [], [], []
+        for _ in range(args.calentamiento):
+            _peticion(escenario, cliente, rnd, args)
+        barrera.wait()
+        for _ in range(args.peticiones):
+            try:
+                estado, duracion, n_consultas, esperados = _peticion(escenario, cliente, rnd, args)
+            except OSError as e:
+                propios_e.append(str(e))
+                continue
+            if estado not in esperados:
+                propios_e.append(f"HTTP {estado}")
+            propias_d.append(duracion)
+            if n_consultas is not None:
+                propias_c.append(n_consultas)
+        with candado:
+            duraciones.extend(propias_d)
+            consultas.extend(propias_c)
+            errores.extend(propios_e)
+
+    hilos = [threading.Thread(target=trabajar, args=(i, c), daemon=True) for i, c in enumerate(clientes)]
+    for hilo in hilos:
+        hilo.start()
+    barrera.wait()
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.join()
+    transcurrido = time.perf_counter() - inicio
+
+    ordenados = sorted(duraciones)
+    return {
+        'peticiones': len(duraciones),
+        'errores': len(errores),
+        'ejemplos_error': sorted(set(errores))[:5],
+        'p50_ms': _percentil(ordenados, 50),
+        'p95_ms': _percentil(ordenados, 95),
+        'p99_ms': _percentil(ordenados, 99),
+        'max_ms': round(ordenados[-1] * 1000, 2) if ordenados else None,
+        'peticiones_por_segundo': round(len(duraciones) / transcurrido, 1) if transcurrido else None,
+        'consultas_por_peticion': round(sum(consultas) / len(consultas), 2) if consultas else None,
+    }
+
+
+def limpiar_registros():
+    """Borra los usuarios creados por el escenario de registro"""
+    from utils.db_connection import get_db_connection
+
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM logs_transacciones
+            WHERE usuario_id IN (SELECT id FROM (SELECT id FROM usuarios WHERE correo LIKE %s) r)
+        """, (f"{PREFIJO_REGISTRO}%",))
+        cursor.execute("DELETE FROM usuarios WHERE correo LIKE %s", (f"{PREFIJO_REGISTRO}%",))
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"Error limpiando usuarios de registro: {e}")
+    finally:
+        conn.close()
+
+
+def ejecutar(args):
+    from werkzeug.serving import make_server
+    from app import crear_app
+    from utils.auditoria import escritor_auditoria
+    from utils.autenticacion import motor_login
+    from utils.db_connection import estadisticas_pool
+
+    app = crear_app()
+    if not args.con_limites:
+        # Todos los clientes salen de 127.0.0.1: el límite por IP frenaría el escenario de login
+        motor_login.limitador_ip = None
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # sin una línea por petición
+    servidor = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{servidor.server_port}"
+    print(f"App en {base} (base de datos {MYSQL_DB})")
+
+    resultados = {}
+    try:
+        for escenario in args.escenarios:
+            print(f"- {escenario}: {args.clientes} clientes x {args.peticiones} peticiones...")
+            resultados[escenario] = ejecutar_escenario(escenario, base, args)
+            r = resultados[escenario]
+            print(f"  p50 {r['p50_ms']} ms | p95 {r['p95_ms']} ms | p99 {r['p99_ms']} ms | "
+                  f"{r['peticiones_por_segundo']} pet/s | {r['consultas_por_peticion']} consultas/pet | "
+                  f"{r['errores']} errores")
+    finally:
+        servidor.shutdown()
+        escritor_auditoria.vaciar()
+        if 'registro' in args.escenarios:
+            limpiar_registros()
+
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'base_datos': MYSQL_DB,
+        'parametros': {
+            'clientes': args.clientes,
+            'peticiones': args.peticiones,
+            'calentamiento': args.calentamiento,
+            'usuarios': args.usuarios,
+        },
+        'pool': estadisticas_pool(),
+        'escenarios': resultados,
+    }
+
+
+def comparar(actual, base, umbral):
+    """Lista de regresiones: p95 más lento o menos peticiones/s que la base más allá del umbral"""
+    regresiones = []
+    for escenario, r in actual['escenarios'].items():
+        anterior = base.get('escenarios', {}).get(escenario)
+        if not anterior:
+            continue
+        if anterior['p95_ms'] and r['p95_ms'] and r['p95_ms'] > anterior['p95_ms'] * (1 + umbral):
+            regresiones.append(f"{escenario}: p95 {anterior['p95_ms']} -> {r['p95_ms']} ms")
+        if (anterior['peticiones_por_segundo'] and r['peticiones_por_segundo']
+                and r['peticiones_por_segundo'] < anterior['peticiones_por_segundo'] * (1 - umbral)):
+            regresiones.append(f"{escenario}: {anterior['peticiones_por_segundo']} -> "
+                               f"{r['peticiones_por_segundo']} pet/s")
+        if r['errores'] > anterior['errores']:
+            regresiones.append(f"{escenario}: {anterior['errores']} -> {r['errores']} errores")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pruebas de carga de la app Flask")
+    parser.add_argument('--sembrar', action='store_true', help="Poblar la base antes de medir")
+    parser.add_argument('--solo-sembrar', action='store_true', help="Poblar la base y salir")
+    parser.add_argument('--usuarios', type=int, default=10000, help="Usuarios bench<n> sembrados")
+    parser.add_argument('--logs', type=int, default=200000)
+    parser.add_argument('--dias', type=int, default=90)
+    parser.add_argument('--procesos', type=int, default=4, help="Procesos para la siembra")
+    parser.add_argument('--contrasena', default='estudiante123', help="Contraseña de los usuarios sembrados")
+    parser.add_argument('--escenarios', nargs='+', choices=ESCENARIOS, default=ESCENARIOS)
+    parser.add_argument('--clientes', type=int, default=8, help="Clientes concurrentes por escenario")
+    parser.add_argument('--peticiones', type=int, default=100, help="Peticiones medidas por cliente")
+    parser.add_argument('--calentamiento', type=int, default=5, help="Peticiones por cliente sin medir")
+    parser.add_argument('--con-limites', action='store_true', help="Mantener el límite de intentos por IP")
+    parser.add_argument('--salida', default=None, help="Archivo JSON de resultados")
+    parser.add_argument('--base', default=None, help="Resultados anteriores para comparar")
+    parser.add_argument('--umbral', type=float, default=0.15, help="Regresión tolerada (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    if args.sembrar or args.solo_sembrar:
+        sembrar(args)
+        if args.solo_sembrar:
+            return 0
+
+    resultado = ejecutar(args)
+    salida = args.salida or os.path.join('logs', f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(salida) or '.', exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {salida}")
+
+    if args.base:
+        with open(args.base, encoding='utf-8') as f:
+            regresiones = comparar(resultado, json.load(f), args.umbral)
+        if regresiones:
+            print(f"\nRegresiones respecto a {args.base} (umbral {args.umbral:.0%}):")
+            for regresion in regresiones:
+                print(f"  - {regresion}")
+            return 1
+        print(f"\nSin regresiones respecto a {args.base}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
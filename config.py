@@ -12,13 +12,190 @@ MYSQL_USER = os.getenv('MYSQL_USER', 'root')
 MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', '')  # Por defecto XAMPP no tiene password
 MYSQL_DB = os.getenv('MYSQL_DB', 'ComunicacionDatos')
 
+# Pool de conexiones (por proceso/worker de gunicorn)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))          # segundos esperando una conexión libre
+DB_POOL_MAX_AGE = int(os.getenv('DB_POOL_MAX_AGE', '1800'))         # segundos antes de reciclar una conexión
+DB_POOL_PING = os.getenv('DB_POOL_PING', 'true').lower() == 'true'  # verificar la conexión al prestarla
+# Pool aparte para los hilos de fondo (auditoría, ingesta, índice de usuarios, anomalías,
+# monitores XMPP y de salud): no le quitan conexiones a los hilos que atienden peticiones
+DB_POOL_FONDO = int(os.getenv('DB_POOL_FONDO', '3'))
+DB_POOL_FONDO_TIMEOUT = float(os.getenv('DB_POOL_FONDO_TIMEOUT', '30'))  # segundos (los hilos de fondo pueden esperar)
+
+# =========================================================
+# AUDITORÍA (logs_transacciones) ASÍNCRONA
+# =========================================================
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '200'))
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '1.0'))   # segundos
+AUDIT_OVERFLOW_POLICY = os.getenv('AUDIT_OVERFLOW_POLICY', 'disco')      # bloquear | descartar | disco
+AUDIT_BLOCK_TIMEOUT = float(os.getenv('AUDIT_BLOCK_TIMEOUT', '0.05'))    # segundos (política bloquear)
+AUDIT_SPILL_PATH = os.getenv('AUDIT_SPILL_PATH', 'logs/auditoria_pendiente.jsonl')
+
+# Retención y archivo de logs_transacciones (mantenimiento_logs.py)
+LOGS_RETENCION_DIAS = int(os.getenv('LOGS_RETENCION_DIAS', '180'))
+LOGS_ARCHIVO_DIR = os.getenv('LOGS_ARCHIVO_DIR', 'archivo')
+LOGS_ACTIVIDAD_RECIENTE_DIAS = int(os.getenv('LOGS_ACTIVIDAD_RECIENTE_DIAS', '7'))  # ventana de /admin
+
+# =========================================================
+# ESTADÍSTICAS DEL PANEL ADMIN
+# =========================================================
+STATS_CACHE_TTL = int(os.getenv('STATS_CACHE_TTL', '300'))  # segundos entre recálculos completos (en segundo plano)
+STATS_FILE = os.getenv('STATS_FILE', 'logs/estadisticas_admin.json')  # contadores compartidos por los workers; vacío: por proceso
+
+# Tablas de referencia (tipos_documento) en memoria
+REFERENCE_CACHE_TTL = int(os.getenv('REFERENCE_CACHE_TTL', '600'))  # segundos entre recargas
+
+# =========================================================
+# BÚSQUEDA DE USUARIOS (utils/busqueda_usuarios.py)
+# =========================================================
+BUSQUEDA_RECARGA = int(os.getenv('BUSQUEDA_RECARGA', '900'))       # segundos entre reconstrucciones completas del índice
+BUSQUEDA_INTERVALO = int(os.getenv('BUSQUEDA_INTERVALO', '30'))    # segundos entre lecturas de usuarios nuevos (otros workers)
+BUSQUEDA_SIMILITUD = float(os.getenv('BUSQUEDA_SIMILITUD', '0.45'))  # similitud mínima de trigramas para errores de digitación
+BUSQUEDA_MAX_RESULTADOS = int(os.getenv('BUSQUEDA_MAX_RESULTADOS', '50'))
+
+# =========================================================
+# DETECCIÓN DE ANOMALÍAS EN TRÁFICO (utils/anomalias.py)
+# =========================================================
+ANOMALIAS_METODO = os.getenv('ANOMALIAS_METODO', 'robusto')        # 'robusto' (z robusto) o 'isolation' (IsolationForest)
+ANOMALIAS_UMBRAL_Z = float(os.getenv('ANOMALIAS_UMBRAL_Z', '3.5'))  # z robusto a partir del cual se marca la muestra
+ANOMALIAS_DIAS_ENTRENAMIENTO = int(os.getenv('ANOMALIAS_DIAS_ENTRENAMIENTO', '28'))
+ANOMALIAS_REENTRENAR_HORAS = int(os.getenv('ANOMALIAS_REENTRENAR_HORAS', '24'))
+ANOMALIAS_INTERVALO = int(os.getenv('ANOMALIAS_INTERVALO', '300'))  # segundos entre revisiones de muestras nuevas
+ANOMALIAS_MARGEN_HORAS = int(os.getenv('ANOMALIAS_MARGEN_HORAS', '2'))  # horas que se vuelven a revisar (muestras tardías)
+ANOMALIAS_N_JOBS = int(os.getenv('ANOMALIAS_N_JOBS', '-1'))        # procesos de joblib (-1: todos los núcleos)
+ANOMALIAS_DIR = os.getenv('ANOMALIAS_DIR', 'modelos')               # modelos y anomalías recientes (compartidos por los workers)
+ANOMALIAS_MAXIMAS = int(os.getenv('ANOMALIAS_MAXIMAS', '500'))      # anomalías recientes conservadas
+
+# =========================================================
+# INGESTA DE TRÁFICO (utils/ingesta_trafico.py)
+# =========================================================
+# Tokens de los colectores separados por comas (Authorization: Bearer <token>); vacío deshabilita la ingesta
+INGESTA_TOKENS = [t.strip() for t in os.getenv('INGESTA_TOKENS', '').split(',') if t.strip()]
+INGESTA_CAPACIDAD = int(os.getenv('INGESTA_CAPACIDAD', '100000'))   # muestras en el buffer por worker
+INGESTA_LOTE = int(os.getenv('INGESTA_LOTE', '1000'))               # filas por INSERT
+INGESTA_INTERVALO = float(os.getenv('INGESTA_INTERVALO', '1.0'))    # segundos entre escrituras
+INGESTA_MAX_BYTES = int(os.getenv('INGESTA_MAX_BYTES', str(5 * 1024 * 1024)))  # tamaño máximo del cuerpo
+
+# =========================================================
+# EXPORTACIONES (utils/exportaciones.py)
+# =========================================================
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')                          # archivos de trabajos en segundo plano
+EXPORT_BLOCK_SIZE = int(os.getenv('EXPORT_BLOCK_SIZE', '5000'))          # filas por fetchmany
+EXPORT_MAX_WORKERS = int(os.getenv('EXPORT_MAX_WORKERS', '2'))           # exportaciones simultáneas por proceso
+EXPORT_RETENTION_HOURS = int(os.getenv('EXPORT_RETENTION_HOURS', '24'))  # horas antes de borrar los archivos
+
+# =========================================================
+# REGISTRO DE EVENTOS (utils/bitacora.py)
+# =========================================================
+# {pid}: un archivo por proceso (cada worker de gunicorn rota el suyo). Sin {pid} los workers
+# comparten el archivo y no lo rotan ellos (logrotate externo); vacío: solo consola
+LOG_FILE = os.getenv('LOG_FILE', 'logs/app.{pid}.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Niveles por módulo: "utils.db_connection=DEBUG,werkzeug=WARNING"
+LOG_LEVELS = dict(
+    (modulo.strip(), nivel.strip().upper())
+    for modulo, nivel in (par.split('=', 1) for par in os.getenv('LOG_LEVELS', '').split(',') if '=' in par)
+)
+LOG_ROTATION = os.getenv('LOG_ROTATION', 'tamano')      # tamano | tiempo | externa (logrotate con copytruncate o reapertura)
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_WHEN = os.getenv('LOG_WHEN', 'midnight')            # rotación por tiempo (valores de TimedRotatingFileHandler)
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', '14'))       # archivos .gz que se conservan
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_CONSOLE = os.getenv('LOG_CONSOLE', 'false').lower() == 'true'
+LOG_MUESTREO_CONEXIONES = int(os.getenv('LOG_MUESTREO_CONEXIONES', '100'))  # 1 de cada N conexiones en DEBUG
+
 # =========================================================
 # CONFIGURACIÓN FLASK
 # =========================================================
 SECRET_KEY = os.getenv('SECRET_KEY', 'clave_secreta_ucundinamarca_2024')
+# Proxies de confianza delante de la app. Por defecto 0: gunicorn y app.py escuchan directo en
+# 0.0.0.0 y un cliente podría falsear X-Forwarded-For para esquivar el límite de intentos por IP.
+# Detrás de un proxy inverso que reescribe X-Forwarded-For (nginx: proxy_set_header X-Forwarded-For
+# $proxy_add_x_forwarded_for) y con gunicorn escuchando solo para él (GUNICORN_BIND=127.0.0.1:5000),
+# poner la cantidad de proxies de la cadena: PROXY_SALTOS=1
+PROXY_SALTOS = int(os.getenv('PROXY_SALTOS', '0'))
+
+# Sesiones del lado del servidor (utils/sesiones.py)
+# memoria: un solo proceso | archivos: workers y chat en la misma máquina | mysql: varias máquinas (migración 006)
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'archivos')
+SESSION_DIR = os.getenv('SESSION_DIR', 'sesiones')                        # almacén 'archivos'
+SESSION_TTL = int(os.getenv('SESSION_TTL', str(8 * 3600)))                # segundos de inactividad antes de vencer
+SESSION_LOCAL_SIZE = int(os.getenv('SESSION_LOCAL_SIZE', '10000'))        # sesiones del almacén 'memoria'
+SESSION_USER_TTL = int(os.getenv('SESSION_USER_TTL', '30'))               # segundos de caché del contexto del usuario
+SESSION_SYNC_INTERVAL = float(os.getenv('SESSION_SYNC_INTERVAL', '2'))    # segundos entre lecturas de invalidaciones
+
+# =========================================================
+# SERVIDOR DE PRODUCCIÓN (gunicorn.conf.py)
+# =========================================================
+GUNICORN_BIND = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+GUNICORN_WORKERS = int(os.getenv('GUNICORN_WORKERS', '0'))          # 0: 2 x núcleos + 1 (hasta GUNICORN_MAX_WORKERS)
+GUNICORN_MAX_WORKERS = int(os.getenv('GUNICORN_MAX_WORKERS', '12'))
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', '0'))          # 0: DB_POOL_SIZE (una conexión por hilo)
+GUNICORN_TIMEOUT = int(os.getenv('GUNICORN_TIMEOUT', '60'))         # segundos sin respuesta antes de reiniciar un worker
+GUNICORN_GRACEFUL_TIMEOUT = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))  # segundos para terminar peticiones al recargar
+GUNICORN_MAX_REQUESTS = int(os.getenv('GUNICORN_MAX_REQUESTS', '5000'))  # peticiones antes de reciclar un worker (0: nunca)
+GUNICORN_PRELOAD = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'  # cargar app y cachés en el maestro antes del fork
+GUNICORN_RELOAD = os.getenv('GUNICORN_RELOAD', 'false').lower() == 'true'   # desarrollo: recargar al cambiar el código
 
 # =========================================================
 # CONFIGURACIÓN SSL/TLS
 # =========================================================
 SSL_CERT_PATH = os.getenv('SSL_CERT_PATH', 'certificado/cert.pem')
 SSL_KEY_PATH = os.getenv('SSL_KEY_PATH', 'certificado/key.pem')
+
+# =========================================================
+# CHAT EN TIEMPO REAL (utils/chat_servidor.py)
+# =========================================================
+CHAT_HOST = os.getenv('CHAT_HOST', '0.0.0.0')
+CHAT_PORT = int(os.getenv('CHAT_PORT', '5001'))
+CHAT_PUBLIC_URL = os.getenv('CHAT_PUBLIC_URL', '')  # vacío: mismo host que la app, puerto CHAT_PORT
+CHAT_ALLOWED_ORIGINS = [o.strip() for o in os.getenv(
+    'CHAT_ALLOWED_ORIGINS', 'http://localhost:5000,http://127.0.0.1:5000').split(',') if o.strip()]
+CHAT_BATCH_SIZE = int(os.getenv('CHAT_BATCH_SIZE', '100'))
+CHAT_FLUSH_INTERVAL = float(os.getenv('CHAT_FLUSH_INTERVAL', '0.5'))  # segundos
+CHAT_REPLAY_BUFFER = int(os.getenv('CHAT_REPLAY_BUFFER', '100'))     # mensajes por sala para reconexiones
+
+# =========================================================
+# MONITOREO XMPP (utils/xmpp_estado.py)
+# =========================================================
+XMPP_HOST = os.getenv('XMPP_HOST', 'xmpp.ucundinamarca.edu.co')
+XMPP_PORT = int(os.getenv('XMPP_PORT', '5222'))
+XMPP_DOMAIN = os.getenv('XMPP_DOMAIN', XMPP_HOST)
+XMPP_USER = os.getenv('XMPP_USER', '')          # cuenta de monitoreo (admin para contar usuarios en línea)
+XMPP_PASSWORD = os.getenv('XMPP_PASSWORD', '')
+XMPP_TLS_VERIFY = os.getenv('XMPP_TLS_VERIFY', 'true').lower() == 'true'
+XMPP_PROBE_INTERVAL = int(os.getenv('XMPP_PROBE_INTERVAL', '30'))     # segundos entre muestras
+XMPP_PROBE_TIMEOUT = float(os.getenv('XMPP_PROBE_TIMEOUT', '5'))      # segundos por etapa de la sonda
+XMPP_HISTORY = int(os.getenv('XMPP_HISTORY', '120'))                  # muestras guardadas en memoria
+
+# =========================================================
+# INSTRUMENTACIÓN (utils/metricas.py)
+# =========================================================
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))          # umbral del registro de consultas lentas
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')                     # vacío: /metrics solo desde localhost sin proxy
+METRICS_DIR = os.getenv('METRICS_DIR', 'logs/metricas')            # estado de cada worker para sumarlos; vacío: solo el que responde
+METRICS_INTERVALO = float(os.getenv('METRICS_INTERVALO', '5'))     # segundos entre volcados de cada worker
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', 'false').lower() == 'true'
+PROFILER_SAMPLE_RATE = float(os.getenv('PROFILER_SAMPLE_RATE', '0'))  # fracción de peticiones perfiladas (0 a 1)
+PROFILER_DIR = os.getenv('PROFILER_DIR', 'logs/perfiles')
+
+# =========================================================
+# SALUD Y DISPONIBILIDAD (utils/salud.py: /healthz y /readyz)
+# =========================================================
+SALUD_INTERVALO = float(os.getenv('SALUD_INTERVALO', '5'))          # segundos entre verificaciones de fondo
+SALUD_TIMEOUT = float(os.getenv('SALUD_TIMEOUT', '2'))              # segundos máximos por verificación
+SALUD_AUDITORIA_UMBRAL = float(os.getenv('SALUD_AUDITORIA_UMBRAL', '0.8'))  # fracción de la cola de auditoría
+SALUD_XMPP_CRITICO = os.getenv('SALUD_XMPP_CRITICO', 'false').lower() == 'true'  # XMPP caído saca la app de servicio
+
+# =========================================================
+# INICIO DE SESIÓN (utils/autenticacion.py)
+# =========================================================
+# Método de werkzeug para los hashes nuevos; los hashes con otro método se regeneran al iniciar sesión
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+LOGIN_CACHE_SIZE = int(os.getenv('LOGIN_CACHE_SIZE', '2000'))          # usuarios en la caché de búsqueda
+LOGIN_CACHE_TTL = int(os.getenv('LOGIN_CACHE_TTL', '60'))              # segundos
+LOGIN_MAX_INTENTOS_IP = int(os.getenv('LOGIN_MAX_INTENTOS_IP', '30'))  # intentos por IP en la ventana
+LOGIN_VENTANA_IP = int(os.getenv('LOGIN_VENTANA_IP', '60'))            # segundos
+LOGIN_MAX_FALLOS_CUENTA = int(os.getenv('LOGIN_MAX_FALLOS_CUENTA', '5'))  # fallos por correo en la ventana
+LOGIN_VENTANA_CUENTA = int(os.getenv('LOGIN_VENTANA_CUENTA', '300'))   # segundos
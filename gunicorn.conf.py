@@ -0,0 +1,62 @@
+"""
+Configuración de gunicorn para producción (gunicorn la lee sola desde este directorio).
+
+    gunicorn                                  # usa este archivo
+    GUNICORN_WORKERS=4 gunicorn               # los valores se ajustan con variables de entorno (config.py)
+
+- Workers según los núcleos (2 x núcleos + 1) e hilos según el pool de MySQL, para que
+  cada hilo tenga una conexión; los hilos de fondo del worker usan su propio pool (DB_POOL_FONDO)
+- Con preload (GUNICORN_PRELOAD) el maestro importa la app, pandas/NumPy/scikit-learn y
+  precarga las tablas de referencia antes del fork: los workers arrancan sin importar
+  nada y comparten esas páginas de memoria
+- Recarga sin cortar peticiones:
+    kill -HUP <maestro>       reinicia los workers de forma ordenada (graceful_timeout);
+                              con preload reutilizan el código ya cargado en el maestro
+    kill -USR2 <maestro>      arranca un maestro nuevo con el código nuevo; luego
+    kill -TERM <maestro viejo> cuando el nuevo ya atiende
+"""
+import multiprocessing
+
+from config import (DB_POOL_SIZE, DB_POOL_FONDO, GUNICORN_BIND, GUNICORN_WORKERS, GUNICORN_MAX_WORKERS, GUNICORN_THREADS,
+                    GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT, GUNICORN_MAX_REQUESTS, GUNICORN_PRELOAD,
+                    GUNICORN_RELOAD)
+
+bind = GUNICORN_BIND
+workers = GUNICORN_WORKERS or min(multiprocessing.cpu_count() * 2 + 1, GUNICORN_MAX_WORKERS)
+worker_class = 'gthread'
+threads = GUNICORN_THREADS or DB_POOL_SIZE
+
+timeout = GUNICORN_TIMEOUT
+graceful_timeout = GUNICORN_GRACEFUL_TIMEOUT
+keepalive = 5
+# Reciclar workers de a poco evita que la memoria crezca sin límite; el jitter evita que reinicien todos juntos
+max_requests = GUNICORN_MAX_REQUESTS
+max_requests_jitter = GUNICORN_MAX_REQUESTS // 10
+
+# --reload vuelve a importar el código en cada worker: no tiene sentido precargarlo en el maestro
+reload = GUNICORN_RELOAD
+preload_app = GUNICORN_PRELOAD and not GUNICORN_RELOAD
+wsgi_app = f"app:crear_app(precargar_analitica={preload_app})"
+
+# Los registros de la app van a utils/bitacora.py; gunicorn solo escribe sus errores
+accesslog = None
+errorlog = '-'
+proc_name = 'red-universidad'
+
+
+def when_ready(server):
+    server.log.info("Workers: %s x %s hilos (hasta %s conexiones MySQL), preload=%s",
+                    workers, threads, workers * (DB_POOL_SIZE + DB_POOL_FONDO), preload_app)
+
+
+def pre_fork(server, worker):
+    # Las conexiones que abrió el maestro al precargar no deben heredarse: el socket quedaría compartido
+    if preload_app:
+        from utils.db_connection import cerrar_pool
+        cerrar_pool()
+
+
+def post_fork(server, worker):
+    # /readyz responde desde el primer momento con verificaciones hechas en este worker
+    from utils.salud import monitor_salud
+    monitor_salud.iniciar()
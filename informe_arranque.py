@@ -0,0 +1,102 @@
+"""
+Informe del costo de arranque de la app: tiempo de importación por módulo.
+
+Importa app.py en un proceso nuevo con `python -X importtime` y agrupa el resultado
+por paquete de primer nivel (flask, pandas, numpy...) y por módulo propio (app, utils.*).
+Sirve para comprobar que las librerías pesadas no se cargan al arrancar un worker.
+
+Uso:
+    python informe_arranque.py
+    python informe_arranque.py --con-analitica          # como el maestro de gunicorn con preload
+    python informe_arranque.py --top 30 --salida logs/arranque.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+PROPIOS = ('app', 'config', 'utils')
+
+
+def medir(con_analitica=False):
+    """Ejecuta la importación en un subproceso y retorna (filas de -X importtime, segundos totales)"""
+    codigo = f"import app; app.crear_app(precargar_analitica={con_analitica})"
+    inicio = time.perf_counter()
+    proceso = subprocess.run([sys.executable, '-X', 'importtime', '-c', codigo],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    total = time.perf_counter() - inicio
+    if proceso.returncode != 0:
+        raise RuntimeError(proceso.stderr.strip().splitlines()[-1] if proceso.stderr.strip() else "Error importando app")
+
+    filas = []
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith('import time:') or 'self [us]' in linea:
+            continue
+        _, propio, acumulado, nombre = (parte for parte in linea.replace('import time:', '|', 1).split('|'))
+        profundidad = (len(nombre) - len(nombre.lstrip()) - 1) // 2
+        filas.append({'modulo': nombre.strip(), 'propio_ms': int(propio) / 1000,
+                      'acumulado_ms': int(acumulado) / 1000, 'profundidad': profundidad})
+    return filas, total
+
+
+def resumir(filas, top=20):
+    """Costo por paquete de primer nivel (suma de tiempo propio) y de los módulos propios"""
+    por_paquete = {}
+    for fila in filas:
+        paquete = fila['modulo'].split('.')[0]
+        por_paquete[paquete] = por_paquete.get(paquete, 0.0) + fila['propio_ms']
+    paquetes = sorted(por_paquete.items(), key=lambda par: par[1], reverse=True)
+
+    propios = [fila for fila in filas if fila['modulo'].split('.')[0] in PROPIOS]
+    propios.sort(key=lambda fila: fila['acumulado_ms'], reverse=True)
+    return {
+        'importacion_total_ms': round(sum(f['propio_ms'] for f in filas), 1),
+        'modulos': len(filas),
+        'paquetes': [{'paquete': nombre, 'ms': round(ms, 1)} for nombre, ms in paquetes[:top]],
+        'propios': [{'modulo': f['modulo'], 'acumulado_ms': round(f['acumulado_ms'], 1),
+                     'propio_ms': round(f['propio_ms'], 1)} for f in propios[:top]],
+        'cargados_pesados': sorted({f['modulo'].split('.')[0] for f in filas}
+                                   & {'pandas', 'numpy', 'sklearn', 'scipy', 'matplotlib', 'joblib'}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de importación de la app por módulo")
+    parser.add_argument('--con-analitica', action='store_true',
+                        help="precargar los módulos de analítica (como gunicorn con preload)")
+    parser.add_argument('--top', type=int, default=15, help="filas por tabla")
+    parser.add_argument('--salida', help="archivo JSON con el informe")
+    args = parser.parse_args()
+
+    try:
+        filas, total = medir(args.con_analitica)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    informe = resumir(filas, args.top)
+    informe.update({'fecha': datetime.now().isoformat(timespec='seconds'),
+                    'con_analitica': args.con_analitica,
+                    'proceso_total_ms': round(total * 1000, 1)})
+
+    print(f"Proceso completo: {informe['proceso_total_ms']:.0f} ms  |  importaciones: "
+          f"{informe['importacion_total_ms']:.0f} ms en {informe['modulos']} módulos")
+    print(f"Librerías pesadas cargadas: {', '.join(informe['cargados_pesados']) or 'ninguna'}\n")
+    print(f"{'Paquete':<30}{'ms':>10}")
+    for fila in informe['paquetes']:
+        print(f"{fila['paquete']:<30}{fila['ms']:>10.1f}")
+    print(f"\n{'Módulo propio':<30}{'acumulado':>12}{'propio':>10}")
+    for fila in informe['propios']:
+        print(f"{fila['modulo']:<30}{fila['acumulado_ms']:>12.1f}{fila['propio_ms']:>10.1f}")
+
+    if args.salida:
+        os.makedirs(os.path.dirname(args.salida) or '.', exist_ok=True)
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+        print(f"\nInforme guardado en {args.salida}")
+
+
+if __name__ == '__main__':
+    main()
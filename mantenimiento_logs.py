@@ -0,0 +1,390 @@
+"""
+Mantenimiento de logs_transacciones: particiones por mes y archivo de registros antiguos.
+
+    python mantenimiento_logs.py estado
+    python mantenimiento_logs.py particionar --dry-run      # convierte la tabla a particiones mensuales
+    python mantenimiento_logs.py particiones --meses 3      # crea las particiones de los próximos meses
+    python mantenimiento_logs.py archivar --retencion-dias 180 --dry-run
+
+archivar escribe los registros anteriores a la retención en archivos CSV comprimidos
+(uno por mes, en LOGS_ARCHIVO_DIR) y luego los borra. Si la tabla está particionada,
+los meses completos se eliminan con DROP PARTITION en lugar de DELETE. El archivado
+es "al menos una vez": si el proceso se corta entre escribir y borrar un lote, ese
+lote puede quedar repetido en el archivo al volver a ejecutarlo.
+
+Para particionar, MySQL exige que la llave primaria incluya fecha_hora y no admite
+llaves foráneas en tablas particionadas; `particionar` las ajusta (revisar el plan
+con --dry-run primero: el ALTER reescribe la tabla completa).
+"""
+import argparse
+import csv
+import gzip
+import io
+import os
+import time
+from datetime import date, datetime, timedelta
+
+from config import LOGS_RETENCION_DIAS, LOGS_ARCHIVO_DIR
+from utils.db_connection import get_db_connection, cerrar_cursor
+
+TABLA = 'logs_transacciones'
+COLUMNAS = ('id', 'usuario_id', 'accion', 'fecha_hora')
+
+
+def _conectar():
+    conn = get_db_connection()
+    if not conn:
+        raise SystemExit("Error: No se pudo conectar a la base de datos")
+    return conn
+
+
+def _inicio_mes(dia, meses=0):
+    indice = dia.year * 12 + dia.month - 1 + meses
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def _nombre_particion(mes):
+    return f"p{mes:%Y%m}"
+
+
+def _tipo_fecha(cursor):
+    cursor.execute("""
+        SELECT DATA_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'fecha_hora'
+    """, (TABLA,))
+    return cursor.fetchone()[0].lower()
+
+
+def _limite_particion(mes, tipo_fecha):
+    # Las columnas TIMESTAMP solo se pueden particionar con UNIX_TIMESTAMP()
+    if tipo_fecha == 'timestamp':
+        return f"UNIX_TIMESTAMP('{mes:%Y-%m-%d} 00:00:00')"
+    return f"TO_DAYS('{mes:%Y-%m-%d}')"
+
+
+def particiones_actuales(cursor):
+    """Lista de (nombre, filas aproximadas) en orden; vacía si la tabla no está particionada"""
+    cursor.execute("""
+        SELECT PARTITION_NAME, TABLE_ROWS
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (TABLA,))
+    return cursor.fetchall()
+
+
+def _mes_de_particion(nombre):
+    """Primer día del mes de una partición pAAAAMM (None para pmax u otros nombres)"""
+    try:
+        return datetime.strptime(nombre, 'p%Y%m').date()
+    except ValueError:
+        return None
+
+
+def _ejecutar(cursor, sentencias, dry_run):
+    for sentencia in sentencias:
+        print(f"{'[dry-run] ' if dry_run else ''}{sentencia}")
+        if not dry_run:
+            inicio = time.perf_counter()
+            cursor.execute(sentencia)
+            print(f"  ... {time.perf_counter() - inicio:.1f}s")
+
+
+# =========================================================
+# ESTADO
+# =========================================================
+
+def estado(args):
+    conn = _conectar()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*), MIN(fecha_hora), MAX(fecha_hora) FROM {TABLA}")
+        total, minimo, maximo = cursor.fetchone()
+        print(f"{TABLA}: {total:,} registros entre {minimo} y {maximo}")
+        corte = datetime.now() - timedelta(days=args.retencion_dias)
+        cursor.execute(f"SELECT COUNT(*) FROM {TABLA} WHERE fecha_hora < %s", (corte,))
+        print(f"Anteriores a la retención de {args.retencion_dias} días ({corte:%Y-%m-%d}): "
+              f"{cursor.fetchone()[0]:,}")
+        particiones = particiones_actuales(cursor)
+        if not particiones:
+            print("La tabla no está particionada.")
+        for nombre, filas in particiones:
+            print(f"  {nombre}: ~{filas:,} filas")
+        cursor.close()
+    finally:
+        conn.close()
+
+
+# =========================================================
+# PARTICIONES
+# =========================================================
+
+def particionar(args):
+    """Convierte la tabla a particiones RANGE mensuales sobre fecha_hora"""
+    conn = _conectar()
+    try:
+        cursor = conn.cursor()
+        if particiones_actuales(cursor):
+            print("La tabla ya está particionada; use 'particiones' para crear meses nuevos.")
+            return
+
+        cursor.execute("""
+            SELECT TABLE_NAME FROM information_schema.KEY_COLUMN_USAGE
+            WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME = %s
+        """, (TABLA,))
+        referencias = [fila[0] for fila in cursor.fetchall()]
+        if referencias:
+            print(f"No se puede particionar: {', '.join(referencias)} tiene(n) llaves foráneas hacia {TABLA}.")
+            return
+
+        cursor.execute("""
+            SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+            WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """, (TABLA,))
+        foraneas = [fila[0] for fila in cursor.fetchall()]
+
+        cursor.execute("""
+            SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_NAME = 'PRIMARY'
+            ORDER BY ORDINAL_POSITION
+        """, (TABLA,))
+        llave = [fila[0] for fila in cursor.fetchall()]
+
+        tipo_fecha = _tipo_fecha(cursor)
+        cursor.execute(f"SELECT MIN(fecha_hora) FROM {TABLA}")
+        minimo = cursor.fetchone()[0]
+        primer_mes = _inicio_mes(minimo.date() if minimo else date.today())
+        ultimo_mes = _inicio_mes(date.today(), args.meses)
+
+        sentencias = [f"ALTER TABLE {TABLA} DROP FOREIGN KEY {nombre}" for nombre in foraneas]
+        if 'fecha_hora' not in llave:
+            # En la misma sentencia: id es AUTO_INCREMENT y no puede quedar sin llave
+            sentencias.append(f"ALTER TABLE {TABLA} DROP PRIMARY KEY, ADD PRIMARY KEY (id, fecha_hora)")
+
+        funcion = 'UNIX_TIMESTAMP' if tipo_fecha == 'timestamp' else 'TO_DAYS'
+        definiciones = []
+        mes = primer_mes
+        while mes <= ultimo_mes:
+            siguiente = _inicio_mes(mes, 1)
+            definiciones.append(f"PARTITION {_nombre_particion(mes)} VALUES LESS THAN "
+                                f"({_limite_particion(siguiente, tipo_fecha)})")
+            mes = siguiente
+        definiciones.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        sentencias.append(f"ALTER TABLE {TABLA} PARTITION BY RANGE ({funcion}(fecha_hora)) (\n    "
+                          + ",\n    ".join(definiciones) + "\n)")
+
+        if foraneas:
+            print(f"Aviso: se eliminan las llaves foráneas {', '.join(foraneas)} "
+                  "(MySQL no las admite en tablas particionadas).")
+        _ejecutar(cursor, sentencias, args.dry_run)
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def crear_particiones(args):
+    """Divide pmax para que existan particiones hasta `meses` meses adelante"""
+    conn = _conectar()
+    try:
+        cursor = conn.cursor()
+        particiones = particiones_actuales(cursor)
+        if not particiones:
+            print("La tabla no está particionada; ejecute 'particionar' primero.")
+            return
+        meses = [m for m in (_mes_de_particion(nombre) for nombre, _ in particiones) if m]
+        tipo_fecha = _tipo_fecha(cursor)
+        mes = _inicio_mes(max(meses), 1) if meses else _inicio_mes(date.today())
+        ultimo_mes = _inicio_mes(date.today(), args.meses)
+        nuevas = []
+        while mes <= ultimo_mes:
+            siguiente = _inicio_mes(mes, 1)
+            nuevas.append(f"PARTITION {_nombre_particion(mes)} VALUES LESS THAN "
+                          f"({_limite_particion(siguiente, tipo_fecha)})")
+            mes = siguiente
+        if not nuevas:
+            print("Las particiones ya cubren los próximos meses.")
+            return
+        # pmax está vacía mientras existan particiones futuras, así que reorganizarla es inmediato
+        _ejecutar(cursor, [f"ALTER TABLE {TABLA} REORGANIZE PARTITION pmax INTO (\n    "
+                           + ",\n    ".join(nuevas + ["PARTITION pmax VALUES LESS THAN MAXVALUE"]) + "\n)"],
+                  args.dry_run)
+        cursor.close()
+    finally:
+        conn.close()
+
+
+# =========================================================
+# ARCHIVO
+# =========================================================
+
+class ArchivoMensual:
+    """Escribe filas en archivos CSV gzip por mes; agrega un miembro gzip si el archivo ya existe"""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self._abiertos = {}
+        self.bytes_escritos = 0
+
+    def _archivo(self, mes):
+        if mes not in self._abiertos:
+            os.makedirs(self.directorio, exist_ok=True)
+            ruta = os.path.join(self.directorio, f"{TABLA}_{mes}.csv.gz")
+            nuevo = not os.path.exists(ruta)
+            crudo = open(ruta, 'ab')
+            comprimido = gzip.GzipFile(fileobj=crudo, mode='ab')
+            texto = io.TextIOWrapper(comprimido, encoding='utf-8', newline='')
+            escritor = csv.writer(texto)
+            if nuevo:
+                escritor.writerow(COLUMNAS)
+            self._abiertos[mes] = (crudo, comprimido, texto, escritor)
+        return self._abiertos[mes][3]
+
+    def escribir(self, filas):
+        for fila in filas:
+            self._archivo(f"{fila[3]:%Y-%m}").writerow(fila)
+
+    def sincronizar(self):
+        """Asegura en disco lo escrito antes de borrar las filas de la base"""
+        for crudo, comprimido, texto, _ in self._abiertos.values():
+            texto.flush()
+            comprimido.flush()
+            crudo.flush()
+            os.fsync(crudo.fileno())
+
+    def cerrar(self):
+        for crudo, comprimido, texto, _ in self._abiertos.values():
+            texto.close()
+            crudo.close()  # GzipFile no cierra el archivo que recibe
+            self.bytes_escritos += os.path.getsize(crudo.name)
+        self._abiertos = {}
+
+
+def _archivar_particion(conn, nombre, archivo, lote):
+    """Copia una partición completa al archivo; retorna las filas copiadas"""
+    cursor = conn.cursor(buffered=False)
+    total = 0
+    try:
+        cursor.execute(f"SELECT {', '.join(COLUMNAS)} FROM {TABLA} PARTITION ({nombre}) ORDER BY id")
+        while True:
+            filas = cursor.fetchmany(lote)
+            if not filas:
+                break
+            archivo.escribir(filas)
+            total += len(filas)
+    finally:
+        # Si falla la escritura quedan filas sin leer: cursor.close() lanzaría y ocultaría el error original
+        cerrar_cursor(cursor)
+    return total
+
+
+def archivar(args):
+    corte = datetime.combine(date.today() - timedelta(days=args.retencion_dias), datetime.min.time())
+    print(f"Archivando registros anteriores a {corte:%Y-%m-%d} en {args.destino}"
+          f"{' (dry-run)' if args.dry_run else ''}")
+    inicio = time.perf_counter()
+    reporte = {'filas_archivadas': 0, 'filas_borradas': 0, 'particiones_eliminadas': 0,
+               'segundos_lectura': 0.0, 'segundos_borrado': 0.0}
+
+    conn = _conectar()
+    archivo = ArchivoMensual(args.destino)
+    try:
+        cursor = conn.cursor()
+        # Particiones cuyo mes completo quedó fuera de la retención: se copian y se eliminan enteras
+        vencidas = [nombre for nombre, _ in particiones_actuales(cursor)
+                    if _mes_de_particion(nombre) and _inicio_mes(_mes_de_particion(nombre), 1) <= corte.date()]
+        if args.dry_run:
+            cursor.execute(f"SELECT COUNT(*) FROM {TABLA} WHERE fecha_hora < %s", (corte,))
+            print(f"Se archivarían {cursor.fetchone()[0]:,} registros; "
+                  f"particiones a eliminar: {', '.join(vencidas) or 'ninguna'}")
+            cursor.close()
+            return
+
+        for nombre in vencidas:
+            t = time.perf_counter()
+            filas = _archivar_particion(conn, nombre, archivo, args.lote)
+            archivo.sincronizar()
+            reporte['segundos_lectura'] += time.perf_counter() - t
+            t = time.perf_counter()
+            cursor.execute(f"ALTER TABLE {TABLA} DROP PARTITION {nombre}")
+            reporte['segundos_borrado'] += time.perf_counter() - t
+            reporte['filas_archivadas'] += filas
+            reporte['filas_borradas'] += filas
+            reporte['particiones_eliminadas'] += 1
+            print(f"  - partición {nombre}: {filas:,} filas archivadas y eliminada")
+
+        # El resto se recorre por id en lotes: leer, escribir al archivo, borrar y confirmar
+        ultimo_id = 0
+        while True:
+            t = time.perf_counter()
+            cursor.execute(f"""
+                SELECT {', '.join(COLUMNAS)} FROM {TABLA}
+                WHERE fecha_hora < %s AND id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (corte, ultimo_id, args.lote))
+            filas = cursor.fetchall()
+            if not filas:
+                break
+            archivo.escribir(filas)
+            archivo.sincronizar()
+            reporte['segundos_lectura'] += time.perf_counter() - t
+
+            t = time.perf_counter()
+            # Todas las filas vencidas con id en (ultimo_id, id final] están en este lote
+            cursor.execute(f"DELETE FROM {TABLA} WHERE id > %s AND id <= %s AND fecha_hora < %s",
+                           (ultimo_id, filas[-1][0], corte))
+            conn.commit()
+            reporte['segundos_borrado'] += time.perf_counter() - t
+            reporte['filas_archivadas'] += len(filas)
+            reporte['filas_borradas'] += cursor.rowcount
+            ultimo_id = filas[-1][0]
+            if args.pausa:
+                time.sleep(args.pausa)  # deja respirar a la réplica y a las peticiones en línea
+        cursor.close()
+    finally:
+        try:
+            archivo.cerrar()
+        finally:
+            conn.close()
+
+    duracion = time.perf_counter() - inicio
+    print("\n=== REPORTE DE ARCHIVADO ===")
+    print(f"Filas archivadas: {reporte['filas_archivadas']:,} | borradas: {reporte['filas_borradas']:,} | "
+          f"particiones eliminadas: {reporte['particiones_eliminadas']}")
+    print(f"Archivo: {archivo.bytes_escritos / 1024 / 1024:,.1f} MB comprimidos en {args.destino}")
+    print(f"Lectura y escritura: {reporte['segundos_lectura']:.1f}s | borrado: {reporte['segundos_borrado']:.1f}s")
+    print(f"Total: {duracion:.1f}s ({reporte['filas_archivadas'] / max(duracion, 1e-9):,.0f} filas/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento de logs_transacciones")
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+
+    p = subcomandos.add_parser('estado', help="Registros, rango de fechas y particiones")
+    p.add_argument('--retencion-dias', type=int, default=LOGS_RETENCION_DIAS)
+    p.set_defaults(funcion=estado)
+
+    p = subcomandos.add_parser('particionar', help="Convertir la tabla a particiones mensuales")
+    p.add_argument('--meses', type=int, default=3, help="Meses futuros con partición propia")
+    p.add_argument('--dry-run', action='store_true', help="Mostrar las sentencias sin ejecutarlas")
+    p.set_defaults(funcion=particionar)
+
+    p = subcomandos.add_parser('particiones', help="Crear particiones para los próximos meses")
+    p.add_argument('--meses', type=int, default=3)
+    p.add_argument('--dry-run', action='store_true')
+    p.set_defaults(funcion=crear_particiones)
+
+    p = subcomandos.add_parser('archivar', help="Mover registros antiguos a archivos comprimidos")
+    p.add_argument('--retencion-dias', type=int, default=LOGS_RETENCION_DIAS)
+    p.add_argument('--destino', default=LOGS_ARCHIVO_DIR, help="Directorio de los archivos .csv.gz")
+    p.add_argument('--lote', type=int, default=5000, help="Filas por lote (una transacción)")
+    p.add_argument('--pausa', type=float, default=0.0, help="Segundos de espera entre lotes")
+    p.add_argument('--dry-run', action='store_true')
+    p.set_defaults(funcion=archivar)
+
+    args = parser.parse_args()
+    args.funcion(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+-- =========================================================
+-- Índices usados por las estadísticas del panel administrativo
+-- (utils/estadisticas.py y la actividad reciente de /admin)
+-- =========================================================
+
+-- Actividad del día por rango: fecha_hora >= CURDATE() AND fecha_hora < CURDATE() + INTERVAL 1 DAY
+-- y ORDER BY fecha_hora DESC LIMIT 20
+CREATE INDEX idx_logs_fecha_hora ON logs_transacciones (fecha_hora);
+
+-- Conexiones del día: WHERE fecha = CURDATE()
+CREATE INDEX idx_trafico_fecha ON trafico_red (fecha);
+
+-- Usuarios por rol (GROUP BY rol) usa idx_usuarios_rol_creacion de la migración 002
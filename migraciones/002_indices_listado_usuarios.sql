@@ -0,0 +1,23 @@
+-- =========================================================
+-- Índices para el listado paginado de /admin/usuarios
+-- (utils/usuarios.py: paginación por llave sobre (fecha_creacion, id))
+-- =========================================================
+
+-- Orden y cursor: ORDER BY fecha_creacion DESC, id DESC
+--                 WHERE fecha_creacion < ? OR (fecha_creacion = ? AND id < ?)
+-- Requiere fecha_creacion NOT NULL (DEFAULT CURRENT_TIMESTAMP): las filas antiguas sin fecha
+-- toman la de la migración y la columna deja de aceptar NULL (si la tabla la declara DATETIME,
+-- conservar ese tipo en el MODIFY).
+UPDATE usuarios SET fecha_creacion = CURRENT_TIMESTAMP WHERE fecha_creacion IS NULL;
+ALTER TABLE usuarios MODIFY fecha_creacion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX idx_usuarios_creacion ON usuarios (fecha_creacion, id);
+
+-- Filtro por rol con el mismo orden; también sirve al GROUP BY rol de las estadísticas
+CREATE INDEX idx_usuarios_rol_creacion ON usuarios (rol, fecha_creacion, id);
+
+-- Filtro por tipo de documento con el mismo orden
+CREATE INDEX idx_usuarios_tipo_doc_creacion ON usuarios (tipo_documento_id, fecha_creacion, id);
+
+-- Búsqueda por prefijo: nombre LIKE 'abc%' OR correo LIKE 'abc%'
+-- (correo ya tiene índice único por la validación de registro; si no, crearlo)
+CREATE INDEX idx_usuarios_nombre ON usuarios (nombre);
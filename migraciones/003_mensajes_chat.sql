@@ -0,0 +1,19 @@
+-- =========================================================
+-- Tabla mensajes para el chat en tiempo real (utils/chat_servidor.py)
+-- Columnas que usan utils/mensajes.py: usuario_id, sala, contenido, fecha_hora
+-- ADD COLUMN IF NOT EXISTS requiere MariaDB (XAMPP) o MySQL 8.0.29+
+-- =========================================================
+
+CREATE TABLE IF NOT EXISTS mensajes (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    usuario_id INT NOT NULL,
+    sala VARCHAR(50) NOT NULL DEFAULT 'general',
+    contenido TEXT NOT NULL,
+    fecha_hora DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (usuario_id) REFERENCES usuarios(id)
+);
+
+ALTER TABLE mensajes ADD COLUMN IF NOT EXISTS sala VARCHAR(50) NOT NULL DEFAULT 'general';
+
+-- Historial paginado: WHERE sala = ? AND id < ? ORDER BY id DESC LIMIT ?
+CREATE INDEX idx_mensajes_sala_id ON mensajes (sala, id);
@@ -0,0 +1,7 @@
+-- =========================================================
+-- Índice para el conteo de mensajes del monitor XMPP
+-- (utils/xmpp_estado.py: mensajes de hoy y por minuto)
+-- =========================================================
+
+-- WHERE fecha_hora >= CURDATE()
+CREATE INDEX idx_mensajes_fecha_hora ON mensajes (fecha_hora);
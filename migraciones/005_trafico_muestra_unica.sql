@@ -0,0 +1,14 @@
+-- =========================================================
+-- Una fila por muestra en trafico_red
+-- (utils/ingesta_trafico.py: INSERT ... ON DUPLICATE KEY UPDATE)
+-- =========================================================
+
+-- Si la tabla ya tiene muestras repetidas el índice no se puede crear; para conservar
+-- una fila por llave antes de aplicarlo:
+--   CREATE TABLE trafico_red_unica LIKE trafico_red;
+--   ALTER TABLE trafico_red_unica ADD UNIQUE INDEX uq_trafico_muestra (zona_id, fecha, hora, tipo_dispositivo);
+--   INSERT IGNORE INTO trafico_red_unica SELECT * FROM trafico_red;
+--   RENAME TABLE trafico_red TO trafico_red_anterior, trafico_red_unica TO trafico_red;
+
+-- Una muestra por zona, día, hora y tipo de dispositivo; los reenvíos de los colectores actualizan la fila
+CREATE UNIQUE INDEX uq_trafico_muestra ON trafico_red (zona_id, fecha, hora, tipo_dispositivo);
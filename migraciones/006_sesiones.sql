@@ -0,0 +1,21 @@
+-- =========================================================
+-- Sesiones del lado del servidor con SESSION_BACKEND=mysql
+-- (utils/sesiones.py: AlmacenMySQL)
+-- =========================================================
+
+-- La cookie solo lleva el id; datos es la sesión serializada (usuario_id, mensajes flash)
+CREATE TABLE IF NOT EXISTS sesiones (
+    id VARCHAR(64) NOT NULL PRIMARY KEY,
+    usuario_id INT NULL,
+    datos TEXT NOT NULL,
+    expira DATETIME NOT NULL,
+    INDEX idx_sesiones_expira (expira),
+    INDEX idx_sesiones_usuario (usuario_id)
+);
+
+-- Usuarios editados: cada proceso descarta su caché de contexto de los marcados después de su última lectura
+CREATE TABLE IF NOT EXISTS sesiones_invalidaciones (
+    usuario_id INT NOT NULL PRIMARY KEY,
+    fecha DATETIME(6) NOT NULL,
+    INDEX idx_sesiones_invalidaciones_fecha (fecha)
+);
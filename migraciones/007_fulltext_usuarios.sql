@@ -0,0 +1,9 @@
+-- =========================================================
+-- Búsqueda de usuarios mientras el índice en memoria no está listo
+-- (utils/busqueda_usuarios.py: MATCH ... AGAINST en modo booleano)
+-- =========================================================
+
+-- Respaldo de /admin/api/usuarios/buscar al arrancar un worker:
+--   WHERE MATCH(nombre, correo, documento) AGAINST ('+ana* +gom*' IN BOOLEAN MODE)
+-- InnoDB ignora palabras más cortas que innodb_ft_min_token_size (3 por defecto).
+CREATE FULLTEXT INDEX ft_usuarios_busqueda ON usuarios (nombre, correo, documento);
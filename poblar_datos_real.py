@@ -1,6 +1,19 @@
 ﻿from werkzeug.security import generate_password_hash
 from utils.db_connection import get_db_connection
-from datetime import date, time
+from datetime import date, time, datetime, timedelta
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time as reloj
+import zlib
+
+import mysql.connector
+from config import MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB
+
 
 def poblar_datos_real():
     conn = get_db_connection()
@@ -58,9 +71,11 @@ def poblar_datos_real():
             (3, date.today(), time(13, 0), 'movil', 55, 78.9, 38.6),
         ]
         
+        # IGNORE: trafico_red tiene una fila por (zona, fecha, hora, dispositivo) (migración 005)
+        # y volver a poblar el mismo día no debe fallar
         for dato in datos_trafico:
             cursor.execute("""
-                INSERT INTO trafico_red 
+                INSERT IGNORE INTO trafico_red 
                 (zona_id, fecha, hora, tipo_dispositivo, usuarios_conectados, ancho_banda_consumido, latencia_promedio) 
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
             """, dato)
@@ -110,5 +125,322 @@ def poblar_datos_real():
         cursor.close()
         conn.close()
 
+# =========================================================
+# GENERACIÓN MASIVA PARA PRUEBAS DE CARGA
+# =========================================================
+#
+#   python poblar_datos_real.py --masivo --usuarios 1000000 --logs 5000000 --dias 365 --procesos 4
+#
+# Cada tabla se divide en bloques que insertan procesos en paralelo con
+# executemany (INSERT multi-fila) o LOAD DATA LOCAL INFILE. Los bloques
+# terminados se anotan en el archivo de progreso, así que si se interrumpe
+# basta con volver a ejecutar el mismo comando para continuar.
+
+DISPOSITIVOS = ['portatil', 'movil', 'tablet', 'escritorio']
+ACCIONES_LOG = [
+    'LOGIN: Inicio de sesión exitoso', 'LOGOUT: Cerró sesión',
+    'ACCESO_DASHBOARD: Accedió al panel de usuario', 'ACCESO_CHAT: Accedió al sistema de chat',
+]
+# Peso relativo de la actividad por hora del día (madrugada baja, picos a media mañana y tarde)
+CURVA_HORARIA = [1, 1, 1, 1, 1, 2, 4, 8, 12, 14, 15, 14, 12, 13, 15, 14, 12, 10, 8, 6, 5, 3, 2, 1]
+CONTRASENA_CARGA = 'estudiante123'
+
+COLUMNAS = {
+    'usuarios': ('tipo_documento_id', 'documento', 'nombre', 'correo', 'telefono', 'contrasena', 'rol'),
+    'trafico_red': ('zona_id', 'fecha', 'hora', 'tipo_dispositivo', 'usuarios_conectados',
+                    'ancho_banda_consumido', 'latencia_promedio'),
+    'logs_transacciones': ('id', 'usuario_id', 'accion', 'fecha_hora'),
+}
+
+
+def _filas_usuarios(tarea):
+    from faker import Faker  # solo se necesita en modo masivo
+
+    rnd = random.Random(tarea['semilla'])
+    fake = Faker('es_CO')
+    fake.seed_instance(tarea['semilla'])
+    # Faker es lento por llamada: se generan pocos nombres y se combinan
+    nombres = [fake.first_name() for _ in range(200)]
+    apellidos = [fake.last_name() for _ in range(200)]
+    tipos = tarea['tipos_documento']
+
+    for n in range(tarea['inicio'], tarea['inicio'] + tarea['cantidad']):
+        nombre = f"{rnd.choice(nombres)} {rnd.choice(apellidos)}"
+        yield (
+            rnd.choice(tipos),
+            str(3000000000 + n),
+            nombre,
+            f"{tarea['prefijo']}{n}@ucundinamarca.edu.co",
+            f"3{rnd.randint(100000000, 999999999)}",
+            tarea['hash'],
+            'administrador' if n % 5000 == 0 else 'estudiante',
+        )
+
+
+def _filas_trafico(tarea):
+    rnd = random.Random(tarea['semilla'])
+    inicio = date.fromisoformat(tarea['fecha_inicio'])
+    for d in range(tarea['inicio'], tarea['inicio'] + tarea['cantidad']):
+        dia = inicio + timedelta(days=d)
+        fin_de_semana = 0.35 if dia.weekday() >= 5 else 1.0
+        for zona in range(1, tarea['zonas'] + 1):
+            for hora in range(24):
+                for dispositivo in DISPOSITIVOS:
+                    carga = CURVA_HORARIA[hora] * fin_de_semana
+                    usuarios = max(0, int(rnd.gauss(carga * 4, carga)))
+                    ancho_banda = round(max(0.1, usuarios * rnd.uniform(1.5, 4.0)), 2)
+                    latencia = round(max(2.0, rnd.gauss(15 + carga * 2, 4)), 2)
+                    yield (zona, dia, time(hora, 0), dispositivo, usuarios, ancho_banda, latencia)
+
+
+def _filas_logs(tarea):
+    rnd = random.Random(tarea['semilla'])
+    inicio = datetime.fromisoformat(tarea['fecha_inicio'])
+    horas = list(range(24))
+    for n in range(tarea['inicio'], tarea['inicio'] + tarea['cantidad']):
+        hora = rnd.choices(horas, weights=CURVA_HORARIA)[0]
+        fecha = inicio + timedelta(days=rnd.randrange(tarea['dias']), hours=hora,
+                                   seconds=rnd.randrange(3600))
+        # id fijo por posición: un bloque repetido choca con sus propias filas y IGNORE las salta
+        yield (tarea['id_inicio'] + n, rnd.randint(tarea['usuario_min'], tarea['usuario_max']),
+               rnd.choice(ACCIONES_LOG), fecha)
+
+
+GENERADORES = {
+    'usuarios': _filas_usuarios,
+    'trafico_red': _filas_trafico,
+    'logs_transacciones': _filas_logs,
+}
+
+
+def _insertar_bloque(tarea):
+    """Proceso trabajador: genera un bloque de filas y lo inserta en una transacción"""
+    tabla = tarea['tabla']
+    columnas = COLUMNAS[tabla]
+    inicio = reloj.perf_counter()
+    conn = mysql.connector.connect(
+        host=MYSQL_HOST,
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD,
+        database=MYSQL_DB,
+        auth_plugin='mysql_native_password',
+        allow_local_infile=tarea['load_data']
+    )
+    cursor = conn.cursor()
+    filas = 0
+    try:
+        # INSERT IGNORE: si un bloque se repite tras una interrupción (o tras confirmarlo sin llegar a
+        # anotarlo en el progreso) no falla ni duplica: usuarios choca por correo, trafico_red por su
+        # índice único (migración 005) y logs_transacciones por el id fijo de cada fila
+        ignorar = 'IGNORE '
+        if tarea['load_data']:
+            with tempfile.NamedTemporaryFile('w', newline='', suffix='.csv', delete=False, encoding='utf-8') as f:
+                escritor = csv.writer(f)
+                for fila in GENERADORES[tabla](tarea):
+                    escritor.writerow(fila)
+                    filas += 1
+                ruta = f.name
+            try:
+                cursor.execute(f"""
+                    LOAD DATA LOCAL INFILE %s {ignorar.strip()} INTO TABLE {tabla}
+                    CHARACTER SET utf8mb4
+                    FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+                    LINES TERMINATED BY '\\r\\n'
+                    ({', '.join(columnas)})
+                """, (ruta,))
+            finally:
+                os.remove(ruta)
+        else:
+            consulta = (f"INSERT {ignorar}INTO {tabla} ({', '.join(columnas)}) "
+                        f"VALUES ({', '.join(['%s'] * len(columnas))})")
+            lote = []
+            for fila in GENERADORES[tabla](tarea):
+                lote.append(fila)
+                if len(lote) >= tarea['lote']:
+                    # mysql.connector convierte executemany de un INSERT en un único INSERT multi-fila
+                    cursor.executemany(consulta, lote)
+                    filas += len(lote)
+                    lote = []
+            if lote:
+                cursor.executemany(consulta, lote)
+                filas += len(lote)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    return tarea['tabla'], tarea['bloque'], filas, reloj.perf_counter() - inicio
+
+
+def _cargar_progreso(ruta, parametros):
+    if os.path.exists(ruta):
+        with open(ruta, encoding='utf-8') as f:
+            progreso = json.load(f)
+        if progreso.get('parametros') == parametros:
+            return progreso
+        print("El archivo de progreso corresponde a otros parámetros; se empieza de cero.")
+    return {'parametros': parametros, 'completados': {tabla: [] for tabla in COLUMNAS}}
+
+
+def _guardar_progreso(ruta, progreso):
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(progreso, f)
+    os.replace(temporal, ruta)
+
+
+def _ejecutar_tareas(tareas, procesos, progreso, ruta_progreso):
+    pendientes = [t for t in tareas if t['bloque'] not in progreso['completados'][t['tabla']]]
+    if not pendientes:
+        return {}
+    totales = {}
+    inicio = reloj.perf_counter()
+    # spawn: cada proceso abre sus propias conexiones en lugar de heredar sockets del padre
+    contexto = multiprocessing.get_context('spawn')
+    with contexto.Pool(procesos) as pool:
+        for tabla, bloque, filas, duracion in pool.imap_unordered(_insertar_bloque, pendientes):
+            progreso['completados'][tabla].append(bloque)
+            _guardar_progreso(ruta_progreso, progreso)
+            total = totales.setdefault(tabla, {'filas': 0, 'bloques': 0})
+            total['filas'] += filas
+            total['bloques'] += 1
+            transcurrido = reloj.perf_counter() - inicio
+            acumulado = sum(t['filas'] for t in totales.values())
+            print(f"  - {tabla} bloque {bloque}: {filas:,} filas en {duracion:.1f}s "
+                  f"({filas / duracion:,.0f} filas/s) | fase: {acumulado:,} filas, "
+                  f"{acumulado / transcurrido:,.0f} filas/s")
+    return totales
+
+
+def _dividir(tabla, total, tamano_bloque, base):
+    tareas = []
+    for bloque, inicio in enumerate(range(0, total, tamano_bloque)):
+        tarea = dict(base, tabla=tabla, bloque=bloque, inicio=inicio,
+                     cantidad=min(tamano_bloque, total - inicio))
+        # Semilla estable entre ejecuciones para que un bloque reanudado genere las mismas filas
+        tarea['semilla'] = zlib.crc32(f"{tabla}:{bloque}:{base['semilla_base']}".encode())
+        tareas.append(tarea)
+    return tareas
+
+
+def _reservar_ids_logs(progreso, cantidad, ruta_progreso):
+    """
+    Primer id de los logs generados. Se guarda en el progreso para que una carga reanudada
+    use los mismos ids, y AUTO_INCREMENT salta el rango para que la app no lo ocupe mientras tanto.
+    """
+    if 'logs_id_inicio' in progreso:
+        return progreso['logs_id_inicio']
+    conn = get_db_connection()
+    if not conn:
+        print("Error: No se pudo conectar a la base de datos")
+        return None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM logs_transacciones")
+        id_inicio = cursor.fetchone()[0]
+        cursor.execute(f"ALTER TABLE logs_transacciones AUTO_INCREMENT = {int(id_inicio + cantidad)}")
+        cursor.close()
+    finally:
+        conn.close()
+    progreso['logs_id_inicio'] = id_inicio
+    _guardar_progreso(ruta_progreso, progreso)
+    return id_inicio
+
+
+def poblar_masivo(args):
+    parametros = {k: v for k, v in vars(args).items() if k not in ('procesos', 'progreso')}
+    progreso = _cargar_progreso(args.progreso, parametros)
+
+    conn = get_db_connection()
+    if not conn:
+        print("Error: No se pudo conectar a la base de datos")
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM tipos_documento ORDER BY id")
+        tipos_documento = [fila[0] for fila in cursor.fetchall()] or [1]
+        cursor.close()
+    finally:
+        conn.close()
+
+    # Al reanudar se conserva la fecha de inicio original aunque haya cambiado el día
+    fecha_inicio = progreso.setdefault('fecha_inicio', (date.today() - timedelta(days=args.dias - 1)).isoformat())
+    base = {
+        'lote': args.lote,
+        'load_data': args.load_data,
+        'semilla_base': args.semilla,
+        'prefijo': args.prefijo,
+        'hash': generate_password_hash(CONTRASENA_CARGA),  # un solo hash para todos los usuarios
+        'tipos_documento': tipos_documento,
+        'zonas': args.zonas,
+        'dias': args.dias,
+        'fecha_inicio': fecha_inicio,
+    }
+
+    inicio = reloj.perf_counter()
+    resumen = {}
+
+    print(f"Insertando {args.usuarios:,} usuarios...")
+    resumen.update(_ejecutar_tareas(_dividir('usuarios', args.usuarios, args.bloque, base),
+                                    args.procesos, progreso, args.progreso))
+
+    # Los logs se reparten entre los ids de usuario que existen
+    conn = get_db_connection()
+    if not conn:
+        print("Error: No se pudo conectar a la base de datos")
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(id), MAX(id) FROM usuarios")
+        usuario_min, usuario_max = cursor.fetchone()
+        cursor.close()
+    finally:
+        conn.close()
+    if usuario_min is None:
+        print("No hay usuarios; no se pueden generar logs.")
+        return
+    id_inicio = _reservar_ids_logs(progreso, args.logs, args.progreso)
+    if id_inicio is None:
+        return
+
+    # trafico_red: el bloque es un rango de días (zonas x 24 horas x dispositivos por día)
+    filas_por_dia = args.zonas * 24 * len(DISPOSITIVOS)
+    dias_por_bloque = max(1, args.bloque // filas_por_dia)
+    tareas = _dividir('trafico_red', args.dias, dias_por_bloque, base)
+    tareas += _dividir('logs_transacciones', args.logs, args.bloque,
+                       dict(base, usuario_min=usuario_min, usuario_max=usuario_max, id_inicio=id_inicio))
+    print(f"Insertando {args.dias * filas_por_dia:,} muestras de tráfico y {args.logs:,} logs...")
+    resumen.update(_ejecutar_tareas(tareas, args.procesos, progreso, args.progreso))
+
+    duracion = reloj.perf_counter() - inicio
+    total_filas = sum(t['filas'] for t in resumen.values())
+    print("\n=== RESUMEN DE CARGA ===")
+    for tabla, total in resumen.items():
+        print(f"{tabla}: {total['filas']:,} filas en {total['bloques']} bloques")
+    print(f"Total: {total_filas:,} filas en {duracion:.1f}s ({total_filas / max(duracion, 1e-9):,.0f} filas/s)")
+    print(f"Contraseña de los usuarios generados: {CONTRASENA_CARGA}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pobla la base de datos (datos de ejemplo o carga masiva)")
+    parser.add_argument('--masivo', action='store_true', help="Generar datos sintéticos en volumen")
+    parser.add_argument('--usuarios', type=int, default=100000)
+    parser.add_argument('--logs', type=int, default=1000000)
+    parser.add_argument('--dias', type=int, default=90, help="Días de tráfico y logs hacia atrás desde hoy")
+    parser.add_argument('--zonas', type=int, default=3, help="Zonas de red (ids 1..N existentes)")
+    parser.add_argument('--procesos', type=int, default=4, help="Procesos trabajadores en paralelo")
+    parser.add_argument('--bloque', type=int, default=20000, help="Filas por bloque (una transacción)")
+    parser.add_argument('--lote', type=int, default=2000, help="Filas por INSERT multi-fila")
+    parser.add_argument('--load-data', action='store_true', help="Usar LOAD DATA LOCAL INFILE en lugar de INSERT")
+    parser.add_argument('--prefijo', default='carga', help="Prefijo de los correos generados")
+    parser.add_argument('--semilla', type=int, default=2024)
+    parser.add_argument('--progreso', default='poblar_progreso.json', help="Archivo para reanudar la carga")
+    args = parser.parse_args()
+
+    if args.masivo:
+        poblar_masivo(args)
+    else:
+        poblar_datos_real()
+
+
 if __name__ == "__main__":
-    poblar_datos_real()
\ No newline at end of file
+    main()
@@ -1,22 +1,88 @@
-document.addEventListener("DOMContentLoaded", () => {
-    const ctx = document.getElementById("activityChart");
+// admin_charts.js - Gráfica de actividad del panel administrativo
+//
+// Los datos vienen de /admin/api/series/actividad, ya agrupados y reducidos en el
+// servidor a un máximo de puntos. Con cache 'no-cache' el navegador envía
+// If-None-Match y el servidor responde 304 si nada cambió.
 
-    new Chart(ctx, {
-        type: "line",
+let activityChart = null;
+let ultimaSerie = null;
+const INTERVALO_ACTUALIZACION = 60000;
+
+function formatearEtiqueta(iso, bucketSegundos) {
+    const fecha = new Date(iso);
+    if (bucketSegundos >= 86400) {
+        return fecha.toLocaleDateString('es-CO', { weekday: 'short', day: 'numeric' });
+    }
+    return fecha.toLocaleString('es-CO', { weekday: 'short', hour: '2-digit', minute: '2-digit' });
+}
+
+function loadActivityChart() {
+    fetch('/admin/api/series/actividad?dias=7&puntos=150', { cache: 'no-cache' })
+        .then(respuesta => {
+            if (!respuesta.ok) throw new Error(`HTTP ${respuesta.status}`);
+            return respuesta.json();
+        })
+        .then(serie => {
+            // El 304 llega como 200 desde la caché del navegador: solo se redibuja si cambió
+            const firma = JSON.stringify(serie.valores) + JSON.stringify(serie.etiquetas);
+            if (firma === ultimaSerie) return;
+            ultimaSerie = firma;
+            updateChart({
+                labels: serie.etiquetas.map(e => formatearEtiqueta(e, serie.bucket_segundos)),
+                data: serie.valores
+            });
+        })
+        .catch(error => console.error('Error cargando la actividad:', error));
+}
+
+function updateChart(data) {
+    const activityCtx = document.getElementById('activityChart').getContext('2d');
+
+    if (activityChart) {
+        activityChart.destroy();
+    }
+
+    activityChart = new Chart(activityCtx, {
+        type: 'line',
         data: {
-            labels: ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"],
+            labels: data.labels,
             datasets: [{
-                label: "Actividad de usuarios",
-                data: [12, 19, 15, 22, 30, 25, 18],
+                label: 'Actividad',
+                data: data.data,
+                borderColor: '#00733B',
+                backgroundColor: 'rgba(0, 115, 59, 0.1)',
                 borderWidth: 2,
-                tension: 0.3
+                pointRadius: 0,
+                tension: 0.3,
+                fill: true
             }]
         },
         options: {
             responsive: true,
+            animation: false,
             plugins: {
-                legend: { display: true }
+                legend: {
+                    position: 'top',
+                },
+                title: {
+                    display: true,
+                    text: 'Actividad de Usuarios (Últimos 7 días)'
+                }
+            },
+            scales: {
+                x: {
+                    ticks: { maxTicksLimit: 14 }
+                },
+                y: {
+                    beginAtZero: true
+                }
             }
         }
     });
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    if (!document.getElementById('activityChart')) return;
+    loadActivityChart();
+    setInterval(loadActivityChart, INTERVALO_ACTUALIZACION);
 });
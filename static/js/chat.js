@@ -1,11 +1,160 @@
-// chat_mini.js - Control del mini chat en el dashboard
+// chat.js - Chat en tiempo real (página /chat y mini chat del dashboard)
+//
+// Recibe mensajes por Server-Sent Events desde utils/chat_servidor.py, los envía
+// con POST /mensajes y carga el historial paginado desde /chat/api/historial.
 
 let isMiniChatOpen = false;
 
+const chatState = {
+    url: null,
+    sala: 'general',
+    usuarioId: null,
+    container: null,
+    itemClass: 'message',
+    anterior: null,
+    vistos: new Set(),
+    // Últimos mensajes del historial: el stream puede reenviarlos al conectarse
+    finalHistorial: { fecha: null, claves: new Set() },
+    fuente: null
+};
+
+function chatBaseUrl(contenedor) {
+    const configurada = contenedor.dataset.chatUrl;
+    if (configurada) return configurada.replace(/\/$/, '');
+    return `${window.location.protocol}//${window.location.hostname}:5001`;
+}
+
+function iniciarChat(contenedor, mensajes, itemClass) {
+    chatState.url = chatBaseUrl(contenedor);
+    chatState.sala = contenedor.dataset.sala || 'general';
+    chatState.usuarioId = Number(contenedor.dataset.usuarioId);
+    chatState.container = mensajes;
+    chatState.itemClass = itemClass;
+
+    cargarHistorial().then(conectarStream);
+}
+
+function conectarStream() {
+    if (chatState.fuente) return;
+    // Lo publicado entre la consulta del historial y la conexión se pide al stream:
+    // desde la fecha del último mensaje del historial, o todo lo reciente si estaba vacío.
+    // Después EventSource reconecta solo y envía Last-Event-ID para recuperar lo perdido
+    const params = new URLSearchParams({ sala: chatState.sala });
+    if (chatState.finalHistorial.fecha) {
+        params.set('desde_fecha', chatState.finalHistorial.fecha);
+    } else {
+        params.set('desde', '0');
+    }
+    const fuente = new EventSource(`${chatState.url}/stream?${params.toString()}`, { withCredentials: true });
+    fuente.addEventListener('mensaje', (evento) => {
+        const mensaje = JSON.parse(evento.data);
+        if (yaEnHistorial(mensaje)) return;
+        if (mensaje.usuario_id === chatState.usuarioId && mensaje.t_cliente) {
+            reportarLatencia(Date.now() - mensaje.t_cliente);
+        }
+        mostrarMensaje(mensaje, false);
+    });
+    fuente.onerror = () => console.warn('Conexión con el chat interrumpida, reintentando...');
+    chatState.fuente = fuente;
+}
+
+function cargarHistorial() {
+    const params = new URLSearchParams({ sala: chatState.sala });
+    if (chatState.anterior) params.set('antes_de', chatState.anterior);
+
+    return fetch(`/chat/api/historial?${params.toString()}`)
+        .then(respuesta => respuesta.json())
+        .then(datos => {
+            // El historial llega en orden cronológico; se inserta arriba de lo ya mostrado
+            datos.mensajes.slice().reverse().forEach(mensaje => mostrarMensaje(mensaje, true));
+            if (!chatState.fuente && datos.mensajes.length) recordarFinalHistorial(datos.mensajes);
+            chatState.anterior = datos.anterior;
+            const boton = document.getElementById('cargar-anteriores');
+            if (boton) boton.style.display = datos.anterior ? '' : 'none';
+        })
+        .catch(error => console.error('Error cargando historial:', error));
+}
+
+function recordarFinalHistorial(mensajes) {
+    const fecha = mensajes[mensajes.length - 1].fecha_hora;
+    chatState.finalHistorial.fecha = fecha;
+    // El stream reenvía con un segundo de margen: se recuerdan los mensajes de ese tramo
+    mensajes.filter(m => Date.parse(fecha) - Date.parse(m.fecha_hora) <= 1000)
+        .forEach(m => chatState.finalHistorial.claves.add(`${m.usuario_id}|${m.contenido}`));
+}
+
+function yaEnHistorial(mensaje) {
+    const final = chatState.finalHistorial;
+    if (!final.fecha || Math.abs(Date.parse(mensaje.fecha_hora) - Date.parse(final.fecha)) > 2000) return false;
+    return final.claves.delete(`${mensaje.usuario_id}|${mensaje.contenido}`);
+}
+
+function enviarMensaje(input) {
+    const contenido = input.value.trim();
+    if (contenido === '') return;
+
+    fetch(`${chatState.url}/mensajes`, {
+        method: 'POST',
+        credentials: 'include',
+        // text/plain evita el preflight CORS; el servidor lo interpreta como JSON
+        headers: { 'Content-Type': 'text/plain' },
+        body: JSON.stringify({ sala: chatState.sala, contenido: contenido, t_cliente: Date.now() })
+    }).catch(error => console.error('Error enviando mensaje:', error));
+
+    input.value = '';
+    input.focus();
+}
+
+function reportarLatencia(ms) {
+    fetch(`${chatState.url}/latencia`, {
+        method: 'POST',
+        credentials: 'include',
+        headers: { 'Content-Type': 'text/plain' },
+        body: JSON.stringify({ ms: ms })
+    }).catch(() => {});
+}
+
+function mostrarMensaje(mensaje, alInicio) {
+    const clave = mensaje.t_cliente ? `${mensaje.usuario_id}-${mensaje.t_cliente}` : `db-${mensaje.id}`;
+    if (chatState.vistos.has(clave)) return;
+    chatState.vistos.add(clave);
+
+    const placeholder = chatState.container.querySelector('.placeholder');
+    if (placeholder) placeholder.remove();
+
+    const propio = mensaje.usuario_id === chatState.usuarioId;
+    const elemento = document.createElement('div');
+    elemento.className = `${chatState.itemClass} ${propio ? 'me' : 'other'}`;
+    elemento.textContent = propio ? mensaje.contenido : `${mensaje.usuario}: ${mensaje.contenido}`;
+
+    const boton = document.getElementById('cargar-anteriores');
+    if (alInicio) {
+        chatState.container.insertBefore(elemento, boton ? boton.nextSibling : chatState.container.firstChild);
+    } else {
+        chatState.container.appendChild(elemento);
+        chatState.container.scrollTop = chatState.container.scrollHeight;
+    }
+}
+
+// ----- Página /chat -----
+
+function sendMessage() {
+    enviarMensaje(document.getElementById('message'));
+}
+
+function handleKeyPress(event) {
+    if (event.key === 'Enter') {
+        event.preventDefault();
+        sendMessage();
+    }
+}
+
+// ----- Mini chat del dashboard -----
+
 function toggleChatMini() {
     const chatWindow = document.getElementById('chat-mini-window');
     const chatBtn = document.getElementById('chat-floating-btn');
-    
+
     if (isMiniChatOpen) {
         // Cerrar el mini chat
         chatWindow.style.display = 'none';
@@ -24,7 +173,12 @@ function toggleChatMini() {
             </svg>
         `;
         isMiniChatOpen = true;
-        
+
+        // La conexión se abre la primera vez que se despliega el mini chat
+        if (!chatState.container) {
+            iniciarChat(chatWindow, document.getElementById('mini-messages'), 'mini-message');
+        }
+
         // Enfocar el input cuando se abre
         setTimeout(() => {
             document.getElementById('mini-text').focus();
@@ -33,39 +187,7 @@ function toggleChatMini() {
 }
 
 function sendMiniMessage() {
-    const input = document.getElementById('mini-text');
-    const messagesContainer = document.getElementById('mini-messages');
-    const message = input.value.trim();
-    
-    if (message === '') return;
-    
-    // Remover placeholder si existe
-    const placeholder = messagesContainer.querySelector('.placeholder');
-    if (placeholder) {
-        placeholder.remove();
-    }
-    
-    // Crear elemento de mensaje (simulación)
-    addMessageToMiniChat(message, 'me');
-    
-    // Limpiar input
-    input.value = '';
-    
-    // Enfocar de nuevo el input
-    input.focus();
-}
-
-function addMessageToMiniChat(message, sender) {
-    const messagesContainer = document.getElementById('mini-messages');
-    
-    const messageElement = document.createElement('div');
-    messageElement.className = `mini-message ${sender}`;
-    messageElement.textContent = message;
-    
-    messagesContainer.appendChild(messageElement);
-    
-    // Scroll al final
-    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    enviarMensaje(document.getElementById('mini-text'));
 }
 
 function handleMiniKeyPress(event) {
@@ -79,9 +201,9 @@ function handleMiniKeyPress(event) {
 document.addEventListener('click', function(event) {
     const chatWindow = document.getElementById('chat-mini-window');
     const chatBtn = document.getElementById('chat-floating-btn');
-    
-    if (isMiniChatOpen && 
-        !chatWindow.contains(event.target) && 
+
+    if (isMiniChatOpen && chatWindow && chatBtn &&
+        !chatWindow.contains(event.target) &&
         !chatBtn.contains(event.target)) {
         toggleChatMini();
     }
@@ -89,12 +211,8 @@ document.addEventListener('click', function(event) {
 
 // Inicialización
 document.addEventListener('DOMContentLoaded', function() {
-    console.log('Mini chat inicializado');
-    
-    // Agregar algún mensaje de bienvenida si está vacío
-    const messagesContainer = document.getElementById('mini-messages');
-    if (messagesContainer.children.length === 1 && 
-        messagesContainer.querySelector('.placeholder')) {
-        // Puedes agregar un mensaje de bienvenida aquí si quieres
+    const chatBox = document.getElementById('chat-box');
+    if (chatBox) {
+        iniciarChat(chatBox, document.getElementById('chat-messages'), 'message');
     }
-});
\ No newline at end of file
+});
@@ -0,0 +1,260 @@
+"""
+Analítica de la tabla trafico_red con NumPy/pandas.
+
+Las muestras de un rango de fechas se leen por bloques con un cursor sin buffer y
+cada bloque se reduce a agregados parciales (sumas, conteos e histogramas), de modo
+que un año de muestras no tiene que caber en memoria. Los percentiles se obtienen
+de histogramas con bins logarítmicos (error relativo < 2%).
+"""
+import threading
+import time
+from datetime import date, timedelta, time as dt_time
+
+import numpy as np
+import pandas as pd
+
+from utils.db_connection import get_db_connection, cerrar_cursor
+
+COLUMNAS = ['zona_id', 'fecha', 'hora', 'tipo_dispositivo', 'usuarios_conectados',
+            'ancho_banda_consumido', 'latencia_promedio']
+METRICAS = ['usuarios_conectados', 'ancho_banda_consumido', 'latencia_promedio']
+PERCENTILES = (50, 95, 99)
+
+# Bins logarítmicos compartidos por todos los histogramas: 0.01 .. 1e6
+BORDES = np.concatenate(([0.0], np.geomspace(0.01, 1e6, 800)))
+CENTROS = np.concatenate(([0.0], np.sqrt(BORDES[1:-1] * BORDES[2:])))
+
+
+def leer_trafico(desde, hasta, zona_id=None, tamano_bloque=50000, despues_de=None, fabrica=get_db_connection):
+    """
+    Genera DataFrames de trafico_red entre dos fechas (inclusive), de a `tamano_bloque` filas.
+    Usa un cursor sin buffer: el servidor envía las filas a medida que se consumen.
+    Con despues_de=(fecha, hora) solo se leen las muestras posteriores a esa hora.
+    Los hilos de fondo pasan fabrica=get_db_connection_fondo.
+    """
+    consulta = f"""
+        SELECT {', '.join(COLUMNAS)}
+        FROM trafico_red
+        WHERE fecha BETWEEN %s AND %s
+    """
+    parametros = [desde, hasta]
+    if zona_id:
+        consulta += " AND zona_id = %s"
+        parametros.append(zona_id)
+    if despues_de:
+        fecha, hora = despues_de
+        consulta += " AND (fecha > %s OR (fecha = %s AND hora > %s))"
+        parametros.extend([fecha, fecha, dt_time(hora)])
+
+    conn = fabrica()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(consulta, parametros)
+        while True:
+            filas = cursor.fetchmany(tamano_bloque)
+            if not filas:
+                break
+            df = pd.DataFrame.from_records(filas, columns=COLUMNAS)
+            # TIME llega como timedelta desde mysql.connector
+            horas = df['hora']
+            if pd.api.types.is_timedelta64_dtype(horas) or (len(horas) and isinstance(horas.iloc[0], timedelta)):
+                df['hora'] = (pd.to_timedelta(horas).dt.total_seconds() // 3600).astype('int8')
+            else:
+                df['hora'] = pd.Series([h.hour for h in horas], dtype='int8')
+            for metrica in METRICAS:
+                df[metrica] = pd.to_numeric(df[metrica], errors='coerce').astype('float64')
+            yield df
+        cerrar_cursor(cursor)
+    finally:
+        # Un consumidor que deja de iterar cierra el generador con filas sin leer; el pool descarta la conexión
+        conn.close()
+
+
+class AcumuladorTrafico:
+    """Reduce bloques de muestras a agregados combinables por zona, hora, dispositivo y día"""
+
+    DIMENSIONES = {
+        'zona': ['zona_id'],
+        'hora': ['hora'],
+        'dispositivo': ['tipo_dispositivo'],
+        'zona_hora': ['zona_id', 'hora'],
+        'dia': ['fecha'],
+    }
+
+    _AGREGACIONES = {
+        f'{metrica}_{funcion}': (metrica, funcion)
+        for metrica in METRICAS for funcion in ('sum', 'count', 'max')
+    }
+
+    def __init__(self):
+        self._sumas = {nombre: None for nombre in self.DIMENSIONES}
+        self._histogramas = {}  # (dimension, metrica) -> DataFrame grupo x bin
+        self.muestras = 0
+
+    def agregar(self, df):
+        if df.empty:
+            return
+        self.muestras += len(df)
+        for nombre, claves in self.DIMENSIONES.items():
+            parcial = df.groupby(claves).agg(**self._AGREGACIONES)
+            anterior = self._sumas[nombre]
+            if anterior is not None:
+                parcial = pd.concat([anterior, parcial]).groupby(level=list(range(len(claves)))).agg(
+                    {columna: ('max' if columna.endswith('_max') else 'sum') for columna in parcial.columns})
+            self._sumas[nombre] = parcial
+
+        # Histogramas para percentiles de latencia y ancho de banda por zona y dispositivo
+        for nombre in ('zona', 'dispositivo'):
+            clave = self.DIMENSIONES[nombre][0]
+            for metrica in ('latencia_promedio', 'ancho_banda_consumido'):
+                valores = df[metrica].to_numpy()
+                validos = ~np.isnan(valores)
+                bins = np.searchsorted(BORDES, valores[validos], side='right') - 1
+                conteo = pd.crosstab(df[clave].to_numpy()[validos], np.clip(bins, 0, len(CENTROS) - 1))
+                llave = (nombre, metrica)
+                if llave in self._histogramas:
+                    conteo = self._histogramas[llave].add(conteo, fill_value=0)
+                self._histogramas[llave] = conteo
+
+    def _promedios(self, nombre):
+        sumas = self._sumas[nombre]
+        if sumas is None:
+            return pd.DataFrame()
+        resultado = pd.DataFrame(index=sumas.index)
+        for metrica in METRICAS:
+            resultado[f'{metrica}_promedio'] = sumas[f'{metrica}_sum'] / sumas[f'{metrica}_count']
+            resultado[f'{metrica}_max'] = sumas[f'{metrica}_max']
+        resultado['muestras'] = sumas['usuarios_conectados_count'].astype('int64')
+        resultado['ancho_banda_total'] = sumas['ancho_banda_consumido_sum']
+        usuarios = sumas['usuarios_conectados_sum']
+        resultado['ancho_banda_por_usuario'] = (resultado['ancho_banda_total'] / usuarios.where(usuarios > 0))
+        return resultado
+
+    def _percentiles(self, nombre, metrica):
+        conteo = self._histogramas.get((nombre, metrica))
+        if conteo is None:
+            return {}
+        acumulado = conteo.to_numpy().cumsum(axis=1)
+        totales = acumulado[:, -1:]
+        centros = CENTROS[conteo.columns.to_numpy()]
+        resultado = {}
+        for i, grupo in enumerate(conteo.index):
+            resultado[grupo] = {
+                f'p{p}': round(float(centros[np.searchsorted(acumulado[i], totales[i, 0] * p / 100)]), 2)
+                for p in PERCENTILES
+            }
+        return resultado
+
+    def resultado(self, ventana_media_movil=7):
+        """Rollups listos para JSON"""
+        por_zona = self._promedios('zona')
+        por_hora = self._promedios('hora')
+        por_dispositivo = self._promedios('dispositivo')
+        zona_hora = self._promedios('zona_hora')
+        por_dia = self._promedios('dia')
+
+        latencia_zona = self._percentiles('zona', 'latencia_promedio')
+        ancho_zona = self._percentiles('zona', 'ancho_banda_consumido')
+        latencia_dispositivo = self._percentiles('dispositivo', 'latencia_promedio')
+        ancho_dispositivo = self._percentiles('dispositivo', 'ancho_banda_consumido')
+
+        # Hora pico: mayor promedio de usuarios conectados (global y por zona)
+        hora_pico = int(por_hora['usuarios_conectados_promedio'].idxmax()) if not por_hora.empty else None
+        pico_zona = {}
+        if not zona_hora.empty:
+            usuarios = zona_hora['usuarios_conectados_promedio'].unstack('hora')
+            pico_zona = {zona: int(hora) for zona, hora in usuarios.idxmax(axis=1).items()}
+
+        # Serie diaria completa (días sin muestras en cero) con media móvil
+        if not por_dia.empty:
+            por_dia.index = pd.to_datetime(por_dia.index)
+            por_dia = por_dia.asfreq('D')
+            por_dia['ancho_banda_total'] = por_dia['ancho_banda_total'].fillna(0)
+            por_dia['ancho_banda_media_movil'] = por_dia['ancho_banda_total'].rolling(
+                ventana_media_movil, min_periods=1).mean()
+            por_dia['latencia_media_movil'] = por_dia['latencia_promedio_promedio'].rolling(
+                ventana_media_movil, min_periods=1).mean()
+
+        def _filas(df, nombre_clave, extra=None):
+            filas = []
+            for clave, fila in df.iterrows():
+                dato = {nombre_clave: clave.date().isoformat() if hasattr(clave, 'date') else _json(clave)}
+                dato.update({k: _redondear(v) for k, v in fila.items()})
+                if extra:
+                    for nombre, valores in extra.items():
+                        dato[nombre] = valores.get(clave)
+                filas.append(dato)
+            return filas
+
+        return {
+            'muestras': self.muestras,
+            'hora_pico': hora_pico,
+            'por_zona': _filas(por_zona, 'zona_id', {
+                'latencia_percentiles': latencia_zona,
+                'ancho_banda_percentiles': ancho_zona,
+                'hora_pico': pico_zona,
+            }),
+            'por_hora': _filas(por_hora, 'hora'),
+            'por_dispositivo': _filas(por_dispositivo, 'tipo_dispositivo', {
+                'latencia_percentiles': latencia_dispositivo,
+                'ancho_banda_percentiles': ancho_dispositivo,
+            }),
+            'por_dia': _filas(por_dia, 'fecha'),
+            'ventana_media_movil': ventana_media_movil,
+        }
+
+
+def _json(valor):
+    return valor.item() if isinstance(valor, np.generic) else valor
+
+
+def _redondear(valor):
+    valor = _json(valor)
+    if isinstance(valor, float):
+        return None if np.isnan(valor) else round(valor, 2)
+    return valor
+
+
+def analizar_trafico(desde, hasta, zona_id=None, tamano_bloque=50000, ventana_media_movil=7):
+    """Rollups de trafico_red en el rango, procesando las muestras por bloques"""
+    inicio = time.perf_counter()
+    acumulador = AcumuladorTrafico()
+    for bloque in leer_trafico(desde, hasta, zona_id, tamano_bloque):
+        acumulador.agregar(bloque)
+    resultado = acumulador.resultado(ventana_media_movil)
+    resultado.update({
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'zona_id': zona_id,
+        'duracion_ms': round((time.perf_counter() - inicio) * 1000, 1),
+    })
+    return resultado
+
+
+_cache = {}
+_cache_candado = threading.Lock()
+CACHE_TTL = 60
+
+
+def analizar_trafico_cacheado(desde, hasta, zona_id=None):
+    """analizar_trafico con una caché corta por parámetros para los refrescos de las gráficas"""
+    llave = (desde, hasta, zona_id)
+    ahora = time.monotonic()
+    with _cache_candado:
+        guardado = _cache.get(llave)
+        if guardado and ahora - guardado[0] < CACHE_TTL:
+            return guardado[1]
+    resultado = analizar_trafico(desde, hasta, zona_id)
+    with _cache_candado:
+        _cache[llave] = (ahora, resultado)
+        # Se descartan las entradas vencidas para que la caché no crezca sin límite
+        for clave in [k for k, (t, _) in _cache.items() if ahora - t >= CACHE_TTL]:
+            del _cache[clave]
+    return resultado
+
+
+def rango_por_defecto(dias=30):
+    hasta = date.today()
+    return hasta - timedelta(days=dias - 1), hasta
@@ -0,0 +1,427 @@
+"""
+Detección de anomalías en las muestras de trafico_red.
+
+- Línea base por zona: mediana y MAD (desviación absoluta mediana) de usuarios, ancho
+  de banda y latencia por hora del día y tipo de dispositivo. Una muestra es anómala
+  si el z robusto de alguna métrica supera ANOMALIAS_UMBRAL_Z
+- Con ANOMALIAS_METODO='isolation' se entrena además un IsolationForest por zona sobre
+  esos z, que marca combinaciones raras aunque ninguna métrica se salga por sí sola
+- El entrenamiento corre en un hilo de fondo, reparte las zonas entre procesos con
+  joblib y guarda los modelos en disco: al reiniciar se cargan en lugar de reentrenar.
+  Un candado de archivo deja entrenar a un solo worker; los demás cargan su resultado
+- Las muestras nuevas se evalúan por incrementos: los lotes de la ingesta apenas se
+  escriben y, periódicamente, las de las últimas ANOMALIAS_MARGEN_HORAS en adelante
+  (así se revisan también las que llegan tarde o por otro worker)
+- Las anomalías se guardan en un archivo JSON compartido: /admin/estadisticas muestra
+  lo mismo sin importar qué worker responde
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from config import (ANOMALIAS_METODO, ANOMALIAS_UMBRAL_Z, ANOMALIAS_DIAS_ENTRENAMIENTO,
+                    ANOMALIAS_REENTRENAR_HORAS, ANOMALIAS_INTERVALO, ANOMALIAS_MARGEN_HORAS,
+                    ANOMALIAS_N_JOBS, ANOMALIAS_DIR, ANOMALIAS_MAXIMAS)
+from utils.analitica_trafico import COLUMNAS, METRICAS, leer_trafico
+from utils.archivos import bloqueo_archivo, reemplazar
+from utils.db_connection import get_db_connection_fondo
+from utils.ingesta_trafico import buffer_trafico
+
+logger = logging.getLogger(__name__)
+
+# Cambiar si cambia el formato de los modelos guardados en disco
+VERSION_MODELO = 1
+ARCHIVO_MODELOS = 'anomalias_trafico.joblib'
+ARCHIVO_ANOMALIAS = 'anomalias_recientes.json'
+
+# Grupos (hora, dispositivo) con menos muestras usan la línea base del dispositivo en la zona
+MINIMO_MUESTRAS = 8
+# La escala nunca baja del 5% de la mediana: evita z enormes en métricas casi constantes
+ESCALA_MINIMA_RELATIVA = 0.05
+# Horas hacia atrás que se evalúan la primera vez que arranca el detector
+HORAS_INICIALES = 24
+
+
+def _llave(anomalia):
+    return (anomalia['zona_id'], anomalia['fecha'], anomalia['hora'], anomalia['tipo_dispositivo'])
+
+
+def _linea_base(df, claves):
+    """Mediana, escala robusta (1.4826 * MAD) y muestras de cada métrica por grupo"""
+    grupos = df.groupby(claves)
+    medianas = grupos[METRICAS].median()
+    desviaciones = (df[METRICAS] - grupos[METRICAS].transform('median')).abs()
+    mad = desviaciones.groupby([df[c] for c in claves]).median()
+    escala = np.maximum(1.4826 * mad, ESCALA_MINIMA_RELATIVA * medianas.abs()).clip(lower=1e-6)
+
+    base = pd.DataFrame(index=medianas.index)
+    for metrica in METRICAS:
+        base[f'{metrica}_mediana'] = medianas[metrica]
+        base[f'{metrica}_escala'] = escala[metrica]
+    base['muestras'] = grupos.size()
+    return base[base['muestras'] >= MINIMO_MUESTRAS]
+
+
+def puntajes_z(modelo, df):
+    """DataFrame con el valor esperado y el z robusto de cada métrica (índice de df)"""
+    especifica = df.join(modelo['base'], on=['hora', 'tipo_dispositivo'])
+    general = df.join(modelo['general'], on='tipo_dispositivo')
+    resultado = pd.DataFrame(index=df.index)
+    for metrica in METRICAS:
+        mediana = especifica[f'{metrica}_mediana'].fillna(general[f'{metrica}_mediana'])
+        escala = especifica[f'{metrica}_escala'].fillna(general[f'{metrica}_escala'])
+        resultado[f'{metrica}_esperado'] = mediana
+        resultado[f'{metrica}_z'] = (df[metrica] - mediana) / escala
+    return resultado
+
+
+def entrenar_zona(zona_id, df, metodo):
+    """Modelo de una zona (se ejecuta en un proceso de joblib)"""
+    if len(df) < MINIMO_MUESTRAS:
+        return None
+    modelo = {
+        'zona_id': zona_id,
+        'muestras': len(df),
+        'base': _linea_base(df, ['hora', 'tipo_dispositivo']),
+        'general': _linea_base(df, ['tipo_dispositivo']),
+        'bosque': None,
+    }
+    if metodo == 'isolation':
+        from sklearn.ensemble import IsolationForest  # solo se carga con este método
+
+        z = puntajes_z(modelo, df)[[f'{m}_z' for m in METRICAS]].fillna(0).to_numpy()
+        modelo['bosque'] = IsolationForest(n_estimators=100, contamination='auto',
+                                           random_state=0, n_jobs=1).fit(z)
+    return modelo
+
+
+class DetectorAnomalias:
+    """Modelos por zona, evaluación incremental y anomalías recientes en memoria"""
+
+    def __init__(self, directorio='modelos', metodo='robusto', umbral_z=3.5, dias_entrenamiento=28,
+                 reentrenar_horas=24, intervalo=300, margen_horas=2, n_jobs=-1, maximo=500):
+        self.directorio = directorio
+        self.metodo = metodo
+        self.umbral_z = umbral_z
+        self.dias_entrenamiento = dias_entrenamiento
+        self.reentrenar = reentrenar_horas * 3600
+        self.intervalo = intervalo
+        self.margen_horas = margen_horas
+        self.n_jobs = n_jobs
+        self.maximo = maximo
+
+        self._modelos = None
+        self._info = None
+        self._anomalias = OrderedDict()  # (zona, fecha, hora, dispositivo) -> anomalía (copia del archivo)
+        self._version_anomalias = None   # st_mtime_ns del archivo leído
+        self._marca = None  # (fecha, hora) de la última muestra evaluada
+        self._candado = threading.Lock()
+        self._candado_entrenamiento = threading.Lock()
+        self._despertar = threading.Event()
+        self._forzar = False
+        self._pid = None
+        self._hilo = None
+
+        # Contadores
+        self._evaluadas = 0
+        self._entrenamientos = 0
+        self._errores = 0
+        self._ultimo_error = None
+
+    @property
+    def ruta(self):
+        return os.path.join(self.directorio, ARCHIVO_MODELOS)
+
+    @property
+    def ruta_anomalias(self):
+        return os.path.join(self.directorio, ARCHIVO_ANOMALIAS)
+
+    # ----- Modelos -----
+
+    def _aplicar(self, datos):
+        with self._candado:
+            self._modelos = datos['modelos']
+            self._info = {clave: valor for clave, valor in datos.items() if clave != 'modelos'}
+
+    def _vigente(self):
+        return self._info is not None and time.time() - self._info['entrenado'] < self.reentrenar
+
+    def cargar(self):
+        """Carga los modelos guardados si son compatibles con la configuración actual"""
+        if not os.path.exists(self.ruta):
+            return False
+        import joblib
+
+        try:
+            datos = joblib.load(self.ruta)
+        except Exception as e:
+            logger.error("Error cargando los modelos de anomalías: %s", e)
+            return False
+        if datos.get('version') != VERSION_MODELO or datos.get('metodo') != self.metodo:
+            return False
+        self._aplicar(datos)
+        return True
+
+    def entrenar(self, forzar=False):
+        """Entrena los modelos de todas las zonas con los últimos días y los guarda en disco"""
+        from joblib import Parallel, delayed, dump
+
+        solicitado = time.time()
+        with self._candado_entrenamiento, bloqueo_archivo(self.ruta + '.lock'):
+            # Otro worker pudo haberlos entrenado y guardado mientras se esperaba el candado
+            if self.cargar() and self._vigente() and (not forzar or self._info['entrenado'] > solicitado):
+                return self._info
+
+            inicio = time.perf_counter()
+            hasta = date.today()
+            desde = hasta - timedelta(days=self.dias_entrenamiento - 1)
+            bloques = list(leer_trafico(desde, hasta, fabrica=get_db_connection_fondo))
+            if not bloques:
+                logger.warning("Sin muestras de tráfico para entrenar los modelos de anomalías")
+                return None
+            df = pd.concat(bloques, ignore_index=True)
+
+            resultados = Parallel(n_jobs=self.n_jobs)(
+                delayed(entrenar_zona)(zona_id, grupo, self.metodo)
+                for zona_id, grupo in df.groupby('zona_id')
+            )
+            datos = {
+                'version': VERSION_MODELO,
+                'metodo': self.metodo,
+                'entrenado': time.time(),
+                'desde': desde.isoformat(),
+                'hasta': hasta.isoformat(),
+                'muestras': len(df),
+                'duracion_segundos': round(time.perf_counter() - inicio, 1),
+                'modelos': {modelo['zona_id']: modelo for modelo in resultados if modelo},
+            }
+            reemplazar(self.ruta, lambda temporal: dump(datos, temporal))
+            self._aplicar(datos)
+            self._entrenamientos += 1
+            logger.info("Modelos de anomalías entrenados", extra={
+                'zonas': len(datos['modelos']), 'muestras': len(df),
+                'duracion_segundos': datos['duracion_segundos']})
+            return self._info
+
+    def solicitar_reentrenamiento(self):
+        """Reentrena en el hilo de fondo en la próxima vuelta"""
+        self._forzar = True
+        self._asegurar_hilo()
+        self._despertar.set()
+
+    # ----- Evaluación -----
+
+    def evaluar(self, df):
+        """Evalúa un DataFrame de muestras (columnas de leer_trafico); retorna las anomalías nuevas"""
+        with self._candado:
+            modelos = self._modelos
+        if not modelos or df.empty:
+            return []
+        nuevas = []
+        for zona_id, grupo in df.groupby('zona_id'):
+            modelo = modelos.get(zona_id)
+            if modelo is None:
+                continue
+            z = puntajes_z(modelo, grupo)
+            columnas_z = [f'{m}_z' for m in METRICAS]
+            maximo_z = z[columnas_z].abs().max(axis=1)
+            if modelo['bosque'] is not None:
+                matriz = z[columnas_z].fillna(0).to_numpy()
+                marcadas = modelo['bosque'].predict(matriz) == -1
+                puntajes = -modelo['bosque'].score_samples(matriz)
+            else:
+                marcadas = (maximo_z > self.umbral_z).to_numpy()
+                puntajes = maximo_z.to_numpy()
+
+            for posicion in np.flatnonzero(marcadas):
+                fila = grupo.iloc[posicion]
+                detalle = z.iloc[posicion]
+                nuevas.append({
+                    'zona_id': int(zona_id),
+                    'fecha': fila['fecha'].isoformat(),
+                    'hora': int(fila['hora']),
+                    'tipo_dispositivo': fila['tipo_dispositivo'],
+                    'puntaje': round(float(puntajes[posicion]), 2),
+                    'metricas': {
+                        metrica: {
+                            'valor': _redondear(fila[metrica]),
+                            'esperado': _redondear(detalle[f'{metrica}_esperado']),
+                            'z': _redondear(detalle[f'{metrica}_z']),
+                        }
+                        for metrica in METRICAS
+                    },
+                    'detectada': datetime.now().isoformat(timespec='seconds'),
+                })
+
+        with self._candado:
+            self._evaluadas += len(df)
+        return self._registrar(nuevas)
+
+    # ----- Anomalías compartidas entre workers -----
+
+    def _leer_anomalias(self):
+        try:
+            with open(self.ruta_anomalias, encoding='utf-8') as f:
+                return OrderedDict((_llave(a), a) for a in json.load(f))
+        except FileNotFoundError:
+            return OrderedDict()
+        except ValueError as e:
+            logger.error("Archivo de anomalías dañado, se descarta: %s", e)
+            return OrderedDict()
+
+    def _registrar(self, nuevas):
+        """Agrega las anomalías al archivo compartido; retorna las que no estaban"""
+        if not nuevas:
+            return []
+        with bloqueo_archivo(self.ruta_anomalias + '.lock'):
+            actuales = self._leer_anomalias()
+            # La misma muestra puede llegar por la ingesta, la revisión periódica u otro worker
+            registradas = [a for a in nuevas if _llave(a) not in actuales]
+            if registradas:
+                for anomalia in registradas:
+                    actuales[_llave(anomalia)] = anomalia
+                ordenadas = sorted(actuales.values(), key=lambda a: (a['fecha'], a['hora']))[-self.maximo:]
+                actuales = OrderedDict((_llave(a), a) for a in ordenadas)
+
+                def escribir(temporal):
+                    with open(temporal, 'w', encoding='utf-8') as f:
+                        json.dump(ordenadas, f, ensure_ascii=False)
+                reemplazar(self.ruta_anomalias, escribir)
+            version = os.stat(self.ruta_anomalias).st_mtime_ns if os.path.exists(self.ruta_anomalias) else None
+        with self._candado:
+            self._anomalias = actuales
+            self._version_anomalias = version
+        return registradas
+
+    def _sincronizar(self):
+        """Relee el archivo compartido si otro worker lo cambió"""
+        try:
+            version = os.stat(self.ruta_anomalias).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if version == self._version_anomalias:
+            return
+        actuales = self._leer_anomalias()
+        with self._candado:
+            self._anomalias = actuales
+            self._version_anomalias = version
+
+    def evaluar_lote(self, lote):
+        """Evalúa tuplas recién escritas por la ingesta (en el orden de COLUMNAS)"""
+        df = pd.DataFrame.from_records(lote, columns=COLUMNAS)
+        df['hora'] = pd.Series([hora.hour for hora in df['hora']], dtype='int8')
+        return self.evaluar(df)
+
+    def evaluar_nuevas(self):
+        """
+        Lee y evalúa las muestras desde margen_horas antes de la última revisada: las que
+        llegan tarde para esas horas o las que ingirió otro worker también se evalúan
+        (las anomalías ya registradas no se repiten).
+        """
+        if self._marca is None:
+            inicio = datetime.now() - timedelta(hours=HORAS_INICIALES)
+            self._marca = (inicio.date(), inicio.hour)
+        desde = datetime.combine(self._marca[0], datetime.min.time()) + timedelta(
+            hours=self._marca[1] - self.margen_horas)
+        total = 0
+        for bloque in leer_trafico(desde.date(), date.today(), despues_de=(desde.date(), desde.hour),
+                                   fabrica=get_db_connection_fondo):
+            self.evaluar(bloque)
+            total += len(bloque)
+            ultima = bloque.sort_values(['fecha', 'hora']).iloc[-1]
+            self._marca = max(self._marca, (ultima['fecha'], int(ultima['hora'])))
+        return total
+
+    # ----- Hilo de fondo -----
+
+    def _asegurar_hilo(self):
+        # Tras un fork (gunicorn --preload) el hilo del padre no existe en el hijo
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        with self._candado:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="detector-anomalias", daemon=True)
+            self._pid = os.getpid()
+            self._hilo.start()
+
+    def _bucle(self):
+        self.cargar()
+        while True:
+            try:
+                if self._forzar or not self._vigente():
+                    forzar, self._forzar = self._forzar, False
+                    self.entrenar(forzar=forzar)
+                if self._modelos:
+                    self.evaluar_nuevas()
+            except Exception as e:
+                logger.error("Error en el detector de anomalías: %s", e)
+                self._errores += 1
+                self._ultimo_error = str(e)
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+
+    # ----- Consulta -----
+
+    def anomalias(self, zona_id=None, limite=50):
+        """Anomalías más recientes primero (opcionalmente de una zona)"""
+        self._asegurar_hilo()
+        self._sincronizar()
+        with self._candado:
+            lista = list(self._anomalias.values())
+        lista.sort(key=lambda a: (a['fecha'], a['hora']), reverse=True)
+        if zona_id:
+            lista = [a for a in lista if a['zona_id'] == zona_id]
+        return lista[:limite]
+
+    def estadisticas(self):
+        self._asegurar_hilo()
+        self._sincronizar()
+        with self._candado:
+            info = dict(self._info) if self._info else None
+            total = len(self._anomalias)
+            por_zona = {}
+            for anomalia in self._anomalias.values():
+                por_zona[anomalia['zona_id']] = por_zona.get(anomalia['zona_id'], 0) + 1
+        if info:
+            info['entrenado'] = datetime.fromtimestamp(info['entrenado']).isoformat(timespec='seconds')
+        return {
+            'metodo': self.metodo,
+            'umbral_z': self.umbral_z,
+            'modelo': info,
+            'zonas_con_modelo': len(self._modelos or {}),
+            'anomalias': total,
+            'anomalias_por_zona': por_zona,
+            'muestras_evaluadas': self._evaluadas,
+            'ultima_muestra': f"{self._marca[0].isoformat()} {self._marca[1]:02d}:00" if self._marca else None,
+            'entrenamientos': self._entrenamientos,
+            'errores': self._errores,
+            'ultimo_error': self._ultimo_error,
+        }
+
+
+def _redondear(valor):
+    valor = float(valor)
+    return None if np.isnan(valor) else round(valor, 2)
+
+
+detector_anomalias = DetectorAnomalias(
+    directorio=ANOMALIAS_DIR,
+    metodo=ANOMALIAS_METODO,
+    umbral_z=ANOMALIAS_UMBRAL_Z,
+    dias_entrenamiento=ANOMALIAS_DIAS_ENTRENAMIENTO,
+    reentrenar_horas=ANOMALIAS_REENTRENAR_HORAS,
+    intervalo=ANOMALIAS_INTERVALO,
+    margen_horas=ANOMALIAS_MARGEN_HORAS,
+    n_jobs=ANOMALIAS_N_JOBS,
+    maximo=ANOMALIAS_MAXIMAS
+)
+
+buffer_trafico.suscribir(detector_anomalias.evaluar_lote)
@@ -0,0 +1,81 @@
+"""
+Archivos compartidos por los workers de gunicorn de la misma máquina.
+
+- bloqueo_archivo: candado entre procesos (e hilos) sobre un archivo .lock
+- reemplazar: escribe en un temporal único del mismo directorio y lo pone en su lugar
+  de una vez, así un lector nunca ve un archivo a medio escribir
+- escribir_json / leer_json: lo mismo para estados pequeños en JSON
+- proceso_vivo: si el worker dueño de un archivo por PID sigue corriendo
+"""
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso (python app.py), no hace falta candado entre procesos
+    fcntl = None
+
+
+@contextmanager
+def bloqueo_archivo(ruta, esperar=True):
+    """
+    Toma el candado sobre `ruta`; entrega True si lo tiene. Con esperar=False entrega
+    False en lugar de esperar cuando otro proceso ya lo tiene.
+    """
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    with open(ruta, 'a') as archivo:
+        if fcntl:
+            try:
+                fcntl.flock(archivo, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        try:
+            yield True
+        finally:
+            if fcntl:
+                fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+def reemplazar(ruta, escribir):
+    """Llama a escribir(temporal) y reemplaza `ruta` con el resultado"""
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta) or '.', suffix='.tmp')
+    os.close(descriptor)
+    try:
+        escribir(temporal)
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def escribir_json(ruta, datos):
+    def escribir(temporal):
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(datos, f)
+    reemplazar(ruta, escribir)
+
+
+def leer_json(ruta):
+    """Contenido del archivo o None si no existe o está dañado"""
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def proceso_vivo(pid):
+    """True si existe un proceso con ese PID en esta máquina (el propio siempre lo está)"""
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,315 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import mysql.connector
+
+from config import (AUDIT_QUEUE_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL,
+                    AUDIT_OVERFLOW_POLICY, AUDIT_BLOCK_TIMEOUT, AUDIT_SPILL_PATH)
+from utils.archivos import proceso_vivo
+from utils.db_connection import get_db_connection_fondo
+
+logger = logging.getLogger(__name__)
+
+POLITICAS = ('bloquear', 'descartar', 'disco')
+
+_FIN = object()
+
+# Errores de la base por los datos de una fila (usuario borrado, acción demasiado larga):
+# reintentar no sirve, la fila se descarta y el resto del lote se escribe. ProgrammingError
+# no entra: tabla inexistente o sin permiso afectan a todo el lote y va al derrame
+ERRORES_DE_DATOS = (mysql.connector.errors.DataError, mysql.connector.errors.IntegrityError)
+
+
+class EscritorAuditoria:
+    """
+    Escritor asíncrono de logs_transacciones.
+
+    Las peticiones solo encolan el registro; un hilo en segundo plano vacía la cola
+    con INSERT de varias filas cuando se alcanza el tamaño de lote o el intervalo.
+    Si la cola se llena se aplica la política configurada:
+
+    - bloquear: la petición espera hasta timeout_bloqueo y luego descarta
+    - descartar: el registro se descarta de inmediato
+    - disco: el registro se escribe en un archivo JSONL que se reprocesa luego
+
+    Si la base rechaza un lote se divide en mitades hasta aislar las filas rechazadas;
+    solo esas se descartan. Lo que no se pudo escribir por falta de conexión vuelve al
+    archivo de derrame, que se borra recién cuando cada fila quedó en la base o de nuevo
+    en el derrame (tras una caída puede reinsertarse alguna fila, no perderse).
+    """
+
+    def __init__(self, fabrica_conexion=get_db_connection_fondo, capacidad=10000, tamano_lote=200,
+                 intervalo=1.0, politica='disco', timeout_bloqueo=0.05, ruta_derrame=None):
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de auditoría no válida: {politica}")
+        self._fabrica = fabrica_conexion
+        self.capacidad = capacidad
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.politica = politica
+        self.timeout_bloqueo = timeout_bloqueo
+        self.ruta_derrame = ruta_derrame
+
+        self._candado = threading.Lock()
+        self._candado_disco = threading.Lock()
+        self._pid = None
+        self._cola = None
+        self._hilo = None
+        self._ultimo_ok = True
+        self._suscriptores = []
+
+        # Contadores
+        self._encolados = 0
+        self._escritos = 0
+        self._descartados = 0
+        self._derramados = 0
+        self._recuperados = 0
+        self._rechazados = 0
+        self._lotes = 0
+        self._errores = 0
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+
+    def registrar(self, usuario_id, accion):
+        """Encola un registro de auditoría sin tocar la base de datos"""
+        self._asegurar_hilo()
+        fila = (usuario_id, accion, datetime.now())
+        try:
+            if self.politica == 'bloquear':
+                self._cola.put(fila, timeout=self.timeout_bloqueo)
+            else:
+                self._cola.put_nowait(fila)
+        except queue.Full:
+            if self.politica == 'disco' and self._derramar([fila]):
+                return True
+            with self._candado:
+                self._descartados += 1
+            return False
+        with self._candado:
+            self._encolados += 1
+        return True
+
+    def suscribir(self, funcion):
+        """Registra una función que recibe cada lote (usuario_id, accion, fecha_hora) ya escrito"""
+        self._suscriptores.append(funcion)
+
+    def vaciar(self, timeout=5.0):
+        """Detiene el hilo escritor tras escribir lo pendiente (se llama al apagar)"""
+        if self._hilo is None or self._pid != os.getpid() or not self._hilo.is_alive():
+            return
+        try:
+            self._cola.put(_FIN, timeout=timeout)
+        except queue.Full:
+            return
+        self._hilo.join(timeout)
+
+    def pendientes(self):
+        """Registros que esperan en la cola"""
+        return self._cola.qsize() if self._cola is not None else 0
+
+    def estadisticas(self):
+        """Contadores del escritor de auditoría"""
+        with self._candado:
+            return {
+                'politica': self.politica,
+                'capacidad': self.capacidad,
+                'pendientes': self.pendientes(),
+                'encolados': self._encolados,
+                'escritos': self._escritos,
+                'descartados': self._descartados,
+                'derramados_disco': self._derramados,
+                'recuperados_disco': self._recuperados,
+                'rechazados_db': self._rechazados,
+                'lotes': self._lotes,
+                'errores': self._errores,
+                'latencia_lote_promedio_ms': round(self._latencia_total * 1000 / self._lotes, 2) if self._lotes else 0.0,
+                'latencia_lote_max_ms': round(self._latencia_max * 1000, 2),
+            }
+
+    def _asegurar_hilo(self):
+        # Tras un fork (gunicorn --preload) el hilo del padre no existe en el hijo
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        with self._candado:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            self._cola = queue.Queue(maxsize=self.capacidad)
+            self._hilo = threading.Thread(target=self._bucle, name="escritor-auditoria", daemon=True)
+            self._pid = os.getpid()
+            self._hilo.start()
+
+    def _bucle(self):
+        lote = []
+        limite = time.monotonic() + self.intervalo
+        terminar = False
+        while not terminar:
+            try:
+                fila = self._cola.get(timeout=max(0.0, limite - time.monotonic()))
+                if fila is _FIN:
+                    terminar = True
+                else:
+                    lote.append(fila)
+            except queue.Empty:
+                pass
+
+            if lote and (terminar or len(lote) >= self.tamano_lote or time.monotonic() >= limite):
+                self._escribir(lote)
+                lote = []
+            if time.monotonic() >= limite:
+                limite = time.monotonic() + self.intervalo
+                try:
+                    self._recuperar_derrame()
+                except Exception as e:
+                    logger.error("Error reprocesando la auditoría derramada a disco: %s", e)
+
+    def _escribir(self, lote):
+        """Escribe el lote; devuelve False si alguna fila quedó sin escribir por falta de conexión"""
+        inicio = time.monotonic()
+        conn = self._fabrica()
+        if not conn:
+            self._fallo(lote)
+            return False
+        escritas = []
+        resueltas = 0   # las partes se resuelven en orden: lote[:resueltas] ya se escribió o rechazó
+        try:
+            cursor = conn.cursor()
+            partes = [lote]
+            while partes:
+                parte = partes.pop()
+                try:
+                    valores = ", ".join(["(%s, %s, %s)"] * len(parte))
+                    cursor.execute(
+                        f"INSERT INTO logs_transacciones (usuario_id, accion, fecha_hora) VALUES {valores}",
+                        [valor for fila in parte for valor in fila]
+                    )
+                    conn.commit()
+                    escritas.extend(parte)
+                except ERRORES_DE_DATOS as e:
+                    _deshacer(conn)
+                    if len(parte) > 1:
+                        mitad = len(parte) // 2
+                        partes.extend((parte[mitad:], parte[:mitad]))
+                        continue
+                    logger.warning("Registro de auditoría rechazado por la base: %s (%s)", parte[0], e)
+                    with self._candado:
+                        self._rechazados += 1
+                resueltas += len(parte)
+            cursor.close()
+        except Exception as e:
+            logger.error("Error escribiendo lote de auditoría: %s", e)
+            _deshacer(conn)
+            self._fallo(lote[resueltas:])
+        finally:
+            conn.close()
+
+        duracion = time.monotonic() - inicio
+        completo = resueltas == len(lote)
+        self._ultimo_ok = completo
+        with self._candado:
+            self._escritos += len(escritas)
+            self._lotes += 1
+            self._latencia_total += duracion
+            self._latencia_max = max(self._latencia_max, duracion)
+
+        if escritas:
+            for funcion in self._suscriptores:
+                try:
+                    funcion(escritas)
+                except Exception as e:
+                    logger.error("Error notificando lote de auditoría: %s", e)
+        return completo
+
+    def _fallo(self, lote):
+        self._ultimo_ok = False
+        with self._candado:
+            self._errores += 1
+        if self.politica == 'descartar' or not self._derramar(lote):
+            with self._candado:
+                self._descartados += len(lote)
+
+    def _derramar(self, filas):
+        if not self.ruta_derrame:
+            return False
+        try:
+            with self._candado_disco:
+                os.makedirs(os.path.dirname(self.ruta_derrame) or '.', exist_ok=True)
+                with open(self.ruta_derrame, 'a', encoding='utf-8') as f:
+                    for usuario_id, accion, fecha in filas:
+                        f.write(json.dumps({'usuario_id': usuario_id, 'accion': accion,
+                                            'fecha_hora': fecha.isoformat()}) + "\n")
+        except OSError as e:
+            logger.error("Error escribiendo auditoría en disco: %s", e)
+            return False
+        with self._candado:
+            self._derramados += len(filas)
+        return True
+
+    def _recuperar_derrame(self):
+        """Reinserta en la base de datos lo que se derramó a disco mientras MySQL estaba lento"""
+        if not self._ultimo_ok or not self.ruta_derrame:
+            return
+        procesando = f"{self.ruta_derrame}.{os.getpid()}.procesando"
+        with self._candado_disco:
+            # Un .procesando propio que quedó de un intento interrumpido se termina antes de tomar otro
+            if not os.path.exists(procesando):
+                try:
+                    os.replace(self._derrame_huerfano() or self.ruta_derrame, procesando)
+                except OSError:
+                    return
+
+        with open(procesando, encoding='utf-8') as f:
+            filas = []
+            for linea in f:
+                try:
+                    dato = json.loads(linea)
+                    filas.append((dato['usuario_id'], dato['accion'],
+                                  datetime.fromisoformat(dato['fecha_hora'])))
+                except (ValueError, KeyError):
+                    continue
+
+        for i in range(0, len(filas), self.tamano_lote):
+            lote = filas[i:i + self.tamano_lote]
+            if not self._escribir(lote):
+                # _escribir ya devolvió al derrame su parte pendiente; lo que falta vuelve también
+                if filas[i + self.tamano_lote:]:
+                    self._fallo(filas[i + self.tamano_lote:])
+                break
+            with self._candado:
+                self._recuperados += len(lote)
+        # Recién ahora cada fila está en la base o de nuevo en el derrame
+        os.remove(procesando)
+
+    def _derrame_huerfano(self):
+        """Archivo .procesando de un worker que terminó antes de reinsertarlo"""
+        for ruta in glob.glob(f"{glob.escape(self.ruta_derrame)}.*.procesando"):
+            pid = ruta[len(self.ruta_derrame) + 1:-len('.procesando')]
+            if pid.isdigit() and not proceso_vivo(int(pid)):
+                return ruta
+        return None
+
+
+def _deshacer(conn):
+    # Con la conexión perdida rollback() también falla; no debe tumbar el hilo escritor
+    try:
+        conn.rollback()
+    except Exception:
+        pass
+
+
+escritor_auditoria = EscritorAuditoria(
+    capacidad=AUDIT_QUEUE_SIZE,
+    tamano_lote=AUDIT_BATCH_SIZE,
+    intervalo=AUDIT_FLUSH_INTERVAL,
+    politica=AUDIT_OVERFLOW_POLICY,
+    timeout_bloqueo=AUDIT_BLOCK_TIMEOUT,
+    ruta_derrame=AUDIT_SPILL_PATH
+)
+
+atexit.register(escritor_auditoria.vaciar)
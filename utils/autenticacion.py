@@ -0,0 +1,305 @@
+"""
+Motor de inicio de sesión.
+
+- Hash de contraseñas con el método configurado (PASSWORD_HASH_METHOD); los hashes
+  antiguos se regeneran cuando el usuario inicia sesión correctamente
+- Caché LRU con TTL de la búsqueda de usuarios por correo
+- Verificación contra un hash ficticio cuando el correo no existe, para que la
+  respuesta tarde lo mismo exista o no la cuenta
+- Límite de intentos por IP y de fallos por cuenta con ventana deslizante en memoria
+  compartida: el tráfico abusivo se rechaza antes de consultar la base o calcular hashes
+"""
+import hashlib
+import logging
+import multiprocessing
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from config import (PASSWORD_HASH_METHOD, LOGIN_CACHE_SIZE, LOGIN_CACHE_TTL, LOGIN_MAX_INTENTOS_IP,
+                    LOGIN_VENTANA_IP, LOGIN_MAX_FALLOS_CUENTA, LOGIN_VENTANA_CUENTA)
+from utils.db_connection import get_db_connection
+from utils.referencias import descripcion_tipo_documento
+
+logger = logging.getLogger(__name__)
+
+
+class IntentosExcedidos(Exception):
+    """Demasiados intentos de inicio de sesión desde una IP o contra una cuenta"""
+
+    def __init__(self, motivo, reintentar_en):
+        super().__init__(f"Demasiados intentos ({motivo})")
+        self.motivo = motivo
+        self.reintentar_en = reintentar_en
+
+
+class LimitadorVentana:
+    """
+    Contador de ventana deslizante aproximada por clave (ventana actual más la anterior
+    ponderada por el tiempo que aún se solapa).
+
+    Los contadores viven en un arreglo de memoria compartida creado al importar el
+    módulo, así que los workers de gunicorn creados con --preload comparten los límites.
+    Las claves se reparten en `ranuras` por hash; una colisión solo puede sumar intentos
+    de más, nunca dejar pasar de más. Cada ranura guarda la huella de la única clave que
+    la ocupa (o COMPARTIDA), y reiniciar solo la vacía si la huella es la de esa clave:
+    un acceso exitoso con un correo que colisiona no desbloquea otra cuenta.
+    """
+
+    # Huella de una ranura con intentos de más de una clave
+    COMPARTIDA = -1
+
+    def __init__(self, limite, ventana, ranuras=65536):
+        self.limite = limite
+        self.ventana = ventana
+        self.ranuras = ranuras
+        # Por ranura: número de ventana, intentos en esa ventana, intentos en la anterior, huella de la clave
+        self._datos = multiprocessing.RawArray('q', ranuras * 4)
+        self._candado = multiprocessing.Lock()
+
+    def _ranura(self, clave):
+        return (zlib.crc32(clave.encode('utf-8')) % self.ranuras) * 4
+
+    @staticmethod
+    def _huella(clave):
+        # Hash independiente del de la ranura; positiva para no confundirse con COMPARTIDA ni con 0 (vacía)
+        return int.from_bytes(hashlib.blake2b(clave.encode('utf-8'), digest_size=8).digest(), 'big') >> 2 | 1
+
+    def _avanzar(self, i, ahora):
+        # Se llama con el candado tomado
+        actual = int(ahora // self.ventana)
+        guardada = self._datos[i]
+        if guardada == actual:
+            return
+        anterior = self._datos[i + 1] if guardada == actual - 1 else 0
+        self._datos[i], self._datos[i + 1], self._datos[i + 2] = actual, 0, anterior
+
+    def _estimar(self, i, ahora):
+        transcurrido = (ahora % self.ventana) / self.ventana
+        return self._datos[i + 1] + self._datos[i + 2] * (1 - transcurrido)
+
+    def excedido(self, clave):
+        """True si la clave ya alcanzó el límite en la ventana"""
+        ahora = time.time()
+        i = self._ranura(clave)
+        with self._candado:
+            self._avanzar(i, ahora)
+            return self._estimar(i, ahora) >= self.limite
+
+    def registrar(self, clave):
+        ahora = time.time()
+        i = self._ranura(clave)
+        huella = self._huella(clave)
+        with self._candado:
+            self._avanzar(i, ahora)
+            if self._datos[i + 1] == 0 and self._datos[i + 2] == 0:
+                self._datos[i + 3] = huella
+            elif self._datos[i + 3] != huella:
+                self._datos[i + 3] = self.COMPARTIDA
+            self._datos[i + 1] += 1
+
+    def reiniciar(self, clave):
+        """Olvida los intentos de la clave si la ranura es solo suya; si es compartida vencen con la ventana"""
+        i = self._ranura(clave)
+        with self._candado:
+            if self._datos[i + 3] == self._huella(clave):
+                self._datos[i + 1] = self._datos[i + 2] = 0
+
+
+class CacheUsuarios:
+    """Caché LRU con TTL de las filas de usuario por correo (solo cuentas existentes)"""
+
+    def __init__(self, tamano=2000, ttl=60):
+        self.tamano = tamano
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._candado = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, correo):
+        ahora = time.monotonic()
+        with self._candado:
+            guardado = self._datos.get(correo)
+            if guardado and ahora - guardado[0] < self.ttl:
+                self._datos.move_to_end(correo)
+                self.aciertos += 1
+                return dict(guardado[1])
+            if guardado:
+                del self._datos[correo]
+            self.fallos += 1
+            return None
+
+    def guardar(self, correo, usuario):
+        with self._candado:
+            self._datos[correo] = (time.monotonic(), dict(usuario))
+            self._datos.move_to_end(correo)
+            while len(self._datos) > self.tamano:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, correo=None):
+        with self._candado:
+            if correo is None:
+                self._datos.clear()
+            else:
+                self._datos.pop(correo, None)
+
+    def __len__(self):
+        return len(self._datos)
+
+
+def metodo_hash(contrasena_hash):
+    """Método y parámetros de un hash de werkzeug ('scrypt:32768:8:1', 'pbkdf2:sha256:600000', ...)"""
+    return contrasena_hash.split('$', 1)[0] if contrasena_hash else ''
+
+
+class MotorLogin:
+    """Verificación de credenciales con caché, límites de intentos y actualización de hashes"""
+
+    def __init__(self, fabrica_conexion=get_db_connection, metodo=PASSWORD_HASH_METHOD,
+                 cache=None, limitador_ip=None, limitador_cuenta=None):
+        self._fabrica = fabrica_conexion
+        self.metodo = metodo
+        self.cache = cache or CacheUsuarios()
+        self.limitador_ip = limitador_ip
+        self.limitador_cuenta = limitador_cuenta
+        self._hash_ficticio = None
+        self._candado = threading.Lock()
+
+        # Contadores
+        self._exitosos = 0
+        self._fallidos = 0
+        self._inexistentes = 0
+        self._bloqueados_ip = 0
+        self._bloqueados_cuenta = 0
+        self._rehashes = 0
+
+    def generar_hash(self, contrasena):
+        """Hash con el método configurado (usar también al registrar usuarios)"""
+        return generate_password_hash(contrasena, method=self.metodo)
+
+    def necesita_rehash(self, contrasena_hash):
+        return metodo_hash(contrasena_hash) != self.metodo
+
+    def _verificar_ficticio(self, contrasena):
+        # Mismo costo que una verificación real para no revelar si la cuenta existe
+        if self._hash_ficticio is None:
+            self._hash_ficticio = self.generar_hash(secrets.token_hex(16))
+        check_password_hash(self._hash_ficticio, contrasena)
+
+    def _buscar(self, correo):
+        """Fila del usuario o None; la descripción del tipo de documento sale de la caché de referencia"""
+        usuario = self.cache.obtener(correo)
+        if usuario is not None:
+            return usuario
+        conn = self._fabrica()
+        if not conn:
+            raise ConnectionError("Error de conexión a la base de datos.")
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT id, nombre, correo, rol, contrasena, tipo_documento_id
+                FROM usuarios
+                WHERE correo = %s
+            """, (correo,))
+            usuario = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        if usuario:
+            usuario['tipo_documento'] = descripcion_tipo_documento(usuario['tipo_documento_id'])
+            self.cache.guardar(correo, usuario)
+        return usuario
+
+    def _actualizar_hash(self, usuario, contrasena):
+        nuevo = self.generar_hash(contrasena)
+        conn = self._fabrica()
+        if not conn:
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE usuarios SET contrasena = %s WHERE id = %s", (nuevo, usuario['id']))
+            conn.commit()
+            cursor.close()
+            usuario['contrasena'] = nuevo
+            self.cache.guardar(usuario['correo'].strip().lower(), usuario)
+            with self._candado:
+                self._rehashes += 1
+        except Exception as e:
+            logger.error("Error actualizando el hash de la contraseña: %s", e)
+        finally:
+            conn.close()
+
+    def autenticar(self, correo, contrasena, ip=None):
+        """
+        Retorna la fila del usuario si las credenciales son válidas o None si no.
+        Lanza IntentosExcedidos si la IP o la cuenta superaron el límite, y
+        ConnectionError si no hay conexión a la base de datos.
+        """
+        correo = (correo or '').strip().lower()
+        if ip and self.limitador_ip:
+            if self.limitador_ip.excedido(ip):
+                with self._candado:
+                    self._bloqueados_ip += 1
+                raise IntentosExcedidos('ip', self.limitador_ip.ventana)
+            self.limitador_ip.registrar(ip)
+        if self.limitador_cuenta and self.limitador_cuenta.excedido(correo):
+            with self._candado:
+                self._bloqueados_cuenta += 1
+            raise IntentosExcedidos('cuenta', self.limitador_cuenta.ventana)
+
+        usuario = self._buscar(correo)
+        if usuario is None:
+            self._verificar_ficticio(contrasena)
+            valido = False
+        else:
+            valido = check_password_hash(usuario['contrasena'], contrasena)
+
+        with self._candado:
+            if valido:
+                self._exitosos += 1
+            else:
+                self._fallidos += 1
+                if usuario is None:
+                    self._inexistentes += 1
+
+        if not valido:
+            if self.limitador_cuenta:
+                self.limitador_cuenta.registrar(correo)
+            return None
+
+        if self.limitador_cuenta:
+            self.limitador_cuenta.reiniciar(correo)
+        if self.necesita_rehash(usuario['contrasena']):
+            self._actualizar_hash(usuario, contrasena)
+        return usuario
+
+    def invalidar(self, correo=None):
+        """Descarta la caché de un correo (o toda) tras cambiar datos del usuario"""
+        self.cache.invalidar(correo.strip().lower() if correo else None)
+
+    def estadisticas(self):
+        with self._candado:
+            return {
+                'metodo_hash': self.metodo,
+                'exitosos': self._exitosos,
+                'fallidos': self._fallidos,
+                'cuentas_inexistentes': self._inexistentes,
+                'bloqueados_ip': self._bloqueados_ip,
+                'bloqueados_cuenta': self._bloqueados_cuenta,
+                'rehashes': self._rehashes,
+                'cache_usuarios': len(self.cache),
+                'cache_aciertos': self.cache.aciertos,
+                'cache_fallos': self.cache.fallos,
+            }
+
+
+motor_login = MotorLogin(
+    cache=CacheUsuarios(LOGIN_CACHE_SIZE, LOGIN_CACHE_TTL),
+    limitador_ip=LimitadorVentana(LOGIN_MAX_INTENTOS_IP, LOGIN_VENTANA_IP),
+    limitador_cuenta=LimitadorVentana(LOGIN_MAX_FALLOS_CUENTA, LOGIN_VENTANA_CUENTA),
+)
@@ -0,0 +1,194 @@
+"""
+Registro de eventos (logging) de la aplicación.
+
+- Registros JSON de una línea con hora, nivel, módulo, proceso, hilo y campos extra
+- Los hilos de las peticiones solo encolan el registro (QueueHandler); un hilo
+  aparte escribe en disco, y si la cola se llena el registro se descarta y se cuenta
+- Rotación por tamaño o por tiempo; los archivos rotados se comprimen con gzip.
+  Cada proceso escribe su propio archivo (LOG_FILE con {pid}); si varios workers
+  comparten uno, ninguno lo rota: WatchedFileHandler lo reabre cuando logrotate lo mueve
+- Nivel general y niveles por módulo desde config.py (LOG_LEVEL y LOG_LEVELS)
+
+Uso en los módulos:
+    logger = logging.getLogger(__name__)
+    logger.error("Error obteniendo usuarios: %s", e)
+    logger.info("Exportación lista", extra={'filas': 1200})
+"""
+import atexit
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+from datetime import datetime
+
+from config import (LOG_FILE, LOG_LEVEL, LOG_LEVELS, LOG_ROTATION, LOG_MAX_BYTES, LOG_WHEN,
+                    LOG_BACKUPS, LOG_QUEUE_SIZE, LOG_CONSOLE)
+
+# Atributos propios de LogRecord; el resto viene de extra={...}
+_ATRIBUTOS_BASE = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class FormateadorJSON(logging.Formatter):
+    """Una línea JSON por registro"""
+
+    def format(self, record):
+        datos = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensaje': record.getMessage(),
+            'pid': record.process,
+            'hilo': record.threadName,
+        }
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_BASE and not clave.startswith('_'):
+                datos[clave] = valor
+        if record.exc_info:
+            datos['excepcion'] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+def _comprimir(origen, destino):
+    """rotator de los handlers: el archivo rotado se guarda como .gz"""
+    with open(origen, 'rb') as entrada, gzip.open(destino, 'wb') as salida:
+        shutil.copyfileobj(entrada, salida)
+    os.remove(origen)
+
+
+def _manejador_archivo(ruta, compartido=False):
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    # Un worker que rota un archivo compartido lo comprime y borra mientras los demás siguen escribiendo en él
+    if compartido or LOG_ROTATION == 'externa':
+        return logging.handlers.WatchedFileHandler(ruta, encoding='utf-8', delay=True)
+    if LOG_ROTATION == 'tiempo':
+        manejador = logging.handlers.TimedRotatingFileHandler(
+            ruta, when=LOG_WHEN, backupCount=LOG_BACKUPS, encoding='utf-8', delay=True)
+    else:
+        manejador = logging.handlers.RotatingFileHandler(
+            ruta, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8', delay=True)
+    manejador.namer = lambda nombre: f"{nombre}.gz"
+    manejador.rotator = _comprimir
+    return manejador
+
+
+_formateador_trazas = logging.Formatter()
+
+
+class ColaNoBloqueante(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (y cuenta) en lugar de bloquear cuando la cola está llena"""
+
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record):
+        # El QueueHandler base pega la traza al mensaje; aquí va en su propio campo
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.excepcion = _formateador_trazas.formatException(record.exc_info)
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+_estado = {'listener': None, 'manejador_cola': None, 'destinos': None, 'hijo': False}
+_candado = threading.Lock()
+
+
+def _iniciar_listener():
+    cola = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _estado['manejador_cola'].queue = cola
+    listener = logging.handlers.QueueListener(cola, *_estado['destinos'], respect_handler_level=True)
+    listener.start()
+    _estado['listener'] = listener
+
+
+def _crear_destinos():
+    formateador = FormateadorJSON()
+    destinos = []
+    if LOG_FILE:
+        # Sin {pid} el archivo lo comparten los workers creados por fork
+        compartido = _estado['hijo'] and '{pid}' not in LOG_FILE
+        archivo = _manejador_archivo(LOG_FILE.format(pid=os.getpid()), compartido)
+        archivo.setFormatter(formateador)
+        destinos.append(archivo)
+    if LOG_CONSOLE or not destinos:
+        consola = logging.StreamHandler(sys.stderr)
+        consola.setFormatter(formateador)
+        destinos.append(consola)
+    return destinos
+
+
+def _reiniciar_en_hijo():
+    # Tras un fork (gunicorn --preload) el hilo del listener no existe en el hijo,
+    # y con {pid} en LOG_FILE cada worker abre su propio archivo
+    _estado['hijo'] = True
+    if _estado['listener'] is not None:
+        _estado['destinos'] = _crear_destinos()
+        _iniciar_listener()
+
+
+def configurar_logging():
+    """Configura el logger raíz una sola vez por proceso (llamar al arrancar la app o un script)"""
+    with _candado:
+        if _estado['listener'] is not None:
+            return
+        _estado['destinos'] = _crear_destinos()
+        _estado['manejador_cola'] = ColaNoBloqueante(None)
+
+        raiz = logging.getLogger()
+        raiz.setLevel(LOG_LEVEL)
+        raiz.addHandler(_estado['manejador_cola'])
+        for modulo, nivel in LOG_LEVELS.items():
+            logging.getLogger(modulo).setLevel(nivel)
+        _iniciar_listener()
+        os.register_at_fork(after_in_child=_reiniciar_en_hijo)
+        atexit.register(detener_logging)
+
+
+def detener_logging():
+    """Vacía la cola y detiene el hilo escritor"""
+    with _candado:
+        if _estado['listener'] is not None:
+            _estado['listener'].stop()
+            _estado['listener'] = None
+
+
+def estadisticas_logging():
+    manejador = _estado['manejador_cola']
+    return {
+        'pendientes': manejador.queue.qsize() if manejador and manejador.queue else 0,
+        'descartados': manejador.descartados if manejador else 0,
+        'archivo': LOG_FILE.format(pid=os.getpid()) if LOG_FILE else None,
+    }
+
+
+class MuestreoDebug:
+    """Registra en DEBUG solo uno de cada `cada` eventos repetitivos, con el total acumulado"""
+
+    def __init__(self, logger, cada=100):
+        self.logger = logger
+        self.cada = max(1, cada)
+        self._total = 0
+        self._candado = threading.Lock()
+
+    def registrar(self, mensaje, **extra):
+        with self._candado:
+            self._total += 1
+            total = self._total
+        if (total - 1) % self.cada == 0 and self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(mensaje, extra=dict(extra, total=total, muestreo=self.cada))
@@ -0,0 +1,345 @@
+"""
+Búsqueda de usuarios para el autocompletado de /admin/usuarios.
+
+- Índice en memoria por worker construido desde la tabla usuarios: cada palabra de
+  nombre, correo y documento (sin tildes ni mayúsculas) apunta a los usuarios que la
+  contienen; el vocabulario ordenado resuelve prefijos con búsqueda binaria y los
+  trigramas de cada palabra toleran errores de digitación ("gonzales" -> "gonzalez")
+  cuando ninguna palabra empieza por el término
+- Todas las palabras de la consulta deben coincidir; se ordena por puntaje
+  (exacta > prefijo > parecida) y se retornan los k mejores
+- registro() agrega el usuario nuevo al índice de su worker; un hilo de fondo lee los
+  registrados en otros workers cada BUSQUEDA_INTERVALO y reconstruye todo cada
+  BUSQUEDA_RECARGA (cambios y eliminaciones)
+- Mientras el índice no está listo (worker recién arrancado) se responde con el
+  índice FULLTEXT de la migración 007
+"""
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime
+
+from config import BUSQUEDA_RECARGA, BUSQUEDA_INTERVALO, BUSQUEDA_SIMILITUD, BUSQUEDA_MAX_RESULTADOS
+from utils.db_connection import get_db_connection, get_db_connection_fondo
+from utils.usuarios import COLUMNAS_LISTADO, listar_usuarios
+
+logger = logging.getLogger(__name__)
+
+# Puntaje por palabra de la consulta según cómo coincide
+PUNTAJE_EXACTA = 1.0
+PUNTAJE_PREFIJO = 0.8    # + hasta 0.2 según qué tanto de la palabra cubre el prefijo
+PUNTAJE_PARECIDA = 0.7   # x similitud de trigramas
+
+# Palabras más cortas no se comparan por trigramas (casi todo se parecería)
+LONGITUD_MINIMA_TRIGRAMAS = 3
+# InnoDB no indexa palabras más cortas que innodb_ft_min_token_size
+LONGITUD_MINIMA_FULLTEXT = 3
+
+_PALABRA = re.compile(r'[a-z0-9]+')
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes: 'Gómez' -> 'gomez'"""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).lower()
+
+
+def palabras(texto):
+    return _PALABRA.findall(normalizar(texto))
+
+
+def trigramas(palabra):
+    relleno = f"  {palabra} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+def _palabras_usuario(usuario):
+    # Del correo solo la parte local: el dominio institucional lo comparten casi todos
+    local = (usuario['correo'] or '').split('@')[0]
+    return set(palabras(usuario['nombre'])) | set(palabras(local)) | set(palabras(usuario['documento']))
+
+
+class IndiceUsuarios:
+    """Índice invertido y de trigramas sobre nombre, correo y documento"""
+
+    def __init__(self, fabrica_conexion=get_db_connection, fabrica_fondo=get_db_connection_fondo,
+                 recarga=BUSQUEDA_RECARGA, intervalo=BUSQUEDA_INTERVALO, similitud=BUSQUEDA_SIMILITUD):
+        self._fabrica = fabrica_conexion      # búsquedas de respaldo (peticiones)
+        self._fabrica_fondo = fabrica_fondo   # construcción y lectura de nuevos (hilo del índice)
+        self.recarga = recarga
+        self.intervalo = intervalo
+        self.similitud = similitud
+        self._candado = threading.Lock()
+        self._listo = False
+        self._usuarios = {}       # id -> fila del listado
+        self._palabras_de = {}    # id -> palabras del usuario
+        self._ids_de = {}         # palabra -> ids que la contienen
+        self._vocabulario = []    # palabras ordenadas (prefijos por búsqueda binaria)
+        self._trigramas = {}      # trigrama -> palabras que lo contienen
+        # Mayor id leído de la base; agregar() no lo mueve: otro worker pudo registrar
+        # un id menor que este worker todavía no leyó
+        self._ultimo_leido = 0
+        self._construido_en = 0.0
+        self._construyendo = False
+        self._pendientes = []     # agregados mientras se construye el índice nuevo
+        self._hilo = None
+        self._pid = None
+        self._despertar = threading.Event()
+        self._info = {'construcciones': 0, 'duracion_ms': None, 'nuevos_leidos': 0, 'agregados': 0,
+                      'busquedas_indice': 0, 'busquedas_fulltext': 0, 'errores': 0, 'ultimo_error': None}
+
+    # ----- Construcción -----
+
+    def _leer(self, desde_id=0):
+        conn = self._fabrica_fondo()
+        if not conn:
+            raise RuntimeError("Sin conexión a la base de datos")
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"SELECT {COLUMNAS_LISTADO} FROM usuarios u WHERE u.id > %s ORDER BY u.id",
+                           (desde_id,))
+            filas = cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+        return filas
+
+    def construir(self):
+        """Reconstruye el índice completo fuera del candado y lo reemplaza de una vez"""
+        inicio = time.perf_counter()
+        with self._candado:
+            self._construyendo = True
+        try:
+            filas = self._leer()
+        except Exception:
+            with self._candado:
+                self._construyendo = False
+                self._pendientes = []
+            raise
+
+        usuarios, palabras_de, ids_de, trigramas_de = {}, {}, {}, {}
+        for fila in filas:
+            usuarios[fila['id']] = fila
+            propias = _palabras_usuario(fila)
+            palabras_de[fila['id']] = propias
+            for palabra in propias:
+                ids_de.setdefault(palabra, set()).add(fila['id'])
+        for palabra in ids_de:
+            for trigrama in trigramas(palabra):
+                trigramas_de.setdefault(trigrama, set()).add(palabra)
+
+        with self._candado:
+            self._usuarios, self._palabras_de, self._ids_de = usuarios, palabras_de, ids_de
+            self._trigramas = trigramas_de
+            self._vocabulario = sorted(ids_de)
+            self._ultimo_leido = max(usuarios, default=0)
+            for fila in self._pendientes:
+                self._agregar(fila)
+            self._pendientes = []
+            self._construyendo = False
+            self._listo = True
+            self._construido_en = time.monotonic()
+            self._info['construcciones'] += 1
+            self._info['duracion_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        logger.info("Índice de usuarios construido", extra={'usuarios': len(usuarios), 'palabras': len(ids_de),
+                                                             'duracion_ms': self._info['duracion_ms']})
+
+    def leer_nuevos(self):
+        """Agrega los usuarios con id mayor al último indexado (registrados en otros workers)"""
+        filas = self._leer(self._ultimo_leido)
+        with self._candado:
+            for fila in filas:
+                self._agregar(fila)
+                self._ultimo_leido = max(self._ultimo_leido, fila['id'])
+            self._info['nuevos_leidos'] += len(filas)
+        return len(filas)
+
+    def _agregar(self, usuario):
+        # Se llama con el candado tomado
+        usuario_id = usuario['id']
+        if usuario_id in self._usuarios:
+            self._quitar(usuario_id)
+        self._usuarios[usuario_id] = usuario
+        propias = _palabras_usuario(usuario)
+        self._palabras_de[usuario_id] = propias
+        for palabra in propias:
+            ids = self._ids_de.get(palabra)
+            if ids is None:
+                self._ids_de[palabra] = ids = set()
+                insort(self._vocabulario, palabra)
+                for trigrama in trigramas(palabra):
+                    self._trigramas.setdefault(trigrama, set()).add(palabra)
+            ids.add(usuario_id)
+
+    def _quitar(self, usuario_id):
+        # Las palabras que quedan sin usuarios se dejan en el vocabulario hasta la próxima reconstrucción
+        self._usuarios.pop(usuario_id, None)
+        for palabra in self._palabras_de.pop(usuario_id, ()):
+            self._ids_de[palabra].discard(usuario_id)
+
+    def agregar(self, usuario):
+        """Indexa un usuario recién registrado (dict con las columnas de COLUMNAS_LISTADO)"""
+        fila = dict(usuario)
+        fila.setdefault('telefono', None)
+        fila.setdefault('fecha_creacion', datetime.now())
+        with self._candado:
+            self._info['agregados'] += 1
+            if self._construyendo:
+                self._pendientes.append(fila)
+            if self._listo:
+                self._agregar(fila)
+        self._asegurar_hilo()
+
+    # ----- Búsqueda -----
+
+    def _coincidencias(self, termino):
+        """Usuarios que contienen el término: id -> mejor puntaje entre sus palabras"""
+        puntajes = {}
+
+        def anotar(palabra, puntaje):
+            for usuario_id in self._ids_de[palabra]:
+                if puntaje > puntajes.get(usuario_id, 0.0):
+                    puntajes[usuario_id] = puntaje
+
+        posicion = bisect_left(self._vocabulario, termino)
+        hay_prefijos = posicion < len(self._vocabulario) and self._vocabulario[posicion].startswith(termino)
+        while posicion < len(self._vocabulario) and self._vocabulario[posicion].startswith(termino):
+            palabra = self._vocabulario[posicion]
+            if palabra == termino:
+                anotar(palabra, PUNTAJE_EXACTA)
+            else:
+                anotar(palabra, PUNTAJE_PREFIJO + 0.2 * len(termino) / len(palabra))
+            posicion += 1
+
+        # Los trigramas solo se consultan si nada empieza por el término; los documentos no se corrigen
+        if not hay_prefijos and len(termino) >= LONGITUD_MINIMA_TRIGRAMAS and not termino.isdigit():
+            propios = trigramas(termino)
+            compartidos = Counter()
+            for trigrama in propios:
+                compartidos.update(self._trigramas.get(trigrama, ()))
+            for palabra, comunes in compartidos.items():
+                # Jaccard sobre los trigramas; un trigrama por letra más uno
+                similitud = comunes / (len(propios) + len(palabra) + 1 - comunes)
+                if similitud >= self.similitud:
+                    anotar(palabra, PUNTAJE_PARECIDA * similitud)
+        return puntajes
+
+    def _buscar_indice(self, terminos, k):
+        # Se llama con el candado tomado
+        total = None
+        for termino in terminos:
+            puntajes = self._coincidencias(termino)
+            if total is None:
+                total = puntajes
+            else:
+                total = {usuario_id: total[usuario_id] + puntaje
+                         for usuario_id, puntaje in puntajes.items() if usuario_id in total}
+            if not total:
+                return []
+        # Empates: los registrados más recientemente primero
+        mejores = heapq.nlargest(k, total.items(), key=lambda par: (par[1], par[0]))
+        return [dict(self._usuarios[usuario_id], puntaje=round(puntaje / len(terminos), 3))
+                for usuario_id, puntaje in mejores]
+
+    def buscar_fulltext(self, consulta, k):
+        """Respaldo sin índice en memoria: FULLTEXT en modo booleano, o prefijo LIKE si las palabras son cortas"""
+        terminos = [t for t in palabras(consulta) if len(t) >= LONGITUD_MINIMA_FULLTEXT]
+        if not terminos:
+            usuarios, _ = listar_usuarios(limite=k, prefijo=consulta)
+            return usuarios
+        booleana = ' '.join(f'+{t}*' for t in terminos)
+        conn = self._fabrica()
+        if not conn:
+            return []
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"""
+                SELECT {COLUMNAS_LISTADO},
+                       MATCH(u.nombre, u.correo, u.documento) AGAINST (%s IN BOOLEAN MODE) AS puntaje
+                FROM usuarios u
+                WHERE MATCH(u.nombre, u.correo, u.documento) AGAINST (%s IN BOOLEAN MODE)
+                ORDER BY puntaje DESC, u.id DESC
+                LIMIT %s
+            """, (booleana, booleana, k))
+            usuarios = cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            logger.error("Error en la búsqueda FULLTEXT de usuarios: %s", e)
+            return []
+        finally:
+            conn.close()
+        return usuarios
+
+    def buscar(self, consulta, k=10):
+        """
+        Los k usuarios que mejor coinciden con la consulta.
+        Retorna (usuarios, origen) con origen 'indice' o 'fulltext'.
+        """
+        k = max(1, min(int(k), BUSQUEDA_MAX_RESULTADOS))
+        terminos = palabras(consulta)
+        if not terminos:
+            return [], 'indice'
+        self._asegurar_hilo()
+        with self._candado:
+            if self._listo:
+                self._info['busquedas_indice'] += 1
+                return self._buscar_indice(terminos, k), 'indice'
+            self._info['busquedas_fulltext'] += 1
+        return self.buscar_fulltext(consulta, k), 'fulltext'
+
+    # ----- Mantenimiento en segundo plano -----
+
+    def _vigente(self):
+        return self._listo and time.monotonic() - self._construido_en < self.recarga
+
+    def _asegurar_hilo(self):
+        # Tras un fork (gunicorn --preload) el hilo del padre no existe en el hijo
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        with self._candado:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="indice-usuarios", daemon=True)
+            self._pid = os.getpid()
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            try:
+                if not self._vigente():
+                    self.construir()
+                else:
+                    self.leer_nuevos()
+            except Exception as e:
+                logger.error("Error actualizando el índice de usuarios: %s", e)
+                self._info['errores'] += 1
+                self._info['ultimo_error'] = str(e)
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+
+    def reconstruir(self):
+        """Pide una reconstrucción completa en segundo plano"""
+        self._construido_en = 0.0
+        self._asegurar_hilo()
+        self._despertar.set()
+
+    def estadisticas(self):
+        with self._candado:
+            info = dict(self._info)
+            info.update({
+                'listo': self._listo,
+                'usuarios': len(self._usuarios),
+                'palabras': len(self._ids_de),
+                'trigramas': len(self._trigramas),
+                'edad_s': round(time.monotonic() - self._construido_en, 1) if self._listo else None,
+            })
+        return info
+
+
+indice_usuarios = IndiceUsuarios()
@@ -0,0 +1,428 @@
+"""
+Servidor de chat en tiempo real (Server-Sent Events) que corre junto a la app Flask.
+
+    python -m utils.chat_servidor
+
+Usa asyncio: cada cliente conectado es solo un socket abierto y no un hilo, por lo
+que un nodo sostiene miles de conexiones inactivas. Los mensajes se reparten en
+memoria a los clientes de cada sala y se guardan en `mensajes` por lotes.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import signal
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit, parse_qs
+
+from config import (CHAT_HOST, CHAT_PORT, CHAT_ALLOWED_ORIGINS, CHAT_BATCH_SIZE,
+                    CHAT_FLUSH_INTERVAL, CHAT_REPLAY_BUFFER)
+from utils.mensajes import insertar_mensajes, SALA_GENERAL
+from utils.bitacora import configurar_logging
+
+logger = logging.getLogger(__name__)
+
+LARGO_MAXIMO_MENSAJE = 1000
+CUERPO_MAXIMO = 16 * 1024
+INTERVALO_PING = 15
+BUFFER_MAXIMO_CLIENTE = 256 * 1024  # bytes pendientes antes de desconectar a un cliente lento
+# La sesión se busca en el almacén (archivos o MySQL) fuera del loop y se recuerda unos segundos por cookie
+SESION_CACHE_TTL = 5
+SESION_CACHE_TAMANO = 10000
+# Cualquier nombre de sala es válido: sin tope ni vencimiento las salas creadas una vez no se liberan
+SALAS_MAXIMAS = 1000
+SALA_INACTIVA = 600  # segundos sin clientes ni mensajes antes de liberar la sala y su búfer
+
+RAZONES = {200: 'OK', 202: 'Accepted', 204: 'No Content', 400: 'Bad Request',
+           401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           429: 'Too Many Requests'}
+
+
+def _percentil(muestras, p):
+    if not muestras:
+        return 0.0
+    ordenadas = sorted(muestras)
+    return round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p / 100))], 2)
+
+
+class Sala:
+    def __init__(self, tamano_recientes):
+        self.clientes = set()
+        self.recientes = deque(maxlen=tamano_recientes)  # (id, fecha, evento) para reconexiones
+        self.ultimo_uso = time.monotonic()
+
+
+class ServidorChat:
+    """
+    Reparte mensajes por sala a los clientes SSE y los persiste por lotes.
+
+    - verificar_sesion(cabecera_cookie) -> dict de la sesión Flask o None; puede bloquear,
+      se ejecuta en un hilo del executor
+    - guardar_lote(lote) -> bool, se ejecuta en un hilo del executor
+    """
+
+    def __init__(self, verificar_sesion, guardar_lote=insertar_mensajes, tamano_lote=100,
+                 intervalo=0.5, origenes_permitidos=(), tamano_recientes=100):
+        self._verificar_sesion = verificar_sesion
+        self._guardar_lote = guardar_lote
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.origenes_permitidos = set(origenes_permitidos)
+        self.tamano_recientes = tamano_recientes
+
+        self._salas = {}
+        self._ultima_purga = time.monotonic()
+        self._sesiones = OrderedDict()   # cabecera cookie -> (vence, sesión o None)
+        self._secuencia = itertools.count(int(time.time() * 1000) * 1000)
+        self._pendientes = None
+
+        # Métricas
+        self._publicados = 0
+        self._persistidos = 0
+        self._errores_persistencia = 0
+        self._descartados_persistencia = 0
+        self._desconectados_lentos = 0
+        self._latencia_reparto = deque(maxlen=1000)   # ms desde que llega el POST hasta escribir a todos
+        self._latencia_extremo = deque(maxlen=1000)   # ms reportados por los clientes (envío -> recepción)
+
+    async def iniciar(self, host, puerto):
+        self._pendientes = asyncio.Queue()
+        servidor = await asyncio.start_server(self._atender, host, puerto, limit=CUERPO_MAXIMO)
+        persistencia = asyncio.create_task(self._bucle_persistencia())
+        return servidor, persistencia
+
+    async def detener(self, servidor, persistencia):
+        """Cierra el socket de escucha y guarda los mensajes pendientes"""
+        servidor.close()
+        await self._pendientes.put(None)
+        await persistencia
+
+    # ----- HTTP mínimo -----
+
+    async def _atender(self, reader, writer):
+        try:
+            linea = await asyncio.wait_for(reader.readline(), timeout=10)
+            if not linea:
+                return
+            metodo, destino, _ = linea.decode('latin-1').split(' ', 2)
+            cabeceras = {}
+            while True:
+                linea = await asyncio.wait_for(reader.readline(), timeout=10)
+                if linea in (b'\r\n', b'\n', b''):
+                    break
+                nombre, _, valor = linea.decode('latin-1').partition(':')
+                cabeceras[nombre.strip().lower()] = valor.strip()
+
+            largo = int(cabeceras.get('content-length') or 0)
+            if largo > CUERPO_MAXIMO:
+                self._responder(writer, 413, {'error': 'Cuerpo demasiado grande'}, cabeceras)
+                return
+            cuerpo = await reader.readexactly(largo) if largo else b''
+
+            url = urlsplit(destino)
+            parametros = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+            if metodo == 'OPTIONS':
+                self._responder(writer, 204, None, cabeceras)
+            elif url.path == '/stream' and metodo == 'GET':
+                await self._stream(reader, writer, cabeceras, parametros)
+            elif url.path == '/mensajes' and metodo == 'POST':
+                await self._recibir_mensaje(writer, cabeceras, cuerpo)
+            elif url.path == '/latencia' and metodo == 'POST':
+                self._recibir_latencia(writer, cabeceras, cuerpo)
+            elif url.path == '/estadisticas' and metodo == 'GET':
+                sesion = await self._sesion(cabeceras)
+                if sesion and sesion.get('rol') == 'administrador':
+                    self._responder(writer, 200, self.estadisticas(), cabeceras)
+                else:
+                    self._responder(writer, 401, {'error': 'Acceso restringido al administrador.'}, cabeceras)
+            else:
+                self._responder(writer, 404, {'error': 'No encontrado'}, cabeceras)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    def _cabeceras_cors(self, cabeceras):
+        origen = cabeceras.get('origin')
+        if origen and origen in self.origenes_permitidos:
+            return (f"Access-Control-Allow-Origin: {origen}\r\n"
+                    "Access-Control-Allow-Credentials: true\r\n"
+                    "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
+                    "Access-Control-Allow-Headers: Content-Type, Last-Event-ID\r\n"
+                    "Vary: Origin\r\n")
+        return ""
+
+    def _responder(self, writer, estado, datos, cabeceras):
+        cuerpo = json.dumps(datos).encode() if datos is not None else b''
+        writer.write((
+            f"HTTP/1.1 {estado} {RAZONES.get(estado, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(cuerpo)}\r\n"
+            "Connection: close\r\n"
+            f"{self._cabeceras_cors(cabeceras)}\r\n"
+        ).encode('latin-1') + cuerpo)
+
+    async def _sesion(self, cabeceras):
+        cookie = cabeceras.get('cookie', '')
+        guardada = self._sesiones.get(cookie)
+        if guardada and guardada[0] > time.monotonic():
+            return guardada[1]
+        # El almacén de sesiones hace E/S bloqueante (y espera el pool de MySQL): nunca en el loop
+        loop = asyncio.get_running_loop()
+        sesion = await loop.run_in_executor(None, self._verificar_sesion, cookie)
+        if not sesion or 'usuario_id' not in sesion:
+            sesion = None
+        self._sesiones[cookie] = (time.monotonic() + SESION_CACHE_TTL, sesion)
+        self._sesiones.move_to_end(cookie)
+        while len(self._sesiones) > SESION_CACHE_TAMANO:
+            self._sesiones.popitem(last=False)
+        return sesion
+
+    # ----- Rutas -----
+
+    async def _stream(self, reader, writer, cabeceras, parametros):
+        if not await self._sesion(cabeceras):
+            self._responder(writer, 401, {'error': 'Sesión no válida'}, cabeceras)
+            return
+
+        nombre_sala = (parametros.get('sala') or SALA_GENERAL)[:50]
+        sala = self._sala(nombre_sala)
+        if sala is None:
+            self._responder(writer, 429, {'error': 'Demasiadas salas abiertas'}, cabeceras)
+            return
+
+        writer.write((
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: text/event-stream; charset=utf-8\r\n"
+            "Cache-Control: no-cache\r\n"
+            "X-Accel-Buffering: no\r\n"
+            f"{self._cabeceras_cors(cabeceras)}\r\n"
+            "retry: 3000\n\n"
+        ).encode('utf-8'))
+
+        # Al reconectar, reenviar lo que el cliente se perdió
+        ultimo = cabeceras.get('last-event-id') or parametros.get('desde')
+        if ultimo and ultimo.isdigit():
+            for id_evento, _, evento in sala.recientes:
+                if id_evento > int(ultimo):
+                    writer.write(evento)
+        elif parametros.get('desde_fecha'):
+            # Primera conexión tras cargar el historial: se reenvía lo publicado desde su último
+            # mensaje. MySQL guarda la fecha al segundo, así que se toma un segundo de margen
+            # y el cliente descarta los que ya mostró
+            try:
+                desde = datetime.fromisoformat(parametros['desde_fecha']) - timedelta(seconds=1)
+            except ValueError:
+                desde = None
+            for _, fecha, evento in (sala.recientes if desde else ()):
+                if fecha >= desde:
+                    writer.write(evento)
+
+        sala.clientes.add(writer)
+        try:
+            await writer.drain()
+            while True:
+                try:
+                    if not await asyncio.wait_for(reader.read(1024), timeout=INTERVALO_PING):
+                        break
+                except asyncio.TimeoutError:
+                    writer.write(b": ping\n\n")
+                    await asyncio.wait_for(writer.drain(), timeout=INTERVALO_PING)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            sala.clientes.discard(writer)
+            # La inactividad se cuenta desde que se va el último cliente
+            sala.ultimo_uso = time.monotonic()
+
+    async def _recibir_mensaje(self, writer, cabeceras, cuerpo):
+        recibido = time.perf_counter()
+        sesion = await self._sesion(cabeceras)
+        if not sesion:
+            self._responder(writer, 401, {'error': 'Sesión no válida'}, cabeceras)
+            return
+        try:
+            datos = json.loads(cuerpo or b'{}')
+            contenido = str(datos.get('contenido', '')).strip()
+        except (ValueError, AttributeError):
+            contenido = ''
+        if not contenido or len(contenido) > LARGO_MAXIMO_MENSAJE:
+            self._responder(writer, 400, {'error': 'Mensaje vacío o demasiado largo'}, cabeceras)
+            return
+
+        nombre_sala = str(datos.get('sala') or SALA_GENERAL)[:50]
+        if self._sala(nombre_sala) is None:
+            self._responder(writer, 429, {'error': 'Demasiadas salas abiertas'}, cabeceras)
+            return
+        fecha = datetime.now()
+        mensaje = {
+            'id': next(self._secuencia),
+            'sala': nombre_sala,
+            'usuario_id': sesion['usuario_id'],
+            'usuario': sesion.get('usuario'),
+            'contenido': contenido,
+            'fecha_hora': fecha.isoformat(),
+            't_cliente': datos['t_cliente'] if isinstance(datos.get('t_cliente'), (int, float)) else None,
+        }
+        self.publicar(nombre_sala, mensaje)
+        self._pendientes.put_nowait((sesion['usuario_id'], nombre_sala, contenido, fecha))
+        self._latencia_reparto.append((time.perf_counter() - recibido) * 1000)
+        self._responder(writer, 202, {'id': mensaje['id']}, cabeceras)
+
+    def _recibir_latencia(self, writer, cabeceras, cuerpo):
+        try:
+            ms = float(json.loads(cuerpo or b'{}').get('ms'))
+            if 0 <= ms < 60000:
+                self._latencia_extremo.append(ms)
+        except (ValueError, TypeError, AttributeError):
+            pass
+        self._responder(writer, 204, None, cabeceras)
+
+    # ----- Reparto y persistencia -----
+
+    def _sala(self, nombre_sala):
+        """La sala con ese nombre, creándola si hace falta; None si ya hay SALAS_MAXIMAS"""
+        sala = self._salas.get(nombre_sala)
+        if sala is None:
+            if len(self._salas) >= SALAS_MAXIMAS:
+                self._purgar_salas()
+            if len(self._salas) >= SALAS_MAXIMAS:
+                return None
+            sala = self._salas[nombre_sala] = Sala(self.tamano_recientes)
+        sala.ultimo_uso = time.monotonic()
+        return sala
+
+    def _purgar_salas(self):
+        """Libera las salas sin clientes que llevan SALA_INACTIVA segundos sin uso"""
+        ahora = time.monotonic()
+        self._ultima_purga = ahora
+        for nombre, sala in list(self._salas.items()):
+            if not sala.clientes and ahora - sala.ultimo_uso > SALA_INACTIVA:
+                del self._salas[nombre]
+
+    def publicar(self, nombre_sala, mensaje):
+        """Escribe el evento en el buffer de cada cliente de la sala sin esperar"""
+        sala = self._sala(nombre_sala)
+        if sala is None:
+            logger.warning("Mensaje %s sin repartir: demasiadas salas abiertas", mensaje['id'])
+            return
+        evento = f"id: {mensaje['id']}\nevent: mensaje\ndata: {json.dumps(mensaje)}\n\n".encode('utf-8')
+        sala.recientes.append((mensaje['id'], datetime.fromisoformat(mensaje['fecha_hora']), evento))
+        for writer in list(sala.clientes):
+            if writer.is_closing() or writer.transport.get_write_buffer_size() > BUFFER_MAXIMO_CLIENTE:
+                # Un cliente que no lee no debe frenar a los demás
+                sala.clientes.discard(writer)
+                self._desconectados_lentos += 1
+                writer.close()
+                continue
+            writer.write(evento)
+        self._publicados += 1
+
+    async def _bucle_persistencia(self):
+        loop = asyncio.get_running_loop()
+        lote = []
+        terminar = False
+        while not terminar:
+            try:
+                fila = await asyncio.wait_for(self._pendientes.get(), timeout=self.intervalo)
+                if fila is None:
+                    terminar = True
+                else:
+                    lote.append(fila)
+                    if len(lote) < self.tamano_lote:
+                        continue
+            except asyncio.TimeoutError:
+                pass
+            if time.monotonic() - self._ultima_purga > SALA_INACTIVA / 10:
+                self._purgar_salas()
+            if not lote:
+                continue
+            if await loop.run_in_executor(None, self._guardar_lote, lote):
+                self._persistidos += len(lote)
+                lote = []
+            else:
+                self._errores_persistencia += 1
+                # Se reintenta en el siguiente ciclo sin crecer sin límite: los más viejos se pierden
+                descartados = len(lote) - self.tamano_lote * 10
+                if descartados > 0:
+                    self._descartados_persistencia += descartados
+                    logger.warning("Base de datos sin responder: %s mensajes del chat descartados sin guardar "
+                                   "(%s en total)", descartados, self._descartados_persistencia)
+                    lote = lote[descartados:]
+
+    def estadisticas(self):
+        """Conexiones, mensajes y latencias del servidor de chat"""
+        return {
+            'clientes_conectados': sum(len(sala.clientes) for sala in self._salas.values()),
+            'salas': {nombre: len(sala.clientes) for nombre, sala in self._salas.items()},
+            'mensajes_publicados': self._publicados,
+            'mensajes_persistidos': self._persistidos,
+            'pendientes_persistencia': self._pendientes.qsize() if self._pendientes else 0,
+            'errores_persistencia': self._errores_persistencia,
+            'descartados_persistencia': self._descartados_persistencia,
+            'desconectados_lentos': self._desconectados_lentos,
+            'latencia_reparto_ms': {
+                'p50': _percentil(self._latencia_reparto, 50),
+                'p95': _percentil(self._latencia_reparto, 95),
+                'max': round(max(self._latencia_reparto, default=0.0), 2),
+            },
+            'latencia_extremo_a_extremo_ms': {
+                'p50': _percentil(self._latencia_extremo, 50),
+                'p95': _percentil(self._latencia_extremo, 95),
+                'muestras': len(self._latencia_extremo),
+            },
+        }
+
+
+def verificador_sesion_flask():
+    """Busca la sesión de la app Flask en el almacén compartido a partir del id de la cookie"""
+    from app import app
+
+    nombre_cookie = app.config['SESSION_COOKIE_NAME']
+
+    def verificar(cabecera_cookie):
+        cookie = SimpleCookie()
+        try:
+            cookie.load(cabecera_cookie)
+        except Exception:
+            return None
+        if nombre_cookie not in cookie:
+            return None
+        return app.session_interface.cargar(cookie[nombre_cookie].value)
+
+    return verificar
+
+
+async def _main():
+    chat = ServidorChat(
+        verificador_sesion_flask(),
+        tamano_lote=CHAT_BATCH_SIZE,
+        intervalo=CHAT_FLUSH_INTERVAL,
+        origenes_permitidos=CHAT_ALLOWED_ORIGINS,
+        tamano_recientes=CHAT_REPLAY_BUFFER
+    )
+    servidor, persistencia = await chat.iniciar(CHAT_HOST, CHAT_PORT)
+    logger.info("Servidor de chat escuchando en %s:%s", CHAT_HOST, CHAT_PORT)
+
+    detener = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(senal, detener.set)
+        except NotImplementedError:
+            pass  # Windows
+    await detener.wait()
+    logger.info("Deteniendo servidor de chat...")
+    await chat.detener(servidor, persistencia)
+
+
+if __name__ == "__main__":
+    configurar_logging()
+    asyncio.run(_main())
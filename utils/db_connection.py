@@ -1,24 +1,362 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import mysql.connector
-from config import MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB
+from config import (MYSQL_HOST, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DB,
+                    DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_AGE, DB_POOL_PING, DB_POOL_FONDO,
+                    DB_POOL_FONDO_TIMEOUT, LOG_MUESTREO_CONEXIONES)
+from utils.bitacora import MuestreoDebug
+
+logger = logging.getLogger(__name__)
+# Una conexión nueva por préstamo sería ruido: solo 1 de cada N se registra en DEBUG
+_muestreo_conexiones = MuestreoDebug(logger, LOG_MUESTREO_CONEXIONES)
+
+
+class PoolAgotadoError(Exception):
+    """Se lanza cuando no se obtiene una conexión libre dentro del tiempo de espera"""
+
+
+def _crear_conexion_fisica():
+    """
+    Abre una conexión nueva contra MySQL (handshake, autenticación y USE db)
+    """
+    conn = mysql.connector.connect(
+        host=MYSQL_HOST,
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD,
+        database=MYSQL_DB,
+        auth_plugin='mysql_native_password'
+    )
+    _muestreo_conexiones.registrar("Conexión a MySQL establecida correctamente", host=MYSQL_HOST)
+    return conn
+
+
+_observadores_consultas = []
+
+
+def registrar_observador_consultas(funcion):
+    """
+    Registra funcion(sql, duracion_segundos, filas) que se llama después de cada
+    execute/executemany hecho con una conexión del pool (para métricas y consultas lentas).
+    """
+    _observadores_consultas.append(funcion)
+
+
+class CursorMedido:
+    """Cursor que mide la duración de execute/executemany y avisa a los observadores"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _medir(self, metodo, operacion, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return metodo(operacion, *args, **kwargs)
+        finally:
+            duracion = time.perf_counter() - inicio
+            for funcion in _observadores_consultas:
+                try:
+                    funcion(operacion, duracion, getattr(self._cursor, 'rowcount', -1))
+                except Exception:
+                    pass
+
+    def execute(self, operacion, *args, **kwargs):
+        return self._medir(self._cursor.execute, operacion, *args, **kwargs)
+
+    def executemany(self, operacion, *args, **kwargs):
+        return self._medir(self._cursor.executemany, operacion, *args, **kwargs)
+
+
+class ConexionPool:
+    """
+    Envoltura de una conexión prestada por el pool.
+    Se comporta como la conexión de mysql.connector, pero close() la devuelve al pool.
+    """
+
+    def __init__(self, pool, conn, creada):
+        self._pool = pool
+        self._conn = conn
+        self._creada = creada
+
+    def __getattr__(self, nombre):
+        if self._conn is None:
+            raise mysql.connector.errors.OperationalError("La conexión ya fue devuelta al pool")
+        return getattr(self._conn, nombre)
+
+    def cursor(self, *args, **kwargs):
+        if self._conn is None:
+            raise mysql.connector.errors.OperationalError("La conexión ya fue devuelta al pool")
+        cursor = self._conn.cursor(*args, **kwargs)
+        return CursorMedido(cursor) if _observadores_consultas else cursor
+
+    def close(self):
+        """Devuelve la conexión al pool en lugar de cerrarla"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.devolver(conn, self._creada)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PoolConexiones:
+    """
+    Pool acotado de conexiones MySQL reutilizables.
+
+    - tamano: máximo de conexiones físicas abiertas a la vez
+    - timeout: segundos que se espera por una conexión libre
+    - edad_maxima: segundos tras los cuales una conexión se recicla
+    - verificar: hace ping a la conexión antes de prestarla
+    """
+
+    def __init__(self, fabrica, tamano=5, timeout=5.0, edad_maxima=1800, verificar=True):
+        self._fabrica = fabrica
+        self.tamano = max(1, int(tamano))
+        self.timeout = timeout
+        self.edad_maxima = edad_maxima
+        self.verificar = verificar
+
+        self._cond = threading.Condition()
+        self._inactivas = deque()  # (conn, creada)
+        self._total = 0
+        self._en_uso = 0
+
+        # Contadores
+        self._prestamos = 0
+        self._esperas = 0
+        self._tiempo_espera = 0.0
+        self._timeouts = 0
+        self._creadas = 0
+        self._descartadas = 0
+
+    def obtener(self, timeout=None):
+        """Presta una conexión del pool; lanza PoolAgotadoError si vence el tiempo de espera"""
+        timeout = self.timeout if timeout is None else timeout
+        limite = time.monotonic() + timeout
+        espero = False
+        inicio = time.monotonic()
+
+        with self._cond:
+            while True:
+                if self._inactivas:
+                    conn, creada = self._inactivas.pop()
+                    self._en_uso += 1
+                    break
+                if self._total < self.tamano:
+                    self._total += 1
+                    self._en_uso += 1
+                    conn, creada = None, None
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._timeouts += 1
+                    self._registrar_espera(espero, inicio)
+                    raise PoolAgotadoError(
+                        f"No hay conexiones libres tras {timeout:.1f}s (tamaño del pool: {self.tamano})")
+                espero = True
+                self._cond.wait(restante)
+            self._registrar_espera(espero, inicio)
+            self._prestamos += 1
+
+        # La conexión física se abre o verifica fuera del candado
+        try:
+            if conn is not None and not self._sana(conn, creada):
+                self._cerrar(conn)
+                conn = None
+            if conn is None:
+                conn = self._fabrica()
+                creada = time.monotonic()
+                with self._cond:
+                    self._creadas += 1
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._en_uso -= 1
+                self._cond.notify()
+            raise
+
+        return ConexionPool(self, conn, creada)
+
+    def devolver(self, conn, creada):
+        """Devuelve una conexión al pool, descartándola si quedó en mal estado"""
+        # Un cursor sin buffer abandonado deja filas sin leer: leerlas podría tardar lo que la
+        # consulta completa, así que la conexión se cierra y el servidor descarta el resultado
+        reutilizable = not getattr(conn, 'unread_result', False)
+        try:
+            if reutilizable and conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            reutilizable = False
+
+        if reutilizable and self.edad_maxima and time.monotonic() - creada > self.edad_maxima:
+            reutilizable = False
+
+        if not reutilizable:
+            self._cerrar(conn)
+
+        with self._cond:
+            self._en_uso -= 1
+            if reutilizable:
+                self._inactivas.append((conn, creada))
+            else:
+                self._total -= 1
+            self._cond.notify()
+
+    def cerrar_todas(self):
+        """Cierra las conexiones inactivas (por ejemplo al apagar el proceso o tras un fork)"""
+        with self._cond:
+            inactivas = list(self._inactivas)
+            self._inactivas.clear()
+            self._total -= len(inactivas)
+        for conn, _ in inactivas:
+            self._cerrar(conn)
+
+    def estadisticas(self):
+        """Estadísticas del pool para dimensionarlo por worker"""
+        with self._cond:
+            return {
+                'tamano': self.tamano,
+                'abiertas': self._total,
+                'en_uso': self._en_uso,
+                'inactivas': len(self._inactivas),
+                'prestamos': self._prestamos,
+                'esperas': self._esperas,
+                'tiempo_espera_total_ms': round(self._tiempo_espera * 1000, 2),
+                'tiempo_espera_promedio_ms': round(self._tiempo_espera * 1000 / self._esperas, 2) if self._esperas else 0.0,
+                'timeouts': self._timeouts,
+                'creadas': self._creadas,
+                'descartadas': self._descartadas,
+            }
+
+    def _registrar_espera(self, espero, inicio):
+        if espero:
+            self._esperas += 1
+            self._tiempo_espera += time.monotonic() - inicio
+
+    def _sana(self, conn, creada):
+        if self.edad_maxima and time.monotonic() - creada > self.edad_maxima:
+            return False
+        if self.verificar:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def _cerrar(self, conn):
+        with self._cond:
+            self._descartadas += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = PoolConexiones(
+    _crear_conexion_fisica,
+    tamano=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    edad_maxima=DB_POOL_MAX_AGE,
+    verificar=DB_POOL_PING
+)
+
+# Los hilos de fondo de cada worker toman de este pool: un escritor de auditoría o un
+# entrenamiento largo no deja a las peticiones esperando conexión
+_pool_fondo = PoolConexiones(
+    _crear_conexion_fisica,
+    tamano=DB_POOL_FONDO,
+    timeout=DB_POOL_FONDO_TIMEOUT,
+    edad_maxima=DB_POOL_MAX_AGE,
+    verificar=DB_POOL_PING
+)
+
 
 def get_db_connection():
     """
-    Establece y retorna una conexión a la base de datos MySQL
+    Retorna una conexión del pool de MySQL.
+    Al llamar conn.close() la conexión vuelve al pool en lugar de cerrarse.
     """
+    return _prestar(_pool)
+
+
+def get_db_connection_fondo():
+    """Como get_db_connection, pero del pool de los hilos de fondo"""
+    return _prestar(_pool_fondo)
+
+
+def _prestar(pool):
     try:
-        conn = mysql.connector.connect(
-            host=MYSQL_HOST,
-            user=MYSQL_USER,
-            password=MYSQL_PASSWORD,
-            database=MYSQL_DB,
-            auth_plugin='mysql_native_password'
-        )
-        print("Conexión a MySQL establecida correctamente")
-        return conn
+        return pool.obtener()
+    except PoolAgotadoError as e:
+        logger.error("Pool de conexiones agotado: %s", e)
+        return None
     except mysql.connector.Error as e:
-        print(f"Error conectando a MySQL: {e}")
+        logger.error("Error conectando a MySQL: %s", e)
         return None
 
+
+@contextmanager
+def conexion_db():
+    """
+    Context manager que presta una conexión del pool y siempre la devuelve.
+    Entrega None si no fue posible conectarse.
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        if conn:
+            conn.close()
+
+
+def cerrar_cursor(cursor):
+    """
+    Cierra un cursor sin buffer aunque queden filas sin leer (descarga cortada por el
+    cliente): mysql.connector lanza "Unread result found" y la conexión se descarta al devolverla.
+    """
+    try:
+        cursor.close()
+    except mysql.connector.Error:
+        pass
+
+
+def estadisticas_pool(fondo=False):
+    """Estadísticas del pool de conexiones (en uso, inactivas, esperas, tiempo de espera)"""
+    return (_pool_fondo if fondo else _pool).estadisticas()
+
+
+def ping_db(timeout=2.0):
+    """
+    Verifica MySQL con una conexión del pool de fondo: solo el ping del protocolo, sin consultas.
+    Retorna la latencia en segundos; lanza PoolAgotadoError o mysql.connector.Error.
+    """
+    inicio = time.perf_counter()
+    conn = _pool_fondo.obtener(timeout=timeout)
+    try:
+        conn.ping(reconnect=False)
+    finally:
+        conn.close()
+    return time.perf_counter() - inicio
+
+
+def cerrar_pool():
+    """Cierra las conexiones inactivas de los dos pools"""
+    _pool.cerrar_todas()
+    _pool_fondo.cerrar_todas()
+
+
 def test_connection():
     """
     Función para probar la conexión a la base de datos
@@ -29,18 +367,16 @@ def test_connection():
             cursor = conn.cursor()
             cursor.execute("SELECT DATABASE()")
             db_name = cursor.fetchone()
-            print(f"Conectado a la base de datos: {db_name[0]}")
-            
+            logger.info("Conectado a la base de datos: %s", db_name[0])
+
             cursor.execute("SHOW TABLES")
             tables = cursor.fetchall()
-            print("Tablas en la base de datos:")
-            for table in tables:
-                print(f"   - {table[0]}")
-            
+            logger.info("Tablas en la base de datos: %s", ", ".join(table[0] for table in tables))
+
             cursor.close()
             conn.close()
             return True
         except mysql.connector.Error as e:
-            print(f"Error en la consulta: {e}")
+            logger.error("Error en la consulta: %s", e)
             return False
     return False
\ No newline at end of file
@@ -0,0 +1,277 @@
+import logging
+import os
+import threading
+import time
+from datetime import date
+
+from config import STATS_CACHE_TTL, STATS_FILE
+from utils.archivos import bloqueo_archivo, escribir_json, leer_json
+from utils.db_connection import get_db_connection_fondo
+from utils.auditoria import escritor_auditoria
+from utils.ingesta_trafico import buffer_trafico
+
+logger = logging.getLogger(__name__)
+
+
+class EstadisticasAdmin:
+    """
+    Contadores del panel administrativo en memoria.
+
+    Un hilo de fondo los recalcula desde la base de datos cada `ttl` segundos y, entre
+    recálculos, se actualizan de forma incremental con lo que escriben los workers:
+    logs de auditoría, usuarios nuevos, mensajes y tráfico. Así /admin y
+    /admin/estadisticas leen en O(1) sin importar el tamaño de las tablas; una petición
+    solo espera el recálculo si el worker todavía no tiene datos o se pide con ?recalcular=1.
+
+    Con `ruta` los contadores viven en un JSON compartido por los workers: recalcula uno
+    solo, cada actualización incremental se escribe ahí y todos muestran los mismos números.
+    """
+
+    def __init__(self, fabrica_conexion=get_db_connection_fondo, ttl=300, ruta=None):
+        self._fabrica = fabrica_conexion
+        self.ttl = ttl
+        self.ruta = ruta
+        self._candado = threading.Lock()
+        self._candado_recalculo = threading.Lock()
+        self._datos = None
+        self._calculado_en = 0.0   # time.time(): se compara entre procesos
+        self._version = None       # (inodo, mtime) del archivo compartido ya leído
+        self._aciertos = 0
+        self._recalculos = 0
+        self._pid = None
+        self._hilo = None
+
+    def obtener(self, forzar=False):
+        """Retorna las estadísticas con la forma que esperan las plantillas admin"""
+        self._asegurar_hilo()
+        self._sincronizar()
+        if forzar or self._datos is None:
+            # Solo un hilo recalcula; los demás esperan su resultado
+            with self._candado_recalculo:
+                if forzar or self._datos is None:
+                    self.recalcular()
+        else:
+            self._aciertos += 1
+
+        with self._candado:
+            if self._datos is None:
+                return {}
+            self._cambiar_dia_si_es_necesario()
+            datos = self._datos
+            return {
+                'total_usuarios': datos['total_usuarios'],
+                'total_mensajes': datos['total_mensajes'],
+                'actividad_hoy': datos['actividad_hoy'],
+                'conexiones_hoy': datos['conexiones_hoy'],
+                'usuarios_rol': [{'rol': rol, 'cantidad': cantidad}
+                                 for rol, cantidad in sorted(datos['usuarios_rol'].items())],
+                'actividad_hora': [{'hora': hora, 'cantidad': cantidad}
+                                   for hora, cantidad in sorted(datos['actividad_hora'].items())],
+                'calculado_hace': round(time.time() - self._calculado_en, 1),
+            }
+
+    def recalcular(self):
+        """Recalcula todos los contadores desde la base de datos"""
+        conn = self._fabrica()
+        if not conn:
+            return False
+        try:
+            cursor = conn.cursor(dictionary=True)
+
+            cursor.execute("SELECT COUNT(*) as total FROM usuarios")
+            total_usuarios = cursor.fetchone()['total']
+
+            cursor.execute("SELECT COUNT(*) as total FROM mensajes")
+            total_mensajes = cursor.fetchone()['total']
+
+            # Rango sobre fecha_hora en lugar de DATE(fecha_hora) para poder usar el índice
+            cursor.execute("""
+                SELECT HOUR(fecha_hora) as hora, COUNT(*) as cantidad
+                FROM logs_transacciones
+                WHERE fecha_hora >= CURDATE() AND fecha_hora < CURDATE() + INTERVAL 1 DAY
+                GROUP BY HOUR(fecha_hora)
+            """)
+            actividad_hora = {fila['hora']: fila['cantidad'] for fila in cursor.fetchall()}
+
+            cursor.execute("SELECT COUNT(*) as total FROM trafico_red WHERE fecha = CURDATE()")
+            conexiones_hoy = cursor.fetchone()['total']
+
+            cursor.execute("SELECT rol, COUNT(*) as cantidad FROM usuarios GROUP BY rol")
+            usuarios_rol = {fila['rol']: fila['cantidad'] for fila in cursor.fetchall()}
+
+            cursor.close()
+        except Exception as e:
+            logger.error("Error obteniendo estadísticas: %s", e)
+            return False
+        finally:
+            conn.close()
+
+        with self._candado:
+            self._datos = {
+                'dia': date.today(),
+                'total_usuarios': total_usuarios,
+                'total_mensajes': total_mensajes,
+                'actividad_hoy': sum(actividad_hora.values()),
+                'actividad_hora': actividad_hora,
+                'conexiones_hoy': conexiones_hoy,
+                'usuarios_rol': usuarios_rol,
+            }
+            self._calculado_en = time.time()
+            self._recalculos += 1
+            if self.ruta:
+                with bloqueo_archivo(self.ruta + '.lock'):
+                    self._escribir_compartido()
+        return True
+
+    def invalidar(self):
+        """Adelanta el recálculo a la siguiente vuelta del hilo de fondo"""
+        with self._candado:
+            self._calculado_en = 0.0
+        if self._hilo is not None:
+            self._despertar.set()
+
+    # ----- Hilo de fondo y archivo compartido -----
+
+    def _asegurar_hilo(self):
+        # Tras un fork (gunicorn --preload) el hilo del padre no existe en el hijo
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        with self._candado:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            self._despertar = threading.Event()
+            self._hilo = threading.Thread(target=self._bucle, name="estadisticas-admin", daemon=True)
+            self._pid = os.getpid()
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            try:
+                self._sincronizar()
+                if self._datos is not None and time.time() - self._calculado_en >= self.ttl:
+                    self._recalcular_vencido()
+            except Exception as e:
+                logger.error("Error recalculando estadísticas en segundo plano: %s", e)
+            restante = self.ttl - (time.time() - self._calculado_en)
+            self._despertar.wait(min(max(restante, 1.0), self.ttl))
+            self._despertar.clear()
+
+    def _recalcular_vencido(self):
+        if not self.ruta:
+            self.recalcular()
+            return
+        # Un solo worker recalcula; los demás leen su resultado del archivo
+        with bloqueo_archivo(self.ruta + '.recalculo.lock', esperar=False) as tomado:
+            if not tomado:
+                return
+            self._sincronizar()
+            if time.time() - self._calculado_en >= self.ttl:
+                self.recalcular()
+
+    def _sincronizar(self):
+        if self.ruta:
+            with self._candado:
+                self._leer_compartido()
+
+    def _leer_compartido(self):
+        # Se llama con self._candado tomado
+        try:
+            info = os.stat(self.ruta)
+        except OSError:
+            return
+        version = (info.st_ino, info.st_mtime_ns)
+        if version == self._version:
+            return
+        guardado = leer_json(self.ruta)
+        if not guardado:
+            return
+        self._version = version
+        self._calculado_en = guardado['calculado_en']
+        self._datos = {
+            'dia': date.fromisoformat(guardado['dia']),
+            'total_usuarios': guardado['total_usuarios'],
+            'total_mensajes': guardado['total_mensajes'],
+            'actividad_hoy': guardado['actividad_hoy'],
+            'actividad_hora': {int(hora): cantidad for hora, cantidad in guardado['actividad_hora'].items()},
+            'conexiones_hoy': guardado['conexiones_hoy'],
+            'usuarios_rol': guardado['usuarios_rol'],
+        }
+
+    def _escribir_compartido(self):
+        # Se llama con self._candado y el candado del archivo tomados
+        escribir_json(self.ruta, dict(self._datos, dia=self._datos['dia'].isoformat(),
+                                      calculado_en=self._calculado_en))
+        info = os.stat(self.ruta)
+        self._version = (info.st_ino, info.st_mtime_ns)
+
+    def _modificar(self, cambio):
+        """Aplica cambio(datos); con archivo compartido, sobre su versión más nueva y lo reescribe"""
+        with self._candado:
+            if not self.ruta:
+                if self._datos is not None:
+                    self._cambiar_dia_si_es_necesario()
+                    cambio(self._datos)
+                return
+            with bloqueo_archivo(self.ruta + '.lock'):
+                self._leer_compartido()
+                if self._datos is None:
+                    return
+                self._cambiar_dia_si_es_necesario()
+                cambio(self._datos)
+                self._escribir_compartido()
+
+    # ----- Actualizaciones incrementales -----
+
+    def registrar_actividad(self, lote):
+        """Suma al contador del día y por hora los logs (usuario_id, accion, fecha_hora) escritos"""
+        def cambio(datos):
+            for _, _, fecha_hora in lote:
+                if fecha_hora.date() == datos['dia']:
+                    datos['actividad_hoy'] += 1
+                    horas = datos['actividad_hora']
+                    horas[fecha_hora.hour] = horas.get(fecha_hora.hour, 0) + 1
+        self._modificar(cambio)
+
+    def registrar_usuario(self, rol):
+        """Suma un usuario nuevo a los totales"""
+        def cambio(datos):
+            datos['total_usuarios'] += 1
+            datos['usuarios_rol'][rol] = datos['usuarios_rol'].get(rol, 0) + 1
+        self._modificar(cambio)
+
+    def registrar_mensajes(self, cantidad=1):
+        """Suma mensajes persistidos al total"""
+        def cambio(datos):
+            datos['total_mensajes'] += cantidad
+        self._modificar(cambio)
+
+    def registrar_trafico(self, fechas):
+        """Suma las muestras de trafico_red del día"""
+        fechas = list(fechas)
+
+        def cambio(datos):
+            datos['conexiones_hoy'] += sum(1 for fecha in fechas if fecha == datos['dia'])
+        self._modificar(cambio)
+
+    def estadisticas_cache(self):
+        """Aciertos y recálculos de la caché"""
+        return {
+            'ttl': self.ttl,
+            'aciertos': self._aciertos,
+            'recalculos': self._recalculos,
+            'compartido': self.ruta or None,
+            'edad_segundos': round(time.time() - self._calculado_en, 1) if self._datos else None,
+        }
+
+    def _cambiar_dia_si_es_necesario(self):
+        # Al pasar la medianoche los contadores "de hoy" empiezan en cero
+        if self._datos['dia'] != date.today():
+            self._datos['dia'] = date.today()
+            self._datos['actividad_hoy'] = 0
+            self._datos['actividad_hora'] = {}
+            self._datos['conexiones_hoy'] = 0
+
+
+estadisticas_admin = EstadisticasAdmin(ttl=STATS_CACHE_TTL, ruta=STATS_FILE)
+escritor_auditoria.suscribir(estadisticas_admin.registrar_actividad)
+buffer_trafico.suscribir(lambda lote: estadisticas_admin.registrar_trafico(fila[1] for fila in lote))
@@ -0,0 +1,339 @@
+"""
+Exportación de usuarios, logs_transacciones y trafico_red a CSV o XLSX.
+
+Las filas se leen con un cursor sin buffer (el servidor las envía a medida que se
+consumen) y se escriben por bloques, así la memoria no crece con el número de filas:
+
+- CSV: un generador que Flask envía como respuesta por partes (chunked)
+- XLSX: libro de openpyxl en modo write-only sobre un archivo temporal, que luego
+  se envía por bloques y se borra
+- Segundo plano: el archivo se genera en un hilo dentro de EXPORT_DIR y el estado
+  del trabajo se guarda en un JSON al lado, para consultarlo desde cualquier worker
+"""
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from config import EXPORT_DIR, EXPORT_BLOCK_SIZE, EXPORT_MAX_WORKERS, EXPORT_RETENTION_HOURS
+from utils.db_connection import get_db_connection, get_db_connection_fondo, cerrar_cursor
+from utils.referencias import descripcion_tipo_documento
+from utils.usuarios import _escapar_like
+
+logger = logging.getLogger(__name__)
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+CONJUNTOS = {
+    'usuarios': {
+        'columnas': ['id', 'nombre', 'correo', 'telefono', 'documento', 'rol',
+                     'tipo_documento_id', 'fecha_creacion'],
+        'tabla': 'usuarios',
+        'fecha': 'fecha_creacion',
+        'orden': 'id',
+    },
+    'logs': {
+        'columnas': ['id', 'usuario_id', 'accion', 'fecha_hora'],
+        'tabla': 'logs_transacciones',
+        'fecha': 'fecha_hora',
+        'orden': 'id',
+    },
+    'trafico': {
+        'columnas': ['zona_id', 'fecha', 'hora', 'tipo_dispositivo', 'usuarios_conectados',
+                     'ancho_banda_consumido', 'latencia_promedio'],
+        'tabla': 'trafico_red',
+        'fecha': 'fecha',
+        'orden': 'fecha, hora, zona_id',
+    },
+}
+
+
+def encabezados(tipo):
+    columnas = list(CONJUNTOS[tipo]['columnas'])
+    if tipo == 'usuarios':
+        columnas.insert(columnas.index('tipo_documento_id') + 1, 'tipo_documento')
+    return columnas
+
+
+def construir_consulta(tipo, filtros):
+    """SELECT y parámetros del conjunto con los filtros (desde/hasta, rol, tipo de documento, zona...)"""
+    conjunto = CONJUNTOS[tipo]
+    condiciones = []
+    parametros = []
+    columna_fecha = conjunto['fecha']
+
+    if filtros.get('desde'):
+        condiciones.append(f"{columna_fecha} >= %s")
+        parametros.append(filtros['desde'])
+    if filtros.get('hasta'):
+        # hasta es inclusive: se compara contra el día siguiente para que el rango sea sargable
+        condiciones.append(f"{columna_fecha} < %s")
+        parametros.append(filtros['hasta'] + timedelta(days=1))
+    if tipo == 'usuarios':
+        if filtros.get('rol'):
+            condiciones.append("rol = %s")
+            parametros.append(filtros['rol'])
+        if filtros.get('tipo_documento_id'):
+            condiciones.append("tipo_documento_id = %s")
+            parametros.append(filtros['tipo_documento_id'])
+        if filtros.get('prefijo'):
+            patron = _escapar_like(filtros['prefijo'].strip()) + "%"
+            condiciones.append("(nombre LIKE %s OR correo LIKE %s)")
+            parametros.extend([patron, patron])
+    elif tipo == 'logs' and filtros.get('usuario_id'):
+        condiciones.append("usuario_id = %s")
+        parametros.append(filtros['usuario_id'])
+    elif tipo == 'trafico' and filtros.get('zona_id'):
+        condiciones.append("zona_id = %s")
+        parametros.append(filtros['zona_id'])
+
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    consulta = f"""
+        SELECT {', '.join(conjunto['columnas'])}
+        FROM {conjunto['tabla']}
+        {where}
+        ORDER BY {conjunto['orden']}
+    """
+    return consulta, parametros
+
+
+# Excel y LibreOffice interpretan como fórmula una celda que empieza con estos caracteres
+_INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _valor(valor):
+    # TIME llega como timedelta desde mysql.connector
+    if isinstance(valor, timedelta):
+        segundos = int(valor.total_seconds())
+        return f"{segundos // 3600:02d}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+    # Texto escrito por usuarios (nombre, correo, acción): se antepone ' para que no se ejecute como fórmula
+    if isinstance(valor, str) and valor.startswith(_INICIO_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def leer_filas(tipo, filtros, tamano_bloque=EXPORT_BLOCK_SIZE, fabrica=get_db_connection):
+    """
+    Genera las filas del conjunto (listas en el orden de encabezados()) leyendo por bloques.
+    fabrica da la conexión: las descargas usan el pool de peticiones, los trabajos de fondo el suyo.
+    """
+    consulta, parametros = construir_consulta(tipo, filtros)
+    conn = fabrica()
+    if not conn:
+        raise ConnectionError("Error de conexión a la base de datos.")
+    try:
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(consulta, parametros)
+        indice_tipo = CONJUNTOS['usuarios']['columnas'].index('tipo_documento_id')
+        while True:
+            filas = cursor.fetchmany(tamano_bloque)
+            if not filas:
+                break
+            for fila in filas:
+                fila = [_valor(v) for v in fila]
+                if tipo == 'usuarios':
+                    fila.insert(indice_tipo + 1, descripcion_tipo_documento(fila[indice_tipo]))
+                yield fila
+        cerrar_cursor(cursor)
+    finally:
+        # Si el cliente corta la descarga, el generador se cierra con filas sin leer:
+        # el pool descarta esa conexión en lugar de prestarla de nuevo
+        conn.close()
+
+
+def generar_csv(tipo, filtros, filas_por_bloque=1000):
+    """Generador de bytes CSV (UTF-8 con BOM para que Excel muestre bien las tildes)"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write('\ufeff')
+    escritor.writerow(encabezados(tipo))
+    pendientes = 0
+    for fila in leer_filas(tipo, filtros):
+        escritor.writerow(fila)
+        pendientes += 1
+        if pendientes >= filas_por_bloque:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pendientes = 0
+    yield buffer.getvalue().encode('utf-8')
+
+
+def escribir_xlsx(tipo, filtros, destino, fabrica=get_db_connection):
+    """Escribe un libro write-only en `destino` (ruta o archivo); retorna el número de filas"""
+    from openpyxl import Workbook  # solo se carga al exportar a Excel
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(title=tipo)
+    hoja.append(encabezados(tipo))
+    total = 0
+    for fila in leer_filas(tipo, filtros, fabrica=fabrica):
+        hoja.append(fila)
+        total += 1
+    libro.save(destino)
+    return total
+
+
+def generar_xlsx(tipo, filtros, tamano_bloque=64 * 1024):
+    """
+    Genera el XLSX en un archivo temporal y lo envía por bloques.
+    Un .xlsx es un zip que solo queda completo al final, así que no puede enviarse fila a fila.
+    """
+    descriptor, ruta = tempfile.mkstemp(suffix='.xlsx')
+    os.close(descriptor)
+    try:
+        escribir_xlsx(tipo, filtros, ruta)
+        with open(ruta, 'rb') as archivo:
+            while True:
+                bloque = archivo.read(tamano_bloque)
+                if not bloque:
+                    break
+                yield bloque
+    finally:
+        os.remove(ruta)
+
+
+def iniciar_flujo(generador):
+    """
+    Pide el primer bloque antes de responder: así un error de conexión se reporta con
+    un código HTTP en lugar de cortar una descarga ya empezada.
+    """
+    primero = next(generador, b'')
+
+    def continuar():
+        try:
+            yield primero
+            yield from generador
+        finally:
+            generador.close()
+
+    return continuar()
+
+
+def nombre_archivo(tipo, formato):
+    return f"{tipo}_{datetime.now():%Y%m%d_%H%M%S}.{formato}"
+
+
+class TrabajosExportacion:
+    """Exportaciones en segundo plano con el estado guardado en disco"""
+
+    def __init__(self, directorio='exports', max_trabajadores=2, retencion_horas=24):
+        self.directorio = directorio
+        self.max_trabajadores = max_trabajadores
+        self.retencion = retencion_horas * 3600
+        self._candado = threading.Lock()
+        self._pid = None
+        self._ejecutor = None
+
+    def _ruta_estado(self, trabajo_id):
+        return os.path.join(self.directorio, f"{trabajo_id}.json")
+
+    def _guardar_estado(self, estado):
+        temporal = self._ruta_estado(estado['id']) + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(estado, f, ensure_ascii=False)
+        os.replace(temporal, self._ruta_estado(estado['id']))
+
+    def _asegurar_ejecutor(self):
+        # Tras un fork (gunicorn --preload) los hilos del padre no existen en el hijo
+        if self._pid == os.getpid() and self._ejecutor is not None:
+            return self._ejecutor
+        with self._candado:
+            if self._pid != os.getpid() or self._ejecutor is None:
+                self._ejecutor = ThreadPoolExecutor(max_workers=self.max_trabajadores,
+                                                    thread_name_prefix="exportacion")
+                self._pid = os.getpid()
+            return self._ejecutor
+
+    def crear(self, tipo, formato, filtros, usuario_id=None):
+        """Encola la exportación y retorna su estado inicial"""
+        os.makedirs(self.directorio, exist_ok=True)
+        self.limpiar()
+        trabajo_id = uuid.uuid4().hex
+        estado = {
+            'id': trabajo_id,
+            'tipo': tipo,
+            'formato': formato,
+            'filtros': {k: (v.isoformat() if hasattr(v, 'isoformat') else v) for k, v in filtros.items()},
+            'usuario_id': usuario_id,
+            'estado': 'pendiente',
+            'filas': 0,
+            'archivo': nombre_archivo(tipo, formato),
+            'creado': datetime.now().isoformat(timespec='seconds'),
+            'terminado': None,
+            'error': None,
+        }
+        self._guardar_estado(estado)
+        self._asegurar_ejecutor().submit(self._ejecutar, dict(estado), filtros)
+        return estado
+
+    def _ejecutar(self, estado, filtros):
+        estado['estado'] = 'en_proceso'
+        self._guardar_estado(estado)
+        ruta = os.path.join(self.directorio, f"{estado['id']}.{estado['formato']}")
+        inicio = time.perf_counter()
+        try:
+            if estado['formato'] == 'xlsx':
+                estado['filas'] = escribir_xlsx(estado['tipo'], filtros, ruta, fabrica=get_db_connection_fondo)
+            else:
+                total = 0
+                with open(ruta, 'w', encoding='utf-8-sig', newline='') as archivo:
+                    escritor = csv.writer(archivo)
+                    escritor.writerow(encabezados(estado['tipo']))
+                    for fila in leer_filas(estado['tipo'], filtros, fabrica=get_db_connection_fondo):
+                        escritor.writerow(fila)
+                        total += 1
+                estado['filas'] = total
+            estado['estado'] = 'listo'
+        except Exception as e:
+            logger.error("Error en la exportación %s: %s", estado['id'], e)
+            estado['estado'] = 'error'
+            estado['error'] = str(e)
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        estado['duracion_segundos'] = round(time.perf_counter() - inicio, 1)
+        estado['terminado'] = datetime.now().isoformat(timespec='seconds')
+        self._guardar_estado(estado)
+
+    def estado(self, trabajo_id):
+        """Estado del trabajo o None si no existe"""
+        if not trabajo_id.isalnum():
+            return None
+        try:
+            with open(self._ruta_estado(trabajo_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def ruta_archivo(self, estado):
+        return os.path.abspath(os.path.join(self.directorio, f"{estado['id']}.{estado['formato']}"))
+
+    def limpiar(self):
+        """Borra los archivos de exportaciones más antiguas que la retención"""
+        if not os.path.isdir(self.directorio):
+            return
+        limite = time.time() - self.retencion
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+            except OSError:
+                pass
+
+
+trabajos_exportacion = TrabajosExportacion(
+    directorio=EXPORT_DIR,
+    max_trabajadores=EXPORT_MAX_WORKERS,
+    retencion_horas=EXPORT_RETENTION_HOURS
+)
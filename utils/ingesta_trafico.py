@@ -0,0 +1,333 @@
+"""
+Ingesta por lotes de muestras de trafico_red enviadas por los colectores.
+
+La petición solo valida las muestras y las deja en un buffer en memoria indexado por
+(zona_id, fecha, hora, tipo_dispositivo), así las repetidas se reemplazan antes de
+llegar a la base. Un hilo en segundo plano vacía el buffer con INSERT de varias filas
+(ON DUPLICATE KEY UPDATE sobre el índice único de la migración 005) cuando se
+alcanza el tamaño de lote o el intervalo; ninguna petición toma una conexión.
+Si la base rechaza un lote (zona inexistente, valor fuera de rango) se divide en
+mitades hasta aislar las filas rechazadas, que quedan en cuarentena; el resto se escribe.
+
+Formatos del cuerpo:
+- JSON lines (application/x-ndjson): un objeto por línea
+- CSV (text/csv): con encabezado zona_id,fecha,hora,tipo_dispositivo,usuarios_conectados,
+  ancho_banda_consumido,latencia_promedio
+"""
+import atexit
+import csv
+import io
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import date, time as dt_time
+
+import mysql.connector
+
+from config import INGESTA_CAPACIDAD, INGESTA_LOTE, INGESTA_INTERVALO
+from utils.db_connection import get_db_connection_fondo
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS = ('zona_id', 'fecha', 'hora', 'tipo_dispositivo', 'usuarios_conectados',
+            'ancho_banda_consumido', 'latencia_promedio')
+LARGO_MAXIMO_DISPOSITIVO = 50
+# Errores detallados que se devuelven al colector (el resto solo se cuenta)
+ERRORES_MAXIMOS = 20
+# Rango de las columnas: INT para ids y usuarios, DECIMAL(10,2) para las métricas
+MAXIMO_ENTERO = 2 ** 31 - 1
+MAXIMO_METRICA = 99999999.99
+# Filas rechazadas por la base que se conservan para revisarlas en /admin/api/ingesta
+CUARENTENA_MAXIMA = 100
+# Errores de la base por los datos de una fila (no de conexión): reintentar no sirve
+ERRORES_DE_DATOS = (mysql.connector.errors.DataError, mysql.connector.errors.IntegrityError,
+                    mysql.connector.errors.ProgrammingError)
+
+
+class MuestraInvalida(ValueError):
+    """Muestra con campos faltantes o fuera de rango"""
+
+
+def _hora(valor):
+    # Se acepta la hora como entero (0-23) o como HH:MM[:SS]
+    if isinstance(valor, int):
+        return dt_time(valor)
+    partes = [int(p) for p in str(valor).split(':')]
+    return dt_time(*partes)
+
+
+def validar_muestra(dato):
+    """Tupla lista para insertar (en el orden de COLUMNAS) o MuestraInvalida"""
+    faltantes = [c for c in COLUMNAS if dato.get(c) in (None, '')]
+    if faltantes:
+        raise MuestraInvalida(f"faltan campos: {', '.join(faltantes)}")
+    try:
+        zona_id = int(dato['zona_id'])
+        fecha = date.fromisoformat(str(dato['fecha']))
+        hora = _hora(dato['hora'])
+        usuarios = int(dato['usuarios_conectados'])
+        ancho_banda = float(dato['ancho_banda_consumido'])
+        latencia = float(dato['latencia_promedio'])
+    except (TypeError, ValueError) as e:
+        raise MuestraInvalida(f"valor no válido: {e}") from None
+    tipo_dispositivo = str(dato['tipo_dispositivo']).strip().lower()
+
+    if not 0 < zona_id <= MAXIMO_ENTERO:
+        raise MuestraInvalida("zona_id fuera de rango")
+    if not tipo_dispositivo or len(tipo_dispositivo) > LARGO_MAXIMO_DISPOSITIVO:
+        raise MuestraInvalida("tipo_dispositivo vacío o demasiado largo")
+    # Infinity/NaN llegan a float() desde JSON o CSV y mysql.connector los escribe tal cual en el SQL
+    if not (math.isfinite(ancho_banda) and math.isfinite(latencia)):
+        raise MuestraInvalida("las métricas deben ser números finitos")
+    if usuarios < 0 or ancho_banda < 0 or latencia < 0:
+        raise MuestraInvalida("las métricas no pueden ser negativas")
+    if usuarios > MAXIMO_ENTERO or ancho_banda > MAXIMO_METRICA or latencia > MAXIMO_METRICA:
+        raise MuestraInvalida("métrica fuera del rango de la columna")
+    return (zona_id, fecha, hora, tipo_dispositivo, usuarios, round(ancho_banda, 2), round(latencia, 2))
+
+
+def leer_cuerpo(texto, formato):
+    """Genera (número de línea, dict) del cuerpo; las líneas que no se pueden leer dan (línea, None)"""
+    if formato == 'csv':
+        lector = csv.DictReader(io.StringIO(texto))
+        for numero, fila in enumerate(lector, start=2):
+            yield numero, fila
+        return
+    for numero, linea in enumerate(texto.splitlines(), start=1):
+        if not linea.strip():
+            continue
+        try:
+            dato = json.loads(linea)
+        except ValueError:
+            yield numero, None
+            continue
+        yield numero, dato if isinstance(dato, dict) else None
+
+
+class BufferTrafico:
+    """Buffer deduplicado de muestras con escritura por lotes en segundo plano"""
+
+    def __init__(self, fabrica_conexion=get_db_connection_fondo, capacidad=100000, tamano_lote=1000,
+                 intervalo=1.0):
+        self._fabrica = fabrica_conexion
+        self.capacidad = capacidad
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+
+        self._muestras = {}  # (zona_id, fecha, hora, tipo_dispositivo) -> tupla completa
+        self._candado = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener = False
+        self._pid = None
+        self._hilo = None
+        self._suscriptores = []
+        self._cuarentena = deque(maxlen=CUARENTENA_MAXIMA)
+
+        # Contadores
+        self._aceptadas = 0
+        self._rechazadas = 0
+        self._duplicadas = 0
+        self._escritas = 0
+        self._descartadas = 0
+        self._rechazadas_db = 0
+        self._lotes = 0
+        self._errores = 0
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+
+    def agregar(self, filas):
+        """
+        Agrega muestras ya validadas. Retorna False sin agregar nada si no caben
+        (el colector debe reintentar; al estar deduplicadas, reenviar no duplica filas).
+        """
+        self._asegurar_hilo()
+        with self._candado:
+            if len(self._muestras) + len(filas) > self.capacidad:
+                return False
+            antes = len(self._muestras)
+            for fila in filas:
+                self._muestras[fila[:4]] = fila
+            self._duplicadas += len(filas) - (len(self._muestras) - antes)
+            self._aceptadas += len(filas)
+            lleno = len(self._muestras) >= self.tamano_lote
+        if lleno:
+            self._despertar.set()
+        return True
+
+    def ingerir(self, texto, formato):
+        """Valida y encola el cuerpo de una petición; retorna el resumen para el colector"""
+        validas = []
+        errores = []
+        rechazadas = 0
+        for numero, dato in leer_cuerpo(texto, formato):
+            try:
+                if dato is None:
+                    raise MuestraInvalida("línea con formato no válido")
+                validas.append(validar_muestra(dato))
+            except MuestraInvalida as e:
+                rechazadas += 1
+                if len(errores) < ERRORES_MAXIMOS:
+                    errores.append({'linea': numero, 'error': str(e)})
+
+        with self._candado:
+            self._rechazadas += rechazadas
+        if validas and not self.agregar(validas):
+            return None
+        return {'aceptadas': len(validas), 'rechazadas': rechazadas, 'errores': errores}
+
+    def suscribir(self, funcion):
+        """Registra una función que recibe cada lote de tuplas (en el orden de COLUMNAS) ya escrito"""
+        self._suscriptores.append(funcion)
+
+    def pendientes(self):
+        return len(self._muestras)
+
+    def vaciar(self, timeout=5.0):
+        """Escribe lo pendiente y detiene el hilo (se llama al apagar)"""
+        if self._hilo is None or self._pid != os.getpid() or not self._hilo.is_alive():
+            return
+        self._detener = True
+        self._despertar.set()
+        self._hilo.join(timeout)
+
+    def estadisticas(self):
+        with self._candado:
+            return {
+                'capacidad': self.capacidad,
+                'pendientes': len(self._muestras),
+                'aceptadas': self._aceptadas,
+                'rechazadas': self._rechazadas,
+                'duplicadas_en_buffer': self._duplicadas,
+                'escritas': self._escritas,
+                'descartadas': self._descartadas,
+                'rechazadas_db': self._rechazadas_db,
+                'cuarentena': [{'fila': [str(v) for v in fila], 'error': error} for fila, error in self._cuarentena],
+                'lotes': self._lotes,
+                'errores': self._errores,
+                'latencia_lote_promedio_ms': round(self._latencia_total * 1000 / self._lotes, 2) if self._lotes else 0.0,
+                'latencia_lote_max_ms': round(self._latencia_max * 1000, 2),
+            }
+
+    def _asegurar_hilo(self):
+        # Tras un fork (gunicorn --preload) el hilo del padre no existe en el hijo; si el
+        # hilo murió por un error inesperado se arranca otro sin perder lo que hay en el buffer
+        if self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._candado:
+            if self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._muestras = {}
+            self._hilo = threading.Thread(target=self._bucle, name="ingesta-trafico", daemon=True)
+            self._pid = os.getpid()
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            with self._candado:
+                lote = list(self._muestras.values())
+                self._muestras = {}
+            if lote:
+                try:
+                    self._escribir(lote)
+                except Exception as e:
+                    logger.error("Error inesperado escribiendo lote de tráfico: %s", e)
+                    self._devolver(lote)
+            if self._detener:
+                return
+
+    def _escribir(self, lote):
+        inicio = time.monotonic()
+        conn = self._fabrica()
+        if not conn:
+            self._devolver(lote)
+            return False
+        escritas = []
+        restantes = lote
+        try:
+            cursor = conn.cursor()
+            while restantes:
+                escritas.extend(self._escribir_parte(conn, cursor, restantes[:self.tamano_lote]))
+                restantes = restantes[self.tamano_lote:]
+            cursor.close()
+        except Exception as e:
+            # Conexión perdida o base caída: lo que falta vuelve al buffer (reescribir no duplica filas)
+            logger.error("Error escribiendo lote de tráfico: %s", e)
+            _deshacer(conn)
+            self._devolver(restantes)
+            return False
+        finally:
+            conn.close()
+
+        duracion = time.monotonic() - inicio
+        with self._candado:
+            self._escritas += len(escritas)
+            self._lotes += 1
+            self._latencia_total += duracion
+            self._latencia_max = max(self._latencia_max, duracion)
+
+        if escritas:
+            for funcion in self._suscriptores:
+                try:
+                    funcion(escritas)
+                except Exception as e:
+                    logger.error("Error notificando lote de tráfico: %s", e)
+        return True
+
+    def _escribir_parte(self, conn, cursor, parte):
+        """Escribe y confirma una parte; si la base rechaza los datos la divide hasta aislar las filas malas"""
+        try:
+            valores = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(parte))
+            cursor.execute(
+                f"INSERT INTO trafico_red ({', '.join(COLUMNAS)}) VALUES {valores} "
+                "ON DUPLICATE KEY UPDATE usuarios_conectados = VALUES(usuarios_conectados), "
+                "ancho_banda_consumido = VALUES(ancho_banda_consumido), "
+                "latencia_promedio = VALUES(latencia_promedio)",
+                [valor for fila in parte for valor in fila]
+            )
+            conn.commit()
+            return list(parte)
+        except ERRORES_DE_DATOS as e:
+            _deshacer(conn)
+            if len(parte) == 1:
+                logger.warning("Muestra de tráfico rechazada por la base: %s (%s)", parte[0], e)
+                with self._candado:
+                    self._rechazadas_db += 1
+                    self._cuarentena.append((parte[0], str(e)))
+                return []
+            mitad = len(parte) // 2
+            return (self._escribir_parte(conn, cursor, parte[:mitad])
+                    + self._escribir_parte(conn, cursor, parte[mitad:]))
+
+    def _devolver(self, lote):
+        # Si la base no responde el lote vuelve al buffer, sin pisar muestras más nuevas
+        with self._candado:
+            self._errores += 1
+            for fila in lote:
+                if len(self._muestras) >= self.capacidad:
+                    self._descartadas += 1
+                    continue
+                self._muestras.setdefault(fila[:4], fila)
+
+
+def _deshacer(conn):
+    # Con la conexión perdida rollback() también falla; no debe tumbar el hilo de escritura
+    try:
+        conn.rollback()
+    except Exception:
+        pass
+
+
+buffer_trafico = BufferTrafico(
+    capacidad=INGESTA_CAPACIDAD,
+    tamano_lote=INGESTA_LOTE,
+    intervalo=INGESTA_INTERVALO
+)
+
+atexit.register(buffer_trafico.vaciar)
@@ -0,0 +1,84 @@
+import logging
+
+from utils.db_connection import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+SALA_GENERAL = 'general'
+LIMITE_HISTORIAL = 100
+
+
+def insertar_mensajes(lote):
+    """
+    Inserta un lote de mensajes (usuario_id, sala, contenido, fecha_hora) con un solo INSERT.
+    Retorna True si se guardaron.
+    """
+    if not lote:
+        return True
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        cursor = conn.cursor()
+        valores = ", ".join(["(%s, %s, %s, %s)"] * len(lote))
+        parametros = [valor for fila in lote for valor in fila]
+        cursor.execute(
+            f"INSERT INTO mensajes (usuario_id, sala, contenido, fecha_hora) VALUES {valores}",
+            parametros
+        )
+        conn.commit()
+        cursor.close()
+        return True
+    except Exception as e:
+        logger.error("Error guardando mensajes: %s", e)
+        return False
+    finally:
+        conn.close()
+
+
+def obtener_historial(sala=SALA_GENERAL, antes_de=None, limite=50):
+    """
+    Mensajes de una sala, del más reciente al más antiguo, paginados por id.
+    Retorna (mensajes en orden cronológico, id para pedir la página anterior o None).
+    """
+    limite = max(1, min(int(limite), LIMITE_HISTORIAL))
+    parametros = [sala]
+    filtro = ""
+    if antes_de:
+        filtro = "AND m.id < %s"
+        parametros.append(antes_de)
+    parametros.append(limite + 1)
+
+    conn = get_db_connection()
+    if not conn:
+        return [], None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"""
+            SELECT m.id, m.usuario_id, u.nombre as usuario_nombre, m.contenido, m.fecha_hora
+            FROM mensajes m
+            JOIN usuarios u ON m.usuario_id = u.id
+            WHERE m.sala = %s {filtro}
+            ORDER BY m.id DESC
+            LIMIT %s
+        """, parametros)
+        filas = cursor.fetchall()
+        cursor.close()
+    except Exception as e:
+        logger.error("Error obteniendo historial de mensajes: %s", e)
+        return [], None
+    finally:
+        conn.close()
+
+    anterior = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        anterior = filas[-1]['id']
+    filas.reverse()
+    return [{
+        'id': fila['id'],
+        'usuario_id': fila['usuario_id'],
+        'usuario': fila['usuario_nombre'],
+        'contenido': fila['contenido'],
+        'fecha_hora': fila['fecha_hora'].isoformat() if fila['fecha_hora'] else None,
+    } for fila in filas], anterior
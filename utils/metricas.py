@@ -0,0 +1,393 @@
+"""
+Instrumentación de la app Flask.
+
+- Tiempo por petición: total, base de datos, renderizado de plantillas y número de consultas
+  (cabecera Server-Timing en cada respuesta)
+- Registro de consultas lentas con la forma del SQL y su duración
+- Endpoint /metrics en formato de texto de Prometheus con histogramas por ruta. Cada
+  worker de gunicorn vuelca sus contadores en METRICS_DIR y el que atiende el scrape
+  suma los de todos; el pool y la auditoría se reportan por worker (etiqueta pid)
+- Perfilador opcional (cProfile) por petición, por muestreo o con la cabecera X-Perfilar
+"""
+import cProfile
+import hmac
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import g, has_request_context, request, Response, before_render_template, template_rendered
+
+from config import (SLOW_QUERY_MS, METRICS_TOKEN, METRICS_DIR, METRICS_INTERVALO, PROFILER_ENABLED,
+                    PROFILER_SAMPLE_RATE, PROFILER_DIR)
+from utils.archivos import bloqueo_archivo, escribir_json, leer_json, proceso_vivo
+from utils.db_connection import registrar_observador_consultas, estadisticas_pool
+from utils.auditoria import escritor_auditoria
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_PETICION = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+# Cabeceras que agrega un proxy: sin METRICS_TOKEN esas peticiones no se aceptan aunque lleguen desde localhost
+CABECERAS_PROXY = ('X-Forwarded-For', 'X-Real-Ip', 'Forwarded')
+ARCHIVO_TERMINADOS = '_terminados.json'
+
+
+class Histograma:
+    """Histograma acumulado por etiquetas, compatible con el formato de Prometheus"""
+
+    def __init__(self, nombre, ayuda, etiquetas, buckets):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        self._series = {}
+        self._candado = threading.Lock()
+
+    def observar(self, valor, *etiquetas):
+        with self._candado:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def estado(self):
+        """Series de este proceso como [etiquetas, [conteos, suma, total]] (se guardan en JSON)"""
+        with self._candado:
+            return [[list(etiquetas), [list(conteos), suma, total]]
+                    for etiquetas, (conteos, suma, total) in self._series.items()]
+
+    def exponer(self, series=None):
+        """Líneas de exposición; series son las ya sumadas entre workers (por defecto, las de este proceso)"""
+        if series is None:
+            series = _combinar([self.estado()])
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for etiquetas, (conteos, suma, total) in sorted(series.items()):
+            base = ",".join(f'{k}="{_escapar(v)}"' for k, v in zip(self.etiquetas, etiquetas))
+            separador = "," if base else ""
+            for limite, conteo in zip(self.buckets, conteos):
+                lineas.append(f'{self.nombre}_bucket{{{base}{separador}le="{limite}"}} {conteo}')
+            lineas.append(f'{self.nombre}_bucket{{{base}{separador}le="+Inf"}} {total}')
+            lineas.append(f"{self.nombre}_sum{{{base}}} {suma:.6f}")
+            lineas.append(f"{self.nombre}_count{{{base}}} {total}")
+        return lineas
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores = {}
+        self._candado = threading.Lock()
+
+    def incrementar(self, *etiquetas, cantidad=1):
+        with self._candado:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + cantidad
+
+    def estado(self):
+        with self._candado:
+            return [[list(etiquetas), valor] for etiquetas, valor in self._valores.items()]
+
+    def exponer(self, series=None):
+        if series is None:
+            series = _combinar([self.estado()])
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for etiquetas, valor in sorted(series.items()):
+            base = ",".join(f'{k}="{_escapar(v)}"' for k, v in zip(self.etiquetas, etiquetas))
+            lineas.append(f"{self.nombre}{{{base}}} {valor}")
+        return lineas
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _combinar(estados):
+    """Suma los estados de varios procesos de una métrica: etiquetas -> valor (o [conteos, suma, total])"""
+    series = {}
+    for estado in estados:
+        for etiquetas, valor in estado:
+            clave = tuple(etiquetas)
+            previo = series.get(clave)
+            if previo is None:
+                series[clave] = valor
+            elif isinstance(valor, list):
+                series[clave] = [[a + b for a, b in zip(previo[0], valor[0])], previo[1] + valor[1],
+                                 previo[2] + valor[2]]
+            else:
+                series[clave] = previo + valor
+    return series
+
+
+_RE_ESPACIOS = re.compile(r"\s+")
+_RE_VALORES = re.compile(r"(VALUES\s*\([^()]*\))(\s*,\s*\([^()]*\))+", re.IGNORECASE)
+_RE_LITERALES = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b")
+
+
+def forma_sql(sql):
+    """SQL normalizado: espacios colapsados, literales como ? y VALUES multi-fila resumidos"""
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _RE_ESPACIOS.sub(" ", sql).strip()
+    sql = _RE_VALORES.sub(r"\1, ...", sql)
+    return _RE_LITERALES.sub("?", sql)[:500]
+
+
+peticiones_duracion = Histograma(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP por ruta",
+    ("ruta", "metodo"), BUCKETS_PETICION)
+peticiones_db = Histograma(
+    "http_request_db_seconds", "Tiempo en base de datos por petición",
+    ("ruta",), BUCKETS_PETICION)
+peticiones_plantilla = Histograma(
+    "http_request_template_seconds", "Tiempo de renderizado de plantillas por petición",
+    ("ruta",), BUCKETS_PETICION)
+peticiones_total = Contador("http_requests_total", "Peticiones HTTP por ruta y estado", ("ruta", "metodo", "estado"))
+consultas_por_peticion = Contador("http_request_db_queries_total", "Consultas SQL hechas por ruta", ("ruta",))
+consultas_duracion = Histograma(
+    "db_query_duration_seconds", "Duración de las consultas SQL por tipo de sentencia",
+    ("sentencia",), BUCKETS_CONSULTA)
+
+consultas_lentas = deque(maxlen=200)
+
+METRICAS_PETICIONES = (peticiones_duracion, peticiones_db, peticiones_plantilla, peticiones_total,
+                       consultas_por_peticion, consultas_duracion)
+
+
+class MetricasCompartidas:
+    """
+    Suma las métricas de todos los workers de gunicorn en /metrics.
+
+    Cada proceso escribe sus contadores e histogramas en {pid}.json dentro de `directorio`
+    cada `intervalo` segundos (y justo antes de responder /metrics), junto con el estado de
+    su pool y su escritor de auditoría. El worker que atiende el scrape suma los archivos;
+    los de workers que ya terminaron se acumulan en _terminados.json, así los contadores
+    no bajan cuando gunicorn recicla un worker.
+    """
+
+    def __init__(self, metricas, directorio, intervalo=5.0):
+        self._metricas = {metrica.nombre: metrica for metrica in metricas}
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self._pid = None
+        self._hilo = None
+        self._candado = threading.Lock()
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio, nombre)
+
+    def asegurar_hilo(self):
+        # Tras un fork (gunicorn --preload) el hilo del padre no existe en el hijo
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        with self._candado:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            os.makedirs(self.directorio, exist_ok=True)
+            # Un archivo con el pid de este proceso es de un worker anterior que reutilizó el número
+            if os.path.exists(self._ruta(f"{os.getpid()}.json")):
+                with bloqueo_archivo(self._ruta('.lock')):
+                    self._acumular_terminados([self._ruta(f"{os.getpid()}.json")])
+            self._hilo = threading.Thread(target=self._bucle, name="volcado-metricas", daemon=True)
+            self._pid = os.getpid()
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.volcar()
+            except Exception as e:
+                logger.error("Error volcando las métricas del worker: %s", e)
+
+    def volcar(self):
+        """Escribe el estado de este proceso"""
+        escribir_json(self._ruta(f"{os.getpid()}.json"), {
+            'pid': os.getpid(),
+            'metricas': {nombre: metrica.estado() for nombre, metrica in self._metricas.items()},
+            'proceso': _estado_proceso(),
+        })
+
+    def leer(self):
+        """(series sumadas por métrica, {pid: estado del proceso} de los workers vivos)"""
+        self.asegurar_hilo()
+        self.volcar()
+        with bloqueo_archivo(self._ruta('.lock')):
+            vivos, terminados = [], []
+            with os.scandir(self.directorio) as entradas:
+                for entrada in entradas:
+                    pid = entrada.name[:-len('.json')]
+                    if not entrada.name.endswith('.json') or not pid.isdigit():
+                        continue
+                    (vivos if proceso_vivo(int(pid)) else terminados).append(entrada.path)
+            acumulado = self._acumular_terminados(terminados)
+
+        estados = [acumulado] + [datos for datos in map(leer_json, vivos) if datos]
+        series = {nombre: _combinar(datos['metricas'].get(nombre, []) for datos in estados)
+                  for nombre in self._metricas}
+        procesos = {datos['pid']: datos['proceso'] for datos in estados[1:]}
+        return series, procesos
+
+    def _acumular_terminados(self, rutas):
+        # Se llama con el candado de archivo tomado
+        acumulado = leer_json(self._ruta(ARCHIVO_TERMINADOS)) or {'metricas': {}}
+        if not rutas:
+            return acumulado
+        estados = [acumulado] + [datos for datos in map(leer_json, rutas) if datos]
+        acumulado = {'metricas': {
+            nombre: [[list(etiquetas), valor] for etiquetas, valor in
+                     _combinar(datos['metricas'].get(nombre, []) for datos in estados).items()]
+            for nombre in self._metricas
+        }}
+        escribir_json(self._ruta(ARCHIVO_TERMINADOS), acumulado)
+        for ruta in rutas:
+            os.remove(ruta)
+        return acumulado
+
+
+metricas_compartidas = MetricasCompartidas(METRICAS_PETICIONES, METRICS_DIR, METRICS_INTERVALO)
+
+
+def _estado_proceso():
+    return {'pool': estadisticas_pool(), 'auditoria': escritor_auditoria.estadisticas()}
+
+
+def _observar_consulta(sql, duracion, filas):
+    forma = forma_sql(sql)
+    consultas_duracion.observar(duracion, forma.split(" ", 1)[0].upper() or "?")
+    if has_request_context() and hasattr(g, "_metricas"):
+        g._metricas["db"] += duracion
+        g._metricas["consultas"] += 1
+    if duracion * 1000 >= SLOW_QUERY_MS:
+        registro = {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "duracion_ms": round(duracion * 1000, 2),
+            "filas": filas,
+            "sql": forma,
+            "ruta": _ruta() if has_request_context() else None,
+        }
+        consultas_lentas.append(registro)
+        logger.warning("Consulta lenta (%s ms) en %s: %s", registro['duracion_ms'], registro['ruta'], forma,
+                       extra={'duracion_ms': registro['duracion_ms'], 'filas': filas})
+
+
+def _ruta():
+    regla = request.url_rule
+    return regla.rule if regla is not None else "desconocida"
+
+
+def _antes_de_renderizar(app, template, context, **extra):
+    if has_request_context() and hasattr(g, "_metricas"):
+        g._metricas["inicio_plantilla"] = time.perf_counter()
+
+
+def _despues_de_renderizar(app, template, context, **extra):
+    if has_request_context() and hasattr(g, "_metricas"):
+        inicio = g._metricas.pop("inicio_plantilla", None)
+        if inicio is not None:
+            g._metricas["plantilla"] += time.perf_counter() - inicio
+
+
+def _debe_perfilar():
+    if not PROFILER_ENABLED:
+        return False
+    if request.headers.get("X-Perfilar") == "1":
+        return True
+    return PROFILER_SAMPLE_RATE > 0 and random.random() < PROFILER_SAMPLE_RATE
+
+
+def instrumentar_app(app):
+    """Registra los hooks de medición y el endpoint /metrics en la app"""
+    registrar_observador_consultas(_observar_consulta)
+    before_render_template.connect(_antes_de_renderizar, app)
+    template_rendered.connect(_despues_de_renderizar, app)
+
+    @app.before_request
+    def _iniciar_medicion():
+        g._metricas = {"inicio": time.perf_counter(), "db": 0.0, "plantilla": 0.0, "consultas": 0}
+        if _debe_perfilar():
+            g._perfilador = cProfile.Profile()
+            g._perfilador.enable()
+
+    @app.after_request
+    def _terminar_medicion(respuesta):
+        if METRICS_DIR:
+            metricas_compartidas.asegurar_hilo()
+        metricas = g.pop("_metricas", None)
+        if metricas is None:
+            return respuesta
+        total = time.perf_counter() - metricas["inicio"]
+        ruta = _ruta()
+
+        perfilador = g.pop("_perfilador", None)
+        if perfilador is not None:
+            perfilador.disable()
+            os.makedirs(PROFILER_DIR, exist_ok=True)
+            nombre = f"{datetime.now():%Y%m%d_%H%M%S}_{request.endpoint or 'desconocida'}_{int(total * 1000)}ms.prof"
+            perfilador.dump_stats(os.path.join(PROFILER_DIR, nombre))
+            respuesta.headers["X-Perfil"] = nombre
+
+        if ruta != "/metrics":
+            peticiones_duracion.observar(total, ruta, request.method)
+            peticiones_db.observar(metricas["db"], ruta)
+            peticiones_plantilla.observar(metricas["plantilla"], ruta)
+            peticiones_total.incrementar(ruta, request.method, str(respuesta.status_code))
+            consultas_por_peticion.incrementar(ruta, cantidad=metricas["consultas"])
+
+        respuesta.headers["Server-Timing"] = (
+            f'total;dur={total * 1000:.1f}, db;dur={metricas["db"] * 1000:.1f};desc="{metricas["consultas"]} consultas", '
+            f'tpl;dur={metricas["plantilla"] * 1000:.1f}'
+        )
+        return respuesta
+
+    @app.route("/metrics")
+    def metricas_prometheus():
+        if METRICS_TOKEN:
+            if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+                return Response("No autorizado\n", status=401, mimetype="text/plain")
+        # Sin token: solo un scraper en la misma máquina que habla directo con gunicorn; detrás
+        # de un proxy local todas las peticiones llegarían desde 127.0.0.1
+        elif request.remote_addr not in ("127.0.0.1", "::1") or any(h in request.headers for h in CABECERAS_PROXY):
+            return Response("No autorizado\n", status=401, mimetype="text/plain")
+        return Response(exponer_metricas(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+    return app
+
+
+def exponer_metricas():
+    """Texto de /metrics (formato de exposición de Prometheus), sumado entre los workers si hay METRICS_DIR"""
+    series, procesos = None, {os.getpid(): _estado_proceso()}
+    if METRICS_DIR:
+        try:
+            series, procesos = metricas_compartidas.leer()
+        except OSError as e:
+            logger.warning("No se pudieron sumar las métricas de los workers, solo se reporta este: %s", e)
+
+    lineas = []
+    for metrica in METRICAS_PETICIONES:
+        lineas.extend(metrica.exponer(series[metrica.nombre] if series is not None else None))
+
+    # El pool y la cola de auditoría son de cada worker: una serie por pid
+    for clave, tipo in (("abiertas", "gauge"), ("en_uso", "gauge"), ("inactivas", "gauge"),
+                        ("esperas", "counter"), ("timeouts", "counter")):
+        lineas.append(f"# TYPE db_pool_{clave} {tipo}")
+        lineas.extend(f'db_pool_{clave}{{pid="{pid}"}} {proceso["pool"][clave]}' for pid, proceso in sorted(procesos.items()))
+    lineas.append("# TYPE db_pool_espera_segundos_total counter")
+    lineas.extend(f'db_pool_espera_segundos_total{{pid="{pid}"}} {proceso["pool"]["tiempo_espera_total_ms"] / 1000:.6f}'
+                  for pid, proceso in sorted(procesos.items()))
+
+    for clave, tipo in (("pendientes", "gauge"), ("encolados", "counter"), ("escritos", "counter"),
+                        ("descartados", "counter"), ("derramados_disco", "counter")):
+        lineas.append(f"# TYPE auditoria_{clave} {tipo}")
+        lineas.extend(f'auditoria_{clave}{{pid="{pid}"}} {proceso["auditoria"][clave]}'
+                      for pid, proceso in sorted(procesos.items()))
+    return "\n".join(lineas) + "\n"
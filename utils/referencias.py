@@ -0,0 +1,146 @@
+"""
+Caché por proceso de tablas de referencia (tipos_documento y similares).
+
+Las tablas se cargan completas al arrancar y se recargan cuando vence el TTL o al
+invalidarlas. Así el formulario de registro, el login y el listado de usuarios
+resuelven la descripción de un id en memoria en lugar de hacer un JOIN.
+Si la base no responde se siguen sirviendo las filas anteriores y no se reintenta
+hasta pasados ESPERA_TRAS_ERROR segundos: las peticiones no hacen fila detrás de
+una recarga que va a fallar.
+"""
+import logging
+import threading
+import time
+
+from config import REFERENCE_CACHE_TTL
+from utils.db_connection import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Un id desconocido fuerza una recarga, pero no más de una vez cada tantos segundos
+RECARGA_MINIMA = 5
+# Segundos sin reintentar la carga de una tabla después de un error
+ESPERA_TRAS_ERROR = 10
+
+
+class CacheReferencia:
+    """Tablas pequeñas que casi nunca cambian, indexadas por su llave primaria"""
+
+    def __init__(self, fabrica_conexion=get_db_connection, ttl=600):
+        self._fabrica = fabrica_conexion
+        self.ttl = ttl
+        self._tablas = {}  # nombre -> {'consulta', 'llave', 'filas', 'indice', 'cargado_en'}
+        self._candado = threading.Lock()
+        self._aciertos = 0
+        self._fallos = 0
+        self._recargas = 0
+        self._errores = 0
+
+    def registrar(self, nombre, consulta, llave='id'):
+        self._tablas[nombre] = {'consulta': consulta, 'llave': llave, 'filas': None,
+                                'indice': {}, 'cargado_en': 0.0, 'reintentar_en': 0.0}
+
+    def tablas(self):
+        return list(self._tablas)
+
+    def _cargar(self, nombre):
+        # Se llama con el candado tomado
+        tabla = self._tablas[nombre]
+        conn = self._fabrica()
+        if not conn:
+            self._errores += 1
+            tabla['reintentar_en'] = time.monotonic() + ESPERA_TRAS_ERROR
+            return False
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(tabla['consulta'])
+            filas = cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            logger.error("Error cargando la tabla de referencia %s: %s", nombre, e)
+            self._errores += 1
+            tabla['reintentar_en'] = time.monotonic() + ESPERA_TRAS_ERROR
+            return False
+        finally:
+            conn.close()
+        tabla['filas'] = filas
+        tabla['indice'] = {fila[tabla['llave']]: fila for fila in filas}
+        tabla['cargado_en'] = time.monotonic()
+        tabla['reintentar_en'] = 0.0
+        self._recargas += 1
+        return True
+
+    def _tabla(self, nombre, forzar=False):
+        tabla = self._tablas[nombre]
+        if not forzar and tabla['filas'] is not None and time.monotonic() - tabla['cargado_en'] < self.ttl:
+            self._aciertos += 1
+            return tabla
+        # La base falló hace poco: se sirven los datos anteriores sin intentarlo de nuevo
+        if time.monotonic() < tabla['reintentar_en']:
+            return tabla
+        # Con datos anteriores no se espera a que otro hilo termine de recargar
+        if not self._candado.acquire(blocking=tabla['filas'] is None):
+            return tabla
+        try:
+            # Otro hilo pudo recargarla (o fallar) mientras se esperaba el candado
+            vigente = tabla['filas'] is not None and time.monotonic() - tabla['cargado_en'] < self.ttl
+            if (vigente and not forzar) or time.monotonic() < tabla['reintentar_en']:
+                self._aciertos += 1
+                return tabla
+            self._fallos += 1
+            # Si la base no responde se siguen sirviendo los datos anteriores
+            self._cargar(nombre)
+        finally:
+            self._candado.release()
+        return tabla
+
+    def filas(self, nombre):
+        """Todas las filas de la tabla (no modificar la lista retornada)"""
+        return self._tabla(nombre)['filas'] or []
+
+    def obtener(self, nombre, llave):
+        """Fila por llave primaria o None"""
+        tabla = self._tabla(nombre)
+        fila = tabla['indice'].get(llave)
+        if fila is None and llave is not None and time.monotonic() - tabla['cargado_en'] >= RECARGA_MINIMA:
+            fila = self._tabla(nombre, forzar=True)['indice'].get(llave)
+        return fila
+
+    def precargar(self):
+        with self._candado:
+            for nombre in self._tablas:
+                self._cargar(nombre)
+
+    def invalidar(self, nombre=None):
+        """Marca una tabla (o todas) como vencida; se recarga en el siguiente acceso"""
+        with self._candado:
+            for clave in ([nombre] if nombre else self._tablas):
+                self._tablas[clave]['cargado_en'] = 0.0
+                self._tablas[clave]['reintentar_en'] = 0.0
+
+    def estadisticas(self):
+        ahora = time.monotonic()
+        return {
+            'ttl': self.ttl,
+            'aciertos': self._aciertos,
+            'fallos': self._fallos,
+            'recargas': self._recargas,
+            'errores': self._errores,
+            'tablas': {
+                nombre: {
+                    'filas': len(tabla['filas']) if tabla['filas'] is not None else None,
+                    'edad_segundos': round(ahora - tabla['cargado_en'], 1) if tabla['filas'] is not None else None,
+                }
+                for nombre, tabla in self._tablas.items()
+            },
+        }
+
+
+referencias = CacheReferencia(ttl=REFERENCE_CACHE_TTL)
+referencias.registrar('tipos_documento', "SELECT id, codigo, descripcion FROM tipos_documento ORDER BY id")
+
+
+def descripcion_tipo_documento(tipo_documento_id):
+    """Descripción del tipo de documento o None si el id no existe"""
+    tipo = referencias.obtener('tipos_documento', tipo_documento_id)
+    return tipo['descripcion'] if tipo else None
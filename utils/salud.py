@@ -0,0 +1,172 @@
+"""
+Verificaciones de salud para el balanceador de carga (/healthz y /readyz).
+
+Un hilo de fondo por worker verifica cada SALUD_INTERVALO segundos las dependencias
+(ping de MySQL con una conexión del pool, cola del escritor de auditoría y la última
+muestra del monitor XMPP) y guarda el resultado con la latencia de cada una. Las
+rutas solo leen esa copia: sondear más seguido no agrega carga a la base de datos.
+gunicorn arranca el hilo al crear cada worker (post_fork); si un /readyz llega antes
+de la primera vuelta, esa petición hace la verificación en vez de responder "iniciando".
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from config import SALUD_INTERVALO, SALUD_TIMEOUT, SALUD_AUDITORIA_UMBRAL, SALUD_XMPP_CRITICO
+from utils.auditoria import escritor_auditoria
+from utils.db_connection import ping_db, estadisticas_pool, PoolAgotadoError
+from utils.xmpp_estado import monitor_xmpp, ESTADO_OK, ESTADO_DEGRADADO, ESTADO_CAIDO
+
+logger = logging.getLogger(__name__)
+
+_inicio_proceso = time.time()
+
+
+def verificar_mysql(timeout=SALUD_TIMEOUT):
+    """Ping del protocolo con una conexión del pool de fondo (sin consultas)"""
+    pool = estadisticas_pool()
+    fondo = estadisticas_pool(fondo=True)
+    resultado = {'pool_en_uso': pool['en_uso'], 'pool_tamano': pool['tamano'],
+                 'pool_fondo_en_uso': fondo['en_uso'], 'pool_fondo_tamano': fondo['tamano']}
+    try:
+        resultado['latencia_ms'] = round(ping_db(timeout) * 1000, 2)
+        resultado['estado'] = ESTADO_OK
+    except PoolAgotadoError as e:
+        # La base responde pero los hilos de fondo del worker no tienen conexiones libres
+        resultado.update(estado=ESTADO_DEGRADADO, error=str(e))
+    return resultado
+
+
+def verificar_auditoria(umbral=SALUD_AUDITORIA_UMBRAL):
+    """Profundidad de la cola del escritor de auditoría respecto a su capacidad"""
+    stats = escritor_auditoria.estadisticas()
+    ocupacion = stats['pendientes'] / stats['capacidad'] if stats['capacidad'] else 0.0
+    return {
+        'estado': ESTADO_DEGRADADO if ocupacion >= umbral else ESTADO_OK,
+        'pendientes': stats['pendientes'],
+        'capacidad': stats['capacidad'],
+        'ocupacion': round(ocupacion, 3),
+        'derramados_disco': stats['derramados_disco'],
+    }
+
+
+def verificar_xmpp():
+    """Última muestra del monitor XMPP (la sonda corre en su propio hilo)"""
+    muestra = monitor_xmpp.estado()
+    estado = muestra['estado'] if muestra['estado'] in (ESTADO_OK, ESTADO_DEGRADADO, ESTADO_CAIDO) else ESTADO_DEGRADADO
+    return {
+        'estado': estado,
+        'latencia_ms': round(sum(muestra['latencia_ms'].values()), 2) if muestra['latencia_ms'] else None,
+        'etapas_ms': muestra['latencia_ms'],
+        'muestra': muestra['fecha'],
+        'error': muestra['error'],
+    }
+
+
+class MonitorSalud:
+    """Ejecuta las verificaciones en segundo plano y guarda el último resultado de cada una"""
+
+    def __init__(self, intervalo=5.0):
+        self.intervalo = intervalo
+        self._verificaciones = {}   # nombre -> (función, crítica)
+        self._resultados = {}
+        self._actualizado_en = None
+        self._candado = threading.Lock()
+        self._candado_primera = threading.Lock()
+        self._pid = None
+        self._hilo = None
+
+    def registrar(self, nombre, funcion, critica=True):
+        """Una dependencia crítica caída deja a /readyz en 503; las demás solo se reportan"""
+        self._verificaciones[nombre] = (funcion, critica)
+
+    def _verificar(self, funcion, critica):
+        inicio = time.perf_counter()
+        try:
+            resultado = funcion()
+        except Exception as e:
+            resultado = {'estado': ESTADO_CAIDO, 'error': str(e) or e.__class__.__name__}
+        # Si la verificación no mide su propia latencia se usa la duración de la llamada
+        if 'latencia_ms' not in resultado and resultado['estado'] != ESTADO_CAIDO:
+            resultado['latencia_ms'] = round((time.perf_counter() - inicio) * 1000, 2)
+        resultado['critica'] = critica
+        resultado['verificado'] = datetime.now().isoformat(timespec='seconds')
+        return resultado
+
+    def verificar_todo(self):
+        """Ejecuta todas las verificaciones ahora (se llama desde el hilo del monitor)"""
+        resultados = {nombre: self._verificar(funcion, critica)
+                      for nombre, (funcion, critica) in self._verificaciones.items()}
+        with self._candado:
+            self._resultados = resultados
+            self._actualizado_en = time.monotonic()
+        return resultados
+
+    def iniciar(self):
+        """Arranca el hilo de verificaciones en este proceso (gunicorn lo llama en post_fork)"""
+        self._asegurar_hilo()
+
+    def vida(self):
+        """Solo el proceso: si responde, está vivo"""
+        return {'estado': ESTADO_OK, 'pid': os.getpid(),
+                'activo_s': round(time.time() - _inicio_proceso, 1)}
+
+    def disponibilidad(self):
+        """Último resultado en caché; listo si está al día y ninguna dependencia crítica está caída"""
+        self._asegurar_hilo()
+        if self._actualizado_en is None:
+            # Worker recién creado o reciclado: el balanceador no debe sacarlo por no haber verificado aún
+            with self._candado_primera:
+                if self._actualizado_en is None:
+                    self.verificar_todo()
+        with self._candado:
+            resultados = dict(self._resultados)
+            actualizado_en = self._actualizado_en
+        if actualizado_en is None:
+            return {'listo': False, 'estado': 'iniciando', 'motivo': 'Sin verificaciones todavía',
+                    'edad_s': None, 'dependencias': {}}
+
+        edad = time.monotonic() - actualizado_en
+        # Un hilo de verificación detenido no debe dejar un "listo" viejo para siempre
+        vencido = edad > 3 * self.intervalo + SALUD_TIMEOUT * len(resultados)
+        caidas = [nombre for nombre, r in resultados.items() if r['critica'] and r['estado'] == ESTADO_CAIDO]
+        degradadas = [nombre for nombre, r in resultados.items() if r['estado'] != ESTADO_OK]
+
+        respuesta = {'listo': not vencido and not caidas, 'edad_s': round(edad, 1), 'dependencias': resultados}
+        if vencido:
+            respuesta.update(estado=ESTADO_CAIDO, motivo='Verificaciones desactualizadas')
+        elif caidas:
+            respuesta.update(estado=ESTADO_CAIDO, motivo=f"Dependencias críticas caídas: {', '.join(caidas)}")
+        elif degradadas:
+            respuesta['estado'] = ESTADO_DEGRADADO
+        else:
+            respuesta['estado'] = ESTADO_OK
+        return respuesta
+
+    def _asegurar_hilo(self):
+        # Tras un fork (gunicorn --preload) el hilo del padre no existe en el hijo
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        with self._candado:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="monitor-salud", daemon=True)
+            self._pid = os.getpid()
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            inicio = time.monotonic()
+            try:
+                self.verificar_todo()
+            except Exception as e:
+                logger.error("Error en las verificaciones de salud: %s", e)
+            time.sleep(max(0.5, self.intervalo - (time.monotonic() - inicio)))
+
+
+monitor_salud = MonitorSalud(intervalo=SALUD_INTERVALO)
+monitor_salud.registrar('mysql', verificar_mysql)
+monitor_salud.registrar('auditoria', verificar_auditoria, critica=False)
+monitor_salud.registrar('xmpp', verificar_xmpp, critica=SALUD_XMPP_CRITICO)
@@ -0,0 +1,214 @@
+"""
+Series de tiempo para las gráficas del panel administrativo.
+
+La base de datos agrupa por intervalos (buckets) y el resultado se reduce con
+LTTB (Largest-Triangle-Three-Buckets) o min/max hasta un máximo de puntos, así el
+navegador nunca recibe más de `puntos` valores sin importar el rango pedido.
+"""
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from utils.db_connection import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+PUNTOS_MAXIMOS = 2000
+# Rango más largo que se consulta: más que eso recorre la tabla entera para terminar en los mismos puntos
+DIAS_MAXIMOS = 366
+METRICAS_TRAFICO = {
+    'usuarios_conectados': 'SUM',
+    'ancho_banda_consumido': 'SUM',
+    'latencia_promedio': 'AVG',
+}
+CACHE_TTL = 15
+
+
+def lttb(x, y, puntos):
+    """Reduce la serie a `puntos` valores conservando su forma visual (LTTB)"""
+    n = len(x)
+    if puntos >= n or puntos < 3:
+        return x, y
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    indices = np.empty(puntos, dtype='int64')
+    indices[0], indices[-1] = 0, n - 1
+    bordes = np.linspace(1, n - 1, puntos - 1).astype('int64')
+    a = 0
+    for i in range(puntos - 2):
+        inicio, fin = bordes[i], bordes[i + 1]
+        # Promedio del bucket siguiente como tercer vértice del triángulo
+        sig_inicio, sig_fin = bordes[i + 1], bordes[i + 2] if i + 2 < len(bordes) else n
+        x_prom = x[sig_inicio:sig_fin].mean() if sig_fin > sig_inicio else x[-1]
+        y_prom = y[sig_inicio:sig_fin].mean() if sig_fin > sig_inicio else y[-1]
+        areas = np.abs((x[a] - x_prom) * (y[inicio:fin] - y[a]) - (x[a] - x[inicio:fin]) * (y_prom - y[a]))
+        a = inicio + int(areas.argmax())
+        indices[i + 1] = a
+    return x[indices], y[indices]
+
+
+def min_max(x, y, puntos):
+    """Reduce la serie guardando el mínimo y el máximo de cada bucket (conserva los picos)"""
+    n = len(x)
+    if puntos >= n or puntos < 2:
+        return np.asarray(x), np.asarray(y)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    indices = []
+    for trozo in np.array_split(np.arange(n), puntos // 2):
+        if len(trozo):
+            par = sorted({trozo[y[trozo].argmin()], trozo[y[trozo].argmax()]})
+            indices.extend(par)
+    indices = np.asarray(indices)
+    return x[indices], y[indices]
+
+
+REDUCTORES = {'lttb': lttb, 'minmax': min_max}
+
+
+def tamano_bucket(desde, hasta, puntos, minimo=60):
+    """Segundos por bucket para que el rango quepa en ~4 buckets por punto final"""
+    segundos = max(1, int((hasta - desde).total_seconds()))
+    return max(minimo, math.ceil(segundos / (puntos * 4)))
+
+
+def serie_actividad(desde, hasta, puntos):
+    """Cantidad de registros de logs_transacciones por intervalo"""
+    bucket = tamano_bucket(desde, hasta, puntos)
+    consulta = """
+        SELECT FLOOR(UNIX_TIMESTAMP(fecha_hora) / %s) * %s as t, COUNT(*) as valor
+        FROM logs_transacciones
+        WHERE fecha_hora >= %s AND fecha_hora < %s
+        GROUP BY t
+        ORDER BY t
+    """
+    return _consultar(consulta, (bucket, bucket, desde, hasta)), bucket
+
+
+def serie_trafico(desde, hasta, puntos, metrica='ancho_banda_consumido', zona_id=None):
+    """Métrica de trafico_red por intervalo (suma o promedio entre zonas y dispositivos)"""
+    # Las muestras de trafico_red son horarias: el bucket mínimo es una hora
+    bucket = tamano_bucket(desde, hasta, puntos, minimo=3600)
+    funcion = METRICAS_TRAFICO[metrica]
+    filtro = ""
+    parametros = [bucket, bucket, desde.date(), hasta.date()]
+    if zona_id:
+        filtro = "AND zona_id = %s"
+        parametros.append(zona_id)
+    # El total por hora se calcula primero y luego se agrega por bucket
+    consulta = f"""
+        SELECT FLOOR(UNIX_TIMESTAMP(TIMESTAMP(fecha, hora)) / %s) * %s as t, {funcion}(valor) as valor
+        FROM (
+            SELECT fecha, hora, {funcion}({metrica}) as valor
+            FROM trafico_red
+            WHERE fecha BETWEEN %s AND %s {filtro}
+            GROUP BY fecha, hora
+        ) por_hora
+        GROUP BY t
+        ORDER BY t
+    """
+    return _consultar(consulta, parametros), bucket
+
+
+def _consultar(consulta, parametros):
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(consulta, parametros)
+        filas = cursor.fetchall()
+        cursor.close()
+        return filas
+    except Exception as e:
+        logger.error("Error obteniendo serie: %s", e)
+        return None
+    finally:
+        conn.close()
+
+
+def construir_serie(tipo, desde, hasta, puntos, metodo='lttb', metrica=None, zona_id=None):
+    """Serie lista para Chart.js: etiquetas ISO y valores, con a lo sumo `puntos` elementos"""
+    puntos = max(3, min(int(puntos), PUNTOS_MAXIMOS))
+    if tipo == 'actividad':
+        filas, bucket = serie_actividad(desde, hasta, puntos)
+    else:
+        filas, bucket = serie_trafico(desde, hasta, puntos, metrica, zona_id)
+    if filas is None:
+        return None
+
+    x = np.array([float(t) for t, _ in filas])
+    y = np.array([float(v or 0) for _, v in filas])
+    total = len(x)
+    x, y = REDUCTORES[metodo](x, y, puntos)
+    return {
+        'tipo': tipo,
+        'metrica': metrica,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'bucket_segundos': bucket,
+        'metodo': metodo,
+        'puntos_originales': total,
+        'etiquetas': [datetime.fromtimestamp(t).isoformat() for t in x],
+        'valores': [round(v, 2) for v in y],
+    }
+
+
+_cache = {}
+_cache_candado = threading.Lock()
+
+
+def serie_cacheada(tipo, desde, hasta, puntos, metodo='lttb', metrica=None, zona_id=None, rango=None):
+    """
+    construir_serie con caché corta y ETag derivado del contenido.
+    `rango` identifica el rango pedido (("dias", 7) para rangos relativos a ahora).
+    Retorna (serie, etag); mientras los datos no cambien el ETag es el mismo.
+    """
+    llave = (tipo, rango or (desde, hasta), puntos, metodo, metrica, zona_id)
+    ahora = time.monotonic()
+    with _cache_candado:
+        guardado = _cache.get(llave)
+        if guardado and ahora - guardado[0] < CACHE_TTL:
+            return guardado[1], guardado[2]
+
+    serie = construir_serie(tipo, desde, hasta, puntos, metodo, metrica, zona_id)
+    if serie is None:
+        return None, None
+    # El ETag no incluye 'hasta' para que un rango relativo ("últimos 7 días") no cambie en cada sondeo
+    contenido = {k: v for k, v in serie.items() if k not in ('desde', 'hasta')}
+    etag = hashlib.sha1(json.dumps(contenido, sort_keys=True).encode()).hexdigest()
+    with _cache_candado:
+        _cache[llave] = (ahora, serie, etag)
+        for clave in [k for k, (t, _, _) in _cache.items() if ahora - t >= CACHE_TTL]:
+            del _cache[clave]
+    return serie, etag
+
+
+def rango_desde_parametros(args, dias_por_defecto=7):
+    """
+    Lee desde/hasta (AAAA-MM-DD o AAAA-MM-DDTHH:MM) o dias de la query string.
+    Retorna (desde, hasta, rango) donde rango sirve de llave de caché, o lanza ValueError
+    (OverflowError con fechas en el límite del calendario). dias se acota a 1..DIAS_MAXIMOS.
+    """
+    if args.get('desde'):
+        desde = datetime.fromisoformat(args['desde'])
+        hasta = datetime.fromisoformat(args['hasta']) if args.get('hasta') else datetime.now()
+        if len(args.get('hasta', '')) == 10:
+            hasta += timedelta(days=1)  # fecha sin hora: incluye el día completo
+        rango = (args['desde'], args.get('hasta'))
+    else:
+        dias = min(max(int(args.get('dias', dias_por_defecto)), 1), DIAS_MAXIMOS)
+        hasta = datetime.now()
+        desde = hasta - timedelta(days=dias)
+        rango = ('dias', dias)
+    if desde >= hasta:
+        raise ValueError("La fecha inicial debe ser anterior a la final")
+    if hasta - desde > timedelta(days=DIAS_MAXIMOS):
+        raise ValueError(f"El rango no puede superar {DIAS_MAXIMOS} días")
+    return desde, hasta, rango
@@ -0,0 +1,475 @@
+"""
+Sesiones del lado del servidor.
+
+La cookie solo lleva un id opaco; los datos de la sesión (usuario_id, mensajes flash)
+viven en un almacén intercambiable (SESSION_BACKEND):
+
+- memoria: LRU con TTL dentro del proceso (un solo proceso: flask run o un worker)
+- archivos: un JSON por sesión en SESSION_DIR, compartido por los workers y el
+  servidor de chat de la misma máquina (sustituto local de un almacén compartido)
+- mysql: tablas sesiones y sesiones_invalidaciones (migración 006), compartido entre máquinas
+
+El contexto del usuario (nombre, correo, rol, tipo de documento) no se guarda en la
+sesión: se completa al abrirla desde una caché por proceso con TTL corto. Al editar
+un usuario se llama a invalidar_usuario(); la marca se publica en el almacén y los
+demás procesos la leen cada SESSION_SYNC_INTERVAL segundos, no en cada petición.
+"""
+import json
+import logging
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from config import (SESSION_BACKEND, SESSION_DIR, SESSION_TTL, SESSION_LOCAL_SIZE, SESSION_USER_TTL,
+                    SESSION_SYNC_INTERVAL)
+from utils.db_connection import get_db_connection
+from utils.referencias import descripcion_tipo_documento
+
+logger = logging.getLogger(__name__)
+
+# Claves que se completan desde el contexto del usuario y nunca se guardan
+CAMPOS_CONTEXTO = ('usuario', 'correo', 'rol', 'tipo_documento')
+_SID_VALIDO = re.compile(r'[A-Za-z0-9_-]{32,64}')
+_serializador = TaggedJSONSerializer()
+
+
+# ----- Almacenes -----
+
+class AlmacenMemoria:
+    """LRU con TTL en memoria del proceso"""
+
+    def __init__(self, tamano=10000):
+        self.tamano = tamano
+        self._datos = OrderedDict()  # sid -> (expira, registro)
+        self._candado = threading.Lock()
+
+    def leer(self, sid):
+        with self._candado:
+            guardado = self._datos.get(sid)
+            if guardado is None:
+                return None
+            if guardado[0] < time.time():
+                del self._datos[sid]
+                return None
+            self._datos.move_to_end(sid)
+            return guardado[1]
+
+    def guardar(self, sid, registro, ttl):
+        with self._candado:
+            self._datos[sid] = (time.time() + ttl, registro)
+            self._datos.move_to_end(sid)
+            while len(self._datos) > self.tamano:
+                self._datos.popitem(last=False)
+
+    def borrar(self, sid):
+        with self._candado:
+            self._datos.pop(sid, None)
+
+    def marcar_usuario(self, usuario_id):
+        # Un solo proceso: la caché local ya se invalidó
+        pass
+
+    def marcados_desde(self, marca):
+        return [], marca
+
+    def estadisticas(self):
+        return {'almacen': 'memoria', 'sesiones': len(self._datos), 'capacidad': self.tamano}
+
+
+class AlmacenArchivos:
+    """Un archivo por sesión; las invalidaciones son archivos vacíos por usuario (se compara su mtime)"""
+
+    def __init__(self, directorio='sesiones', limpiar_cada=500):
+        self.directorio = directorio
+        self.directorio_usuarios = os.path.join(directorio, '_usuarios')
+        self.limpiar_cada = limpiar_cada
+        self._escrituras = 0
+        os.makedirs(self.directorio_usuarios, exist_ok=True)
+
+    def _ruta(self, sid):
+        return os.path.join(self.directorio, f"{sid}.json")
+
+    def leer(self, sid):
+        try:
+            with open(self._ruta(sid), encoding='utf-8') as f:
+                expira, registro = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if expira < time.time():
+            self.borrar(sid)
+            return None
+        return registro
+
+    def guardar(self, sid, registro, ttl):
+        # Temporal único por escritura: dos hilos del mismo worker pueden guardar la misma sesión a la vez
+        descriptor, temporal = tempfile.mkstemp(prefix=f".{sid}.", suffix='.tmp', dir=self.directorio)
+        try:
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+                json.dump([time.time() + ttl, registro], f)
+            os.replace(temporal, self._ruta(sid))
+        except BaseException:
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+            raise
+        self._escrituras += 1
+        if self._escrituras % self.limpiar_cada == 0:
+            self.limpiar()
+
+    def borrar(self, sid):
+        try:
+            os.remove(self._ruta(sid))
+        except OSError:
+            pass
+
+    def limpiar(self):
+        """Borra las sesiones vencidas"""
+        ahora = time.time()
+        with os.scandir(self.directorio) as entradas:
+            for entrada in entradas:
+                if not entrada.name.endswith('.json'):
+                    continue
+                try:
+                    with open(entrada.path, encoding='utf-8') as f:
+                        expira = json.load(f)[0]
+                    if expira < ahora:
+                        os.remove(entrada.path)
+                except (OSError, ValueError, IndexError):
+                    pass
+
+    def marcar_usuario(self, usuario_id):
+        ruta = os.path.join(self.directorio_usuarios, str(int(usuario_id)))
+        with open(ruta, 'w'):
+            pass
+        os.utime(ruta)
+
+    def marcados_desde(self, marca):
+        marcados = []
+        nueva = marca or 0.0
+        with os.scandir(self.directorio_usuarios) as entradas:
+            for entrada in entradas:
+                modificado = entrada.stat().st_mtime
+                nueva = max(nueva, modificado)
+                if marca is not None and modificado > marca and entrada.name.isdigit():
+                    marcados.append(int(entrada.name))
+        return marcados, nueva
+
+    def estadisticas(self):
+        return {'almacen': 'archivos', 'directorio': self.directorio,
+                'sesiones': sum(1 for nombre in os.listdir(self.directorio) if nombre.endswith('.json'))}
+
+
+class AlmacenMySQL:
+    """Tablas sesiones y sesiones_invalidaciones (migraciones/006_sesiones.sql)"""
+
+    def __init__(self, fabrica_conexion=get_db_connection, limpiar_cada=500):
+        self._fabrica = fabrica_conexion
+        self.limpiar_cada = limpiar_cada
+        self._escrituras = 0
+
+    def _ejecutar(self, consulta, parametros=(), leer=False):
+        conn = self._fabrica()
+        if not conn:
+            raise ConnectionError("Error de conexión a la base de datos.")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(consulta, parametros)
+            filas = cursor.fetchall() if leer else None
+            if not leer:
+                conn.commit()
+            cursor.close()
+            return filas
+        finally:
+            conn.close()
+
+    def leer(self, sid):
+        filas = self._ejecutar("SELECT datos FROM sesiones WHERE id = %s AND expira > NOW()", (sid,), leer=True)
+        return json.loads(filas[0][0]) if filas else None
+
+    def guardar(self, sid, registro, ttl):
+        self._ejecutar("""
+            INSERT INTO sesiones (id, usuario_id, datos, expira)
+            VALUES (%s, %s, %s, NOW() + INTERVAL %s SECOND)
+            ON DUPLICATE KEY UPDATE usuario_id = VALUES(usuario_id), datos = VALUES(datos),
+                                    expira = VALUES(expira)
+        """, (sid, registro['usuario_id'], json.dumps(registro), int(ttl)))
+        self._escrituras += 1
+        if self._escrituras % self.limpiar_cada == 0:
+            self._ejecutar("DELETE FROM sesiones WHERE expira < NOW() LIMIT 1000")
+
+    def borrar(self, sid):
+        self._ejecutar("DELETE FROM sesiones WHERE id = %s", (sid,))
+
+    def marcar_usuario(self, usuario_id):
+        self._ejecutar("""
+            INSERT INTO sesiones_invalidaciones (usuario_id, fecha) VALUES (%s, NOW(6))
+            ON DUPLICATE KEY UPDATE fecha = NOW(6)
+        """, (usuario_id,))
+
+    def marcados_desde(self, marca):
+        # Se usa el reloj de MySQL para no depender de la hora de cada servidor de la app
+        if marca is None:
+            filas = self._ejecutar("SELECT NOW(6)", leer=True)
+            return [], filas[0][0]
+        filas = self._ejecutar(
+            "SELECT usuario_id, fecha FROM sesiones_invalidaciones WHERE fecha > %s", (marca,), leer=True)
+        return [fila[0] for fila in filas], max([marca] + [fila[1] for fila in filas])
+
+    def estadisticas(self):
+        filas = self._ejecutar("SELECT COUNT(*) FROM sesiones WHERE expira > NOW()", leer=True)
+        return {'almacen': 'mysql', 'sesiones': filas[0][0]}
+
+
+
+# ----- Contexto del usuario -----
+
+class ContextoUsuarios:
+    """Caché LRU con TTL de nombre, correo, rol y tipo de documento por usuario_id"""
+
+    def __init__(self, almacen, fabrica_conexion=get_db_connection, tamano=5000, ttl=30,
+                 intervalo_sincronizacion=2.0):
+        self.almacen = almacen
+        self._fabrica = fabrica_conexion
+        self.tamano = tamano
+        self.ttl = ttl
+        self.intervalo_sincronizacion = intervalo_sincronizacion
+        self._datos = OrderedDict()  # usuario_id -> (guardado_en, contexto)
+        self._candado = threading.Lock()
+        self._marca = None
+        self._sincronizado_en = 0.0
+
+        # Contadores
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def _sincronizar(self):
+        """Descarta los usuarios invalidados por otros procesos (como mucho una vez por intervalo)"""
+        ahora = time.monotonic()
+        if ahora - self._sincronizado_en < self.intervalo_sincronizacion:
+            return
+        self._sincronizado_en = ahora
+        try:
+            marcados, self._marca = self.almacen.marcados_desde(self._marca)
+        except Exception as e:
+            logger.error("Error leyendo invalidaciones de sesión: %s", e)
+            return
+        if marcados:
+            with self._candado:
+                for usuario_id in marcados:
+                    self._datos.pop(usuario_id, None)
+
+    def _buscar(self, usuario_id):
+        conn = self._fabrica()
+        if not conn:
+            raise ConnectionError("Error de conexión a la base de datos.")
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT id, nombre, correo, rol, tipo_documento_id FROM usuarios WHERE id = %s",
+                           (usuario_id,))
+            fila = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        return fila
+
+    def guardar(self, usuario):
+        """Guarda el contexto de una fila de usuario (id, nombre, correo, rol, tipo_documento_id)"""
+        contexto = {
+            'usuario': usuario['nombre'],
+            'correo': usuario['correo'],
+            'rol': usuario['rol'],
+            'tipo_documento': usuario.get('tipo_documento') or descripcion_tipo_documento(usuario['tipo_documento_id']),
+        }
+        with self._candado:
+            self._datos[usuario['id']] = (time.monotonic(), contexto)
+            self._datos.move_to_end(usuario['id'])
+            while len(self._datos) > self.tamano:
+                self._datos.popitem(last=False)
+        return contexto
+
+    def obtener(self, usuario_id):
+        """Contexto del usuario o None si ya no existe"""
+        self._sincronizar()
+        with self._candado:
+            guardado = self._datos.get(usuario_id)
+            if guardado and time.monotonic() - guardado[0] < self.ttl:
+                self._datos.move_to_end(usuario_id)
+                self.aciertos += 1
+                return guardado[1]
+            self.fallos += 1
+        try:
+            fila = self._buscar(usuario_id)
+        except Exception as e:
+            logger.error("Error obteniendo el contexto del usuario %s: %s", usuario_id, e)
+            # Sin base de datos se sigue usando el contexto vencido si lo hay
+            return guardado[1] if guardado else None
+        if fila is None:
+            with self._candado:
+                self._datos.pop(usuario_id, None)
+            return None
+        return self.guardar(fila)
+
+    def invalidar(self, usuario_id):
+        """Descarta el contexto aquí y publica la invalidación para los demás procesos"""
+        with self._candado:
+            self._datos.pop(usuario_id, None)
+            self.invalidaciones += 1
+        try:
+            self.almacen.marcar_usuario(usuario_id)
+        except Exception as e:
+            logger.error("Error publicando la invalidación del usuario %s: %s", usuario_id, e)
+
+    def estadisticas(self):
+        return {
+            'ttl': self.ttl,
+            'usuarios': len(self._datos),
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'invalidaciones': self.invalidaciones,
+        }
+
+
+# ----- Interfaz de Flask -----
+
+class SesionServidor(CallbackDict, SessionMixin):
+    """Sesión de Flask guardada en el servidor bajo un id opaco"""
+
+    def __init__(self, datos=None, sid=None, guardada=0.0):
+        def al_modificar(sesion):
+            sesion.modified = True
+
+        super().__init__(datos, al_modificar)
+        self.sid = sid
+        self.guardada = guardada
+        self.usuario_inicial = (datos or {}).get('usuario_id')
+        self.modified = False
+
+
+class InterfazSesiones(SessionInterface):
+    """Reemplaza la sesión en cookie firmada de Flask (app.session_interface)"""
+
+    def __init__(self, almacen, contexto, ttl=28800):
+        self.almacen = almacen
+        self.contexto = contexto
+        self.ttl = ttl
+
+    def _borrar(self, sid):
+        try:
+            self.almacen.borrar(sid)
+        except Exception as e:
+            logger.error("Error borrando la sesión: %s", e)
+
+    def _leer(self, sid):
+        if not sid or not _SID_VALIDO.fullmatch(sid):
+            return None
+        try:
+            registro = self.almacen.leer(sid)
+        except Exception as e:
+            logger.error("Error leyendo la sesión: %s", e)
+            return None
+        if registro is None:
+            return None
+        return _serializador.loads(registro['datos']), registro['guardada']
+
+    def cargar(self, sid):
+        """Datos de la sesión con el contexto del usuario, o None (para el servidor de chat)"""
+        leido = self._leer(sid)
+        if leido is None or 'usuario_id' not in leido[0]:
+            return None
+        contexto = self.contexto.obtener(leido[0]['usuario_id'])
+        return dict(leido[0], **contexto) if contexto else None
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        leido = self._leer(sid)
+        if leido is None:
+            return SesionServidor()
+        sesion = SesionServidor(leido[0], sid=sid, guardada=leido[1])
+        if 'usuario_id' in sesion:
+            contexto = self.contexto.obtener(sesion['usuario_id'])
+            if contexto is None:
+                # El usuario ya no existe: la sesión se cierra al responder
+                sesion.clear()
+            else:
+                # dict.update no dispara el callback: el contexto no marca la sesión como modificada
+                dict.update(sesion, contexto)
+        return sesion
+
+    def save_session(self, app, session, response):
+        nombre = self.get_cookie_name(app)
+        dominio = self.get_cookie_domain(app)
+        ruta = self.get_cookie_path(app)
+        datos = {clave: valor for clave, valor in session.items() if clave not in CAMPOS_CONTEXTO}
+
+        if not datos:
+            if session.sid:
+                self._borrar(session.sid)
+                response.delete_cookie(nombre, domain=dominio, path=ruta)
+            return
+
+        sid = session.sid
+        if sid and datos.get('usuario_id') != session.usuario_inicial:
+            # Al iniciar o cambiar de usuario se emite un id nuevo (evita fijar la sesión)
+            self._borrar(sid)
+            sid = None
+        # Sin cambios solo se reescribe para extender el vencimiento (como mucho cada ttl/4)
+        if sid and not session.modified and time.time() - session.guardada < self.ttl / 4:
+            return
+
+        nuevo = sid is None
+        sid = sid or secrets.token_urlsafe(32)
+        ttl = app.permanent_session_lifetime.total_seconds() if session.permanent else self.ttl
+        registro = {'datos': _serializador.dumps(datos), 'usuario_id': datos.get('usuario_id'),
+                    'guardada': time.time()}
+        try:
+            self.almacen.guardar(sid, registro, ttl)
+        except Exception as e:
+            # La respuesta sale igual; sin cookie nueva el usuario conserva la sesión anterior (o ninguna)
+            logger.error("Error guardando la sesión: %s", e)
+            return
+        if nuevo or session.permanent:
+            response.set_cookie(
+                nombre, sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=dominio,
+                path=ruta,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def estadisticas(self):
+        try:
+            almacen = self.almacen.estadisticas()
+        except Exception as e:
+            almacen = {'error': str(e)}
+        return {'almacen': almacen, 'ttl': self.ttl, 'contexto_usuarios': self.contexto.estadisticas()}
+
+
+def _crear_almacen():
+    if SESSION_BACKEND == 'memoria':
+        return AlmacenMemoria(SESSION_LOCAL_SIZE)
+    if SESSION_BACKEND == 'mysql':
+        return AlmacenMySQL()
+    return AlmacenArchivos(SESSION_DIR)
+
+
+almacen_sesiones = _crear_almacen()
+contexto_usuarios = ContextoUsuarios(almacen_sesiones, ttl=SESSION_USER_TTL,
+                                     intervalo_sincronizacion=SESSION_SYNC_INTERVAL)
+interfaz_sesiones = InterfazSesiones(almacen_sesiones, contexto_usuarios, ttl=SESSION_TTL)
+
+
+def invalidar_usuario(usuario_id):
+    """Llamar tras editar o eliminar un usuario: las sesiones abiertas toman los datos nuevos"""
+    contexto_usuarios.invalidar(usuario_id)
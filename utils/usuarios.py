@@ -0,0 +1,127 @@
+import base64
+import logging
+from datetime import datetime
+
+from utils.db_connection import get_db_connection
+from utils.referencias import descripcion_tipo_documento
+
+logger = logging.getLogger(__name__)
+
+# Columnas que se muestran en la gestión de usuarios (nunca la contraseña).
+# La descripción del tipo de documento se completa desde la caché de referencia.
+COLUMNAS_LISTADO = """
+    u.id, u.nombre, u.correo, u.telefono, u.documento, u.rol,
+    u.fecha_creacion, u.tipo_documento_id
+"""
+
+LIMITE_MAXIMO = 200
+
+
+def codificar_cursor(fecha_creacion, usuario_id):
+    """
+    Convierte la posición (fecha_creacion, id) de la última fila en un cursor opaco.
+    Una fila antigua sin fecha_creacion deja solo el id (esas filas van al final del orden).
+    """
+    fecha = fecha_creacion.isoformat() if fecha_creacion else ""
+    texto = f"{fecha}|{usuario_id}"
+    return base64.urlsafe_b64encode(texto.encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    """Inverso de codificar_cursor (fecha None en un cursor solo de id); None si no es válido"""
+    try:
+        fecha, usuario_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return (datetime.fromisoformat(fecha) if fecha else None), int(usuario_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _escapar_like(texto):
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def listar_usuarios(cursor=None, limite=50, rol=None, tipo_documento_id=None, prefijo=None):
+    """
+    Página de usuarios ordenada por (fecha_creacion, id) descendente.
+
+    Usa paginación por llave (keyset): la siguiente página empieza después de la
+    última fila vista, por lo que el costo no crece con el número de página.
+    Retorna (usuarios, siguiente_cursor); siguiente_cursor es None en la última página.
+    """
+    limite = max(1, min(int(limite), LIMITE_MAXIMO))
+    condiciones = []
+    parametros = []
+
+    if rol:
+        condiciones.append("u.rol = %s")
+        parametros.append(rol)
+    if tipo_documento_id:
+        condiciones.append("u.tipo_documento_id = %s")
+        parametros.append(tipo_documento_id)
+    if prefijo:
+        patron = _escapar_like(prefijo.strip()) + "%"
+        condiciones.append("(u.nombre LIKE %s OR u.correo LIKE %s)")
+        parametros.extend([patron, patron])
+    if cursor:
+        posicion = decodificar_cursor(cursor)
+        # En MySQL los NULL van al final con DESC: después de una fecha siguen las menores
+        # y luego las filas sin fecha; después de una fila sin fecha, solo las sin fecha de id menor
+        if posicion and posicion[0] is None:
+            condiciones.append("(u.fecha_creacion IS NULL AND u.id < %s)")
+            parametros.append(posicion[1])
+        elif posicion:
+            condiciones.append("(u.fecha_creacion < %s OR (u.fecha_creacion = %s AND u.id < %s)"
+                               " OR u.fecha_creacion IS NULL)")
+            parametros.extend([posicion[0], posicion[0], posicion[1]])
+
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    consulta = f"""
+        SELECT {COLUMNAS_LISTADO}
+        FROM usuarios u
+        {where}
+        ORDER BY u.fecha_creacion DESC, u.id DESC
+        LIMIT %s
+    """
+    # Se pide una fila extra para saber si existe otra página
+    parametros.append(limite + 1)
+
+    conn = get_db_connection()
+    if not conn:
+        return [], None
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute(consulta, parametros)
+        usuarios = cur.fetchall()
+        cur.close()
+    except Exception as e:
+        logger.error("Error obteniendo usuarios: %s", e)
+        return [], None
+    finally:
+        conn.close()
+
+    for usuario in usuarios:
+        usuario['tipo_documento'] = descripcion_tipo_documento(usuario['tipo_documento_id'])
+
+    siguiente = None
+    if len(usuarios) > limite:
+        usuarios = usuarios[:limite]
+        ultimo = usuarios[-1]
+        siguiente = codificar_cursor(ultimo['fecha_creacion'], ultimo['id'])
+    return usuarios, siguiente
+
+
+def usuario_a_json(usuario):
+    """Serializa una fila del listado para la API JSON"""
+    fecha = usuario.get('fecha_creacion')
+    return {
+        'id': usuario['id'],
+        'nombre': usuario['nombre'],
+        'correo': usuario['correo'],
+        'telefono': usuario['telefono'],
+        'documento': usuario['documento'],
+        'rol': usuario['rol'],
+        'tipo_documento_id': usuario['tipo_documento_id'],
+        'tipo_documento': usuario['tipo_documento'],
+        'fecha_creacion': fecha.isoformat() if fecha else None,
+        'fecha_registro': fecha.strftime('%d/%m/%Y %H:%M') if fecha else 'N/A',
+    }
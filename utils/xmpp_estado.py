@@ -0,0 +1,268 @@
+"""
+Sonda del servidor XMPP para /admin/xmpp.
+
+Un hilo en segundo plano ejecuta la sonda (asyncio) cada cierto intervalo y guarda
+la última muestra y un historial acotado. La ruta solo lee esa copia en memoria,
+por lo que la página nunca espera a la red.
+"""
+import asyncio
+import base64
+import logging
+import os
+import re
+import ssl
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from config import (XMPP_HOST, XMPP_PORT, XMPP_DOMAIN, XMPP_USER, XMPP_PASSWORD,
+                    XMPP_TLS_VERIFY, XMPP_PROBE_INTERVAL, XMPP_PROBE_TIMEOUT, XMPP_HISTORY)
+from utils.db_connection import get_db_connection_fondo
+
+logger = logging.getLogger(__name__)
+
+ESTADO_OK = 'ok'
+ESTADO_DEGRADADO = 'degradado'
+ESTADO_CAIDO = 'caido'
+
+_NS_ADMIN_ONLINE = 'http://jabber.org/protocol/admin#get-online-users-num'
+
+
+class ErrorSonda(Exception):
+    """Falla de una etapa de la sonda XMPP"""
+
+
+async def _leer_hasta(reader, marcadores, timeout):
+    """Lee del stream hasta encontrar alguno de los marcadores (XML parcial)"""
+    datos = b''
+    limite = time.monotonic() + timeout
+    while not any(m in datos for m in marcadores):
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            raise ErrorSonda("Tiempo de espera agotado leyendo del servidor")
+        bloque = await asyncio.wait_for(reader.read(4096), timeout=restante)
+        if not bloque:
+            raise ErrorSonda("El servidor cerró la conexión")
+        datos += bloque
+    return datos.decode('utf-8', 'replace')
+
+
+async def _leer_iq(reader, iq_id, timeout):
+    """Lee hasta recibir completa la respuesta <iq> con ese id y la retorna"""
+    patron = re.compile(rf"<iq\b[^>]*\bid=['\"]{iq_id}['\"][^>]*?(?:/>|>.*?</iq>)", re.S)
+    datos = b''
+    limite = time.monotonic() + timeout
+    while True:
+        encontrada = patron.search(datos.decode('utf-8', 'replace'))
+        if encontrada:
+            return encontrada.group(0)
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            raise ErrorSonda("Tiempo de espera agotado leyendo del servidor")
+        bloque = await asyncio.wait_for(reader.read(4096), timeout=restante)
+        if not bloque:
+            raise ErrorSonda("El servidor cerró la conexión")
+        datos += bloque
+
+
+def _cabecera_stream(dominio):
+    return (f"<?xml version='1.0'?><stream:stream to='{dominio}' version='1.0' "
+            "xmlns='jabber:client' xmlns:stream='http://etherx.jabber.org/streams'>").encode()
+
+
+async def sondear_xmpp(host, puerto, dominio, usuario=None, contrasena=None,
+                       timeout=5.0, verificar_tls=True):
+    """
+    Conecta al servidor XMPP y mide cada etapa.
+
+    Retorna un dict con latencias en ms (conexion, stream, tls, autenticacion) y, con
+    credenciales, el software y versión del servidor (XEP-0092) y, si la cuenta es
+    administradora (XEP-0133), los usuarios conectados. Lanza ErrorSonda o OSError si falla.
+    Las credenciales solo se envían después de STARTTLS.
+    """
+    resultado = {'latencia_ms': {}, 'version': None, 'usuarios_conectados': None, 'autenticado': False}
+    inicio = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, puerto), timeout=timeout)
+    resultado['latencia_ms']['conexion'] = round((time.perf_counter() - inicio) * 1000, 2)
+    try:
+        t = time.perf_counter()
+        writer.write(_cabecera_stream(dominio))
+        await writer.drain()
+        respuesta = await _leer_hasta(reader, [b'</stream:features>'], timeout)
+        resultado['latencia_ms']['stream'] = round((time.perf_counter() - t) * 1000, 2)
+
+        if not usuario or not contrasena:
+            return resultado
+
+        # SASL PLAIN lleva la contraseña en base64: sin TLS la sonda falla en lugar de enviarla en claro
+        if 'urn:ietf:params:xml:ns:xmpp-tls' not in respuesta:
+            raise ErrorSonda("El servidor no ofrece STARTTLS; no se envían las credenciales sin cifrar")
+        t = time.perf_counter()
+        writer.write(b"<starttls xmlns='urn:ietf:params:xml:ns:xmpp-tls'/>")
+        await writer.drain()
+        if '<failure' in await _leer_hasta(reader, [b'<proceed', b'<failure'], timeout):
+            raise ErrorSonda("El servidor rechazó STARTTLS")
+        contexto = ssl.create_default_context()
+        if not verificar_tls:
+            contexto.check_hostname = False
+            contexto.verify_mode = ssl.CERT_NONE
+        await asyncio.wait_for(writer.start_tls(contexto, server_hostname=dominio), timeout=timeout)
+        writer.write(_cabecera_stream(dominio))
+        await writer.drain()
+        respuesta = await _leer_hasta(reader, [b'</stream:features>'], timeout)
+        resultado['latencia_ms']['tls'] = round((time.perf_counter() - t) * 1000, 2)
+
+        if 'PLAIN' not in respuesta:
+            raise ErrorSonda("El servidor no ofrece autenticación PLAIN")
+        t = time.perf_counter()
+        credencial = base64.b64encode(f"\0{usuario}\0{contrasena}".encode()).decode()
+        writer.write(f"<auth xmlns='urn:ietf:params:xml:ns:xmpp-sasl' mechanism='PLAIN'>{credencial}</auth>".encode())
+        await writer.drain()
+        respuesta = await _leer_hasta(reader, [b'<success', b'<failure'], timeout)
+        if '<failure' in respuesta:
+            raise ErrorSonda("Autenticación rechazada por el servidor")
+        resultado['latencia_ms']['autenticacion'] = round((time.perf_counter() - t) * 1000, 2)
+        resultado['autenticado'] = True
+
+        # Reinicio del stream, bind y conteo de usuarios en línea (XEP-0133)
+        writer.write(_cabecera_stream(dominio))
+        await writer.drain()
+        await _leer_hasta(reader, [b'</stream:features>'], timeout)
+        writer.write(b"<iq type='set' id='bind1'><bind xmlns='urn:ietf:params:xml:ns:xmpp-bind'>"
+                     b"<resource>sonda</resource></bind></iq>")
+        await writer.drain()
+        await _leer_iq(reader, 'bind1', timeout)
+
+        # Software y versión del servidor (XEP-0092); la versión del stream siempre es 1.0
+        writer.write(f"<iq type='get' id='version1' to='{dominio}'><query xmlns='jabber:iq:version'/></iq>".encode())
+        await writer.drain()
+        respuesta = await _leer_iq(reader, 'version1', timeout)
+        nombre = re.search(r"<name>([^<]*)</name>", respuesta)
+        version = re.search(r"<version>([^<]*)</version>", respuesta)
+        if nombre or version:
+            resultado['version'] = ' '.join(m.group(1).strip() for m in (nombre, version) if m)
+
+        writer.write((f"<iq type='set' id='online1' to='{dominio}'>"
+                      f"<command xmlns='http://jabber.org/protocol/commands' node='{_NS_ADMIN_ONLINE}' action='execute'/>"
+                      "</iq>").encode())
+        await writer.drain()
+        respuesta = await _leer_iq(reader, 'online1', timeout)
+        conectados = re.search(r"var=['\"]onlineusersnum['\"][^>]*>\s*<value>(\d+)</value>", respuesta)
+        if conectados:
+            resultado['usuarios_conectados'] = int(conectados.group(1))
+        return resultado
+    finally:
+        try:
+            writer.write(b"</stream:stream>")
+            writer.close()
+        except Exception:
+            pass
+
+
+def contar_mensajes_recientes(minutos=5):
+    """Mensajes de hoy y mensajes por minuto en la ventana reciente (tabla mensajes)"""
+    conn = get_db_connection_fondo()
+    if not conn:
+        return None, None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT
+                COUNT(*) as hoy,
+                SUM(fecha_hora >= NOW() - INTERVAL %s MINUTE) as recientes
+            FROM mensajes
+            WHERE fecha_hora >= CURDATE()
+        """, (minutos,))
+        fila = cursor.fetchone()
+        cursor.close()
+        return fila['hoy'], round(float(fila['recientes'] or 0) / minutos, 2)
+    except Exception as e:
+        logger.error("Error contando mensajes: %s", e)
+        return None, None
+    finally:
+        conn.close()
+
+
+class MonitorXMPP:
+    """Ejecuta la sonda periódicamente y guarda la última muestra y un historial"""
+
+    def __init__(self, intervalo=30, timeout=5.0, tamano_historial=120):
+        self.intervalo = intervalo
+        self.timeout = timeout
+        self._historial = deque(maxlen=tamano_historial)
+        self._ultima = None
+        self._candado = threading.Lock()
+        self._pid = None
+        self._hilo = None
+
+    def estado(self):
+        """Última muestra en caché (nunca bloquea en la red)"""
+        self._asegurar_hilo()
+        with self._candado:
+            if self._ultima is None:
+                return {'estado': 'desconocido', 'conectado': False, 'servidor': XMPP_HOST,
+                        'puerto': XMPP_PORT, 'version': None, 'usuarios_conectados': None,
+                        'mensajes_hoy': None, 'mensajes_por_minuto': None, 'latencia_ms': {},
+                        'error': 'Sin muestras todavía', 'fecha': None}
+            return dict(self._ultima)
+
+    def historial(self):
+        """Muestras recientes, de la más antigua a la más nueva"""
+        with self._candado:
+            return list(self._historial)
+
+    def muestrear(self):
+        """Toma una muestra ahora (se ejecuta en el hilo del monitor)"""
+        muestra = {'servidor': XMPP_HOST, 'puerto': XMPP_PORT, 'fecha': datetime.now().isoformat(),
+                   'version': None, 'usuarios_conectados': None, 'latencia_ms': {}, 'error': None}
+        try:
+            resultado = asyncio.run(sondear_xmpp(
+                XMPP_HOST, XMPP_PORT, XMPP_DOMAIN, XMPP_USER, XMPP_PASSWORD,
+                timeout=self.timeout, verificar_tls=XMPP_TLS_VERIFY))
+            muestra.update(resultado)
+            muestra['estado'] = ESTADO_OK
+            if XMPP_USER and not resultado['autenticado']:
+                muestra['estado'] = ESTADO_DEGRADADO
+        except ErrorSonda as e:
+            # El servidor responde pero alguna etapa falla
+            muestra['estado'] = ESTADO_DEGRADADO
+            muestra['error'] = str(e)
+        except (OSError, asyncio.TimeoutError, ssl.SSLError) as e:
+            muestra['estado'] = ESTADO_CAIDO
+            muestra['error'] = str(e) or e.__class__.__name__
+        muestra['conectado'] = muestra['estado'] != ESTADO_CAIDO
+        muestra.pop('autenticado', None)
+
+        muestra['mensajes_hoy'], muestra['mensajes_por_minuto'] = contar_mensajes_recientes()
+
+        with self._candado:
+            self._ultima = muestra
+            self._historial.append(muestra)
+        return muestra
+
+    def _asegurar_hilo(self):
+        if self._pid == os.getpid() and self._hilo is not None:
+            return
+        with self._candado:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="monitor-xmpp", daemon=True)
+            self._pid = os.getpid()
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            inicio = time.monotonic()
+            try:
+                self.muestrear()
+            except Exception as e:
+                logger.error("Error en la sonda XMPP: %s", e)
+            time.sleep(max(1.0, self.intervalo - (time.monotonic() - inicio)))
+
+
+monitor_xmpp = MonitorXMPP(
+    intervalo=XMPP_PROBE_INTERVAL,
+    timeout=XMPP_PROBE_TIMEOUT,
+    tamano_historial=XMPP_HISTORY
+)